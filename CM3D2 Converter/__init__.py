@@ -18,7 +18,13 @@ bl_info = {
 if "bpy" in locals():
 	import imp
 	
+	imp.reload(binaryio)
+	imp.reload(texindex)
+	imp.reload(texcache)
 	imp.reload(common)
+	imp.reload(modelfile)
+	imp.reload(anmfile)
+	imp.reload(poseeval)
 	
 	imp.reload(model_import)
 	imp.reload(model_export)
@@ -54,7 +60,13 @@ if "bpy" in locals():
 	imp.reload(misc_VIEW3D_MT_edit_mesh_specials)
 
 else:
+	from . import binaryio
+	from . import texindex
+	from . import texcache
 	from . import common
+	from . import modelfile
+	from . import anmfile
+	from . import poseeval
 	
 	from . import model_import
 	from . import model_export
@@ -100,6 +112,7 @@ class AddonPreferences(bpy.types.AddonPreferences):
 	
 	scale = bpy.props.FloatProperty(name="倍率", description="Blenderでモデルを扱うときの拡大率", default=5, min=0.01, max=100, soft_min=0.01, soft_max=100, step=10, precision=2)
 	is_convert_bone_weight_names = bpy.props.BoolProperty(name="基本的にボーン名/ウェイト名をBlender用に変換", default=False, description="modelインポート時にボーン名/ウェイト名を変換するかどうかのオプションのデフォルトを設定します")
+	is_bone_data_array = bpy.props.BoolProperty(name="基本的にボーン情報を配列で保存", default=False, description="modelインポート時にカスタムプロパティのボーン情報を配列で保存するか、エクスポート時に文字列のボーン情報を配列に変換するかのデフォルトを設定します")
 	model_default_path = bpy.props.StringProperty(name="modelファイル置き場", subtype='DIR_PATH', description="設定すれば、modelを扱う時は必ずここからファイル選択を始めます")
 	model_import_path = bpy.props.StringProperty(name="modelインポート時のデフォルトパス", subtype='FILE_PATH', description="modelインポート時に最初はここが表示されます、インポート毎に保存されます")
 	model_export_path = bpy.props.StringProperty(name="modelエクスポート時のデフォルトパス", subtype='FILE_PATH', description="modelエクスポート時に最初はここが表示されます、エクスポート毎に保存されます")
@@ -122,6 +135,10 @@ class AddonPreferences(bpy.types.AddonPreferences):
 	default_tex_path1 = bpy.props.StringProperty(name="texファイル置き場", subtype='DIR_PATH', description="texファイルを探す時はここから探します")
 	default_tex_path2 = bpy.props.StringProperty(name="texファイル置き場", subtype='DIR_PATH', description="texファイルを探す時はここから探します")
 	default_tex_path3 = bpy.props.StringProperty(name="texファイル置き場", subtype='DIR_PATH', description="texファイルを探す時はここから探します")
+	png_cache_size = bpy.props.IntProperty(name="PNGキャッシュの上限 (MB)", default=512, min=1, max=65536, soft_min=16, soft_max=4096, description="texファイルから取り出したPNGのキャッシュがこのサイズを超えると古いものから削除します")
+	
+	is_profile_phases = bpy.props.BoolProperty(name="処理時間を段階毎に記録", default=False, description="インポート/エクスポート等の処理時間を段階毎に計測してコンソールに出力します")
+	profile_path = bpy.props.StringProperty(name="記録の出力先", subtype='FILE_PATH', description="処理時間の記録を追記するファイル (.json か .csv)、空欄ならコンソールにだけ出力します")
 	
 	
 	new_mate_tex_color = bpy.props.FloatVectorProperty(name="テクスチャ設定値の色", default=(0, 0, 1, 1), min=0, max=1, soft_min=0, soft_max=1, step=10, precision=2, subtype='COLOR', size=4)
@@ -154,6 +171,7 @@ class AddonPreferences(bpy.types.AddonPreferences):
 		row = box.row()
 		row.prop(self, 'scale', icon='MAN_SCALE')
 		row.prop(self, 'is_convert_bone_weight_names', icon='BLENDER')
+		box.prop(self, 'is_bone_data_array', icon='LINENUMBERS_ON')
 		box.prop(self, 'model_default_path', icon='FILESEL', text="ファイル選択時の初期フォルダ")
 		
 		box = self.layout.box()
@@ -176,6 +194,14 @@ class AddonPreferences(bpy.types.AddonPreferences):
 		box.prop(self, 'default_tex_path1', icon='LAYER_ACTIVE', text="その2")
 		box.prop(self, 'default_tex_path2', icon='LAYER_ACTIVE', text="その3")
 		box.prop(self, 'default_tex_path3', icon='LAYER_ACTIVE', text="その4")
+		row = box.row()
+		row.prop(self, 'png_cache_size', icon='IMAGE_DATA')
+		row.operator('image.clear_cm3d2_png_cache', icon='X')
+		
+		box = self.layout.box()
+		box.label(text="処理時間の計測", icon='TIME')
+		box.prop(self, 'is_profile_phases', icon='SORTTIME')
+		box.prop(self, 'profile_path', icon='FILESEL')
 		
 		box = self.layout.box()
 		box.label(text="CM3D2用マテリアル新規作成時の初期値", icon='MATERIAL')
@@ -217,6 +243,7 @@ def register():
 	bpy.types.IMAGE_MT_image.append(tex_export.menu_func)
 	
 	bpy.types.TEXT_MT_text.append(mate_import.TEXT_MT_text)
+	bpy.types.TEXT_MT_text.append(model_import.TEXT_MT_text)
 	bpy.types.TEXT_MT_text.append(mate_export.TEXT_MT_text)
 	
 	bpy.types.DATA_PT_context_arm.append(misc_DATA_PT_context_arm.menu_func)
@@ -240,6 +267,8 @@ def register():
 	bpy.types.INFO_HT_header.append(misc_INFO_HT_header.menu_func)
 	bpy.types.VIEW3D_MT_edit_mesh_specials.append(misc_VIEW3D_MT_edit_mesh_specials.menu_func)
 	
+	bpy.app.handlers.load_post.append(common.restore_cached_tex_images)
+	
 	pcoll = bpy.utils.previews.new()
 	dir = os.path.dirname(__file__)
 	pcoll.load('KISS', os.path.join(dir, "kiss.png"), 'IMAGE')
@@ -276,6 +305,7 @@ def unregister():
 	bpy.types.IMAGE_MT_image.remove(tex_export.menu_func)
 	
 	bpy.types.TEXT_MT_text.remove(mate_import.TEXT_MT_text)
+	bpy.types.TEXT_MT_text.remove(model_import.TEXT_MT_text)
 	bpy.types.TEXT_MT_text.remove(mate_export.TEXT_MT_text)
 	
 	bpy.types.DATA_PT_context_arm.remove(misc_DATA_PT_context_arm.menu_func)
@@ -299,6 +329,9 @@ def unregister():
 	bpy.types.INFO_HT_header.remove(misc_INFO_HT_header.menu_func)
 	bpy.types.VIEW3D_MT_edit_mesh_specials.remove(misc_VIEW3D_MT_edit_mesh_specials.menu_func)
 	
+	if common.restore_cached_tex_images in bpy.app.handlers.load_post:
+		bpy.app.handlers.load_post.remove(common.restore_cached_tex_images)
+	
 	for pcoll in common.preview_collections.values():
 		bpy.utils.previews.remove(pcoll)
 	common.preview_collections.clear()
@@ -1,6 +1,9 @@
 import bpy, mathutils
-import struct, re, math, unicodedata
+import os, re, math, numpy, unicodedata
 from . import common
+from . import binaryio
+from . import anmfile
+from . import poseeval
 
 # メインオペレーター
 class export_cm3d2_anm(bpy.types.Operator):
@@ -23,6 +26,10 @@ class export_cm3d2_anm(bpy.types.Operator):
 	time_scale = bpy.props.FloatProperty(name="再生速度", default=1.0, min=0.1, max=10.0, soft_min=0.1, soft_max=10.0, step=10, precision=1)
 	is_keyframe_clean = bpy.props.BoolProperty(name="同じ変形のキーフレームを掃除", default=True)
 	is_smooth_handle = bpy.props.BoolProperty(name="キーフレーム間の変形をスムーズに", default=True)
+	is_keyframe_reduce = bpy.props.BoolProperty(name="誤差の範囲でキーフレームを間引く", default=False, description="補間した結果が許容誤差に収まる範囲でキーフレームを削除します")
+	reduce_location_tolerance = bpy.props.FloatProperty(name="位置の許容誤差", default=0.0001, min=0.0, max=1.0, soft_min=0.0, soft_max=0.01, step=1, precision=5)
+	reduce_rotation_tolerance = bpy.props.FloatProperty(name="回転の許容誤差", default=math.radians(0.1), min=0.0, max=math.radians(10), soft_min=0.0, soft_max=math.radians(1), step=1, precision=3, subtype='ANGLE')
+	is_direct_evaluate = bpy.props.BoolProperty(name="Fカーブを直接評価", default=True, description="シーンを更新せずにFカーブからボーンの姿勢を計算します (コンストレイントやドライバーがある場合は従来通りシーンを更新します)")
 	
 	is_remove_alone_bone = bpy.props.BoolProperty(name="親も子も存在しない", default=True)
 	is_remove_ik_bone = bpy.props.BoolProperty(name="名前がIK/Nubっぽい", default=True)
@@ -66,6 +73,12 @@ class export_cm3d2_anm(bpy.types.Operator):
 		sub_box.prop(self, 'time_scale')
 		sub_box.prop(self, 'is_keyframe_clean', icon='DISCLOSURE_TRI_DOWN')
 		sub_box.prop(self, 'is_smooth_handle', icon='SMOOTHCURVE')
+		sub_box.prop(self, 'is_keyframe_reduce', icon='IPO_EASE_IN_OUT')
+		column = sub_box.column(align=True)
+		column.prop(self, 'reduce_location_tolerance', icon='MAN_TRANS')
+		column.prop(self, 'reduce_rotation_tolerance', icon='MAN_ROT')
+		column.enabled = self.is_keyframe_reduce
+		sub_box.prop(self, 'is_direct_evaluate', icon='IPO')
 		
 		sub_box = box.box()
 		sub_box.label("除外するボーン", icon='X')
@@ -77,6 +90,7 @@ class export_cm3d2_anm(bpy.types.Operator):
 	
 	def execute(self, context):
 		common.preferences().anm_export_path = self.filepath
+		timer = common.PhaseTimer("export_cm3d2_anm")
 		
 		try:
 			file = common.open_temporary(self.filepath, 'wb', is_backup=self.is_backup)
@@ -86,21 +100,27 @@ class export_cm3d2_anm(bpy.types.Operator):
 		
 		try:
 			with file:
-				self.write_animation(context, file)
+				removed_count = self.write_animation(context, file, timer)
 		except common.CM3D2ExportException as e:
 			self.report(type={'ERROR'}, message=str(e))
 			return {'CANCELLED'}
 		
+		timer.finish()
+		if self.is_keyframe_reduce:
+			self.report(type={'INFO'}, message="キーフレームを%d個削減しました (ファイルサイズ %.1fKB)" % (removed_count, os.path.getsize(self.filepath) / 1024))
 		return {'FINISHED'}
 		
-	def write_animation(self, context, file):
+	def write_animation(self, context, file, timer=None):
+		if timer is None:
+			timer = common.PhaseTimer("write_animation")
+		writer = binaryio.BinaryWriter(file)
 		ob = context.active_object
 		arm = ob.data
 		pose = ob.pose
 		fps = context.scene.render.fps
 		
-		common.write_str(file, 'CM3D2_ANIM')
-		file.write(struct.pack('<i', self.version))
+		writer.write_str('CM3D2_ANIM')
+		writer.write_int(self.version)
 		
 		def is_japanese(string):
 			for ch in string:
@@ -149,13 +169,22 @@ class export_cm3d2_anm(bpy.types.Operator):
 		same_locs = {}
 		same_rots = {}
 		pre_rots = {}
+		frames = []
 		for key_frame_index in range(self.key_frame_count):
 			if self.key_frame_count == 1:
-				frame = 0.0
+				frames.append(0.0)
 			else:
-				frame = (self.frame_end - self.frame_start) / (self.key_frame_count - 1) * key_frame_index + self.frame_start
-			context.scene.frame_set(int(frame), frame - int(frame))
-			context.scene.update()
+				frames.append((self.frame_end - self.frame_start) / (self.key_frame_count - 1) * key_frame_index + self.frame_start)
+		
+		# 可能ならシーンを更新せずにFカーブから全フレームの姿勢をまとめて計算
+		pose_matrices = None
+		if self.is_direct_evaluate and can_evaluate_directly(ob):
+			pose_matrices = evaluate_pose_matrices(ob, frames)
+		
+		for key_frame_index, frame in enumerate(frames):
+			if pose_matrices is None:
+				context.scene.frame_set(int(frame), frame - int(frame))
+				context.scene.update()
 			
 			time = frame / fps * (1.0 / self.time_scale)
 			
@@ -167,10 +196,13 @@ class export_cm3d2_anm(bpy.types.Operator):
 				
 				pose_bone = pose.bones[bone.name]
 				
-				pose_mat = ob.convert_space(pose_bone, pose_bone.matrix, 'POSE', 'WORLD')
-				if bone.parent:
-					parent_mat = ob.convert_space(pose_bone.parent, pose_bone.parent.matrix, 'POSE', 'WORLD')
-					pose_mat = parent_mat.inverted() * pose_mat
+				if pose_matrices is not None:
+					pose_mat = mathutils.Matrix(pose_matrices[bone.name][key_frame_index].tolist())
+				else:
+					pose_mat = ob.convert_space(pose_bone, pose_bone.matrix, 'POSE', 'WORLD')
+					if bone.parent:
+						parent_mat = ob.convert_space(pose_bone.parent, pose_bone.parent.matrix, 'POSE', 'WORLD')
+						pose_mat = parent_mat.inverted() * pose_mat
 				
 				loc = pose_mat.to_translation() * self.scale
 				rot = pose_mat.to_quaternion()
@@ -221,22 +253,14 @@ class export_cm3d2_anm(bpy.types.Operator):
 					else:
 						same_rots[bone.name].append(KeyFrame(time, rot.copy()))
 		
-		anm_data = {}
-		for bone_name, channels in anm_data_raw.items():
-			anm_data[bone_name] = {100:{}, 101:{}, 102:{}, 103:{}, 104:{}, 105:{}, 106:{}}
-			for time, loc in channels["LOC"].items():
-				anm_data[bone_name][104][time] = loc.x
-				anm_data[bone_name][105][time] = loc.y
-				anm_data[bone_name][106][time] = loc.z
-			for time, rot in channels["ROT"].items():
-				anm_data[bone_name][100][time] = rot.x
-				anm_data[bone_name][101][time] = rot.y
-				anm_data[bone_name][102][time] = rot.z
-				anm_data[bone_name][103][time] = rot.w
+		timer.phase("evaluate", bones=len(bones), frames=len(frames))
+		
+		reduce_tolerances = None
+		if self.is_keyframe_reduce:
+			reduce_tolerances = anmfile.channel_tolerances(self.reduce_location_tolerance, self.reduce_rotation_tolerance)
+		removed_count = 0
 		
 		for bone in bones:
-			file.write(struct.pack('<?', True))
-			
 			bone_names = [bone.name]
 			current_bone = bone
 			while current_bone.parent:
@@ -244,53 +268,121 @@ class export_cm3d2_anm(bpy.types.Operator):
 				current_bone = current_bone.parent
 			
 			bone_names.reverse()
-			common.write_str(file, "/".join(bone_names))
 			
-			for channel_id, keyframes in sorted(anm_data[bone.name].items(), key=lambda x: x[0]):
-				file.write(struct.pack('<B', channel_id))
-				file.write(struct.pack('<i', len(keyframes)))
-				
-				keyframes_list = sorted(keyframes.items(), key=lambda x: x[0])
-				for i in range(len(keyframes_list)):
-					x = keyframes_list[i][0]
-					y = keyframes_list[i][1]
-					
-					if len(keyframes_list) <= 1:
-						file.write(struct.pack('<f', x))
-						file.write(struct.pack('<f', y))
-						file.write(struct.pack('<2f', 0.0, 0.0))
-						continue
-					
-					if i == 0:
-						prev_x = x - (keyframes_list[i+1][0] - x)
-						prev_y = y - (keyframes_list[i+1][1] - y)
-						next_x = keyframes_list[i+1][0]
-						next_y = keyframes_list[i+1][1]
-					elif i == len(keyframes_list) - 1:
-						prev_x = keyframes_list[i-1][0]
-						prev_y = keyframes_list[i-1][1]
-						next_x = x + (x - keyframes_list[i-1][0])
-						next_y = y + (y - keyframes_list[i-1][1])
-					else:
-						prev_x = keyframes_list[i-1][0]
-						prev_y = keyframes_list[i-1][1]
-						next_x = keyframes_list[i+1][0]
-						next_y = keyframes_list[i+1][1]
-					
-					prev_rad = (prev_y - y) / (prev_x - x)
-					next_rad = (next_y - y) / (next_x - x)
-					join_rad = (prev_rad + next_rad) / 2
-					
-					file.write(struct.pack('<f', x))
-					file.write(struct.pack('<f', y))
-					
-					if self.is_smooth_handle:
-						file.write(struct.pack('<2f', join_rad, join_rad))
-						#file.write(struct.pack('<2f', prev_rad, next_rad))
-					else:
-						file.write(struct.pack('<2f', 0.0, 0.0))
+			locs = anm_data_raw[bone.name]["LOC"]
+			rots = anm_data_raw[bone.name]["ROT"]
+			loc_times = sorted(locs.keys())
+			rot_times = sorted(rots.keys())
+			loc_values = numpy.array([locs[time][:] for time in loc_times]).reshape(-1, 3)
+			rot_values = numpy.array([(rots[time].x, rots[time].y, rots[time].z, rots[time].w) for time in rot_times]).reshape(-1, 4)
+			
+			channels = []
+			for index, channel_id in enumerate(anmfile.ROTATION_CHANNELS):
+				channels.append((channel_id, rot_times, rot_values[:, index]))
+			for index, channel_id in enumerate(anmfile.LOCATION_CHANNELS):
+				channels.append((channel_id, loc_times, loc_values[:, index]))
+			
+			removed_count += anmfile.write_track(writer, "/".join(bone_names), channels, reduce_tolerances, self.is_smooth_handle)
 		
-		file.write(struct.pack('<?', False))
+		writer.write_bool(False)
+		timer.phase("write", bones=len(bones), removed_keyframes=removed_count)
+		return removed_count
+
+# シーンを更新せずにFカーブだけでポーズを計算できるか判定
+def can_evaluate_directly(ob):
+	if ob.parent or len(ob.constraints):
+		return False
+	for data in (ob, ob.data):
+		anim = data.animation_data
+		if not anim:
+			continue
+		if len(anim.drivers):
+			return False
+		for track in anim.nla_tracks:
+			if not track.mute:
+				return False
+	anim = ob.animation_data
+	if anim and anim.action:
+		for fcurve in anim.action.fcurves:
+			if not fcurve.data_path.startswith('pose.bones['):
+				return False
+	for bone in ob.data.bones:
+		if not bone.use_inherit_rotation or not bone.use_inherit_scale or not bone.use_local_location:
+			return False
+	for pose_bone in ob.pose.bones:
+		if len(pose_bone.constraints) or pose_bone.rotation_mode == 'AXIS_ANGLE':
+			return False
+	return True
+
+# Fカーブを直接評価して、全フレーム分の親ボーンからの相対行列をボーン名毎に返す
+def evaluate_pose_matrices(ob, frames):
+	arm = ob.data
+	pose = ob.pose
+	frame_count = len(frames)
+	bone_names = [bone.name for bone in arm.bones]
+	
+	# Fカーブが無いチャンネルは現在の値のまま
+	channels = {}
+	for pose_bone in pose.bones:
+		channels[pose_bone.name] = {
+			'location': numpy.tile(numpy.array(pose_bone.location), (frame_count, 1)),
+			'rotation_quaternion': numpy.tile(numpy.array(pose_bone.rotation_quaternion), (frame_count, 1)),
+			'rotation_euler': numpy.tile(numpy.array(pose_bone.rotation_euler), (frame_count, 1)),
+			'scale': numpy.tile(numpy.array(pose_bone.scale), (frame_count, 1)),
+			}
+	
+	anim = ob.animation_data
+	if anim and anim.action:
+		for fcurve in anim.action.fcurves:
+			if fcurve.mute:
+				continue
+			match = re.match(r'pose\.bones\["(.+)"\]\.(location|rotation_quaternion|rotation_euler|scale)$', fcurve.data_path)
+			if not match:
+				continue
+			bone_name = match.group(1).replace('\\"', '"').replace('\\\\', '\\')
+			if bone_name not in channels:
+				continue
+			if len(fcurve.modifiers):
+				return None
+			points = fcurve.keyframe_points
+			try:
+				interpolations = [poseeval.INTERPOLATION_TYPES[point.interpolation] for point in points]
+			except KeyError:
+				return None
+			if not interpolations:
+				continue
+			co = numpy.empty(len(points) * 2)
+			handle_left = numpy.empty(len(points) * 2)
+			handle_right = numpy.empty(len(points) * 2)
+			points.foreach_get('co', co)
+			points.foreach_get('handle_left', handle_left)
+			points.foreach_get('handle_right', handle_right)
+			channels[bone_name][match.group(2)][:, fcurve.array_index] = poseeval.evaluate_fcurve(frames, co, handle_left, handle_right, interpolations, fcurve.extrapolation)
+	
+	basis_matrices = numpy.empty((frame_count, len(bone_names), 4, 4))
+	for index, bone_name in enumerate(bone_names):
+		pose_bone = pose.bones[bone_name]
+		channel = channels[bone_name]
+		if pose_bone.rotation_mode == 'QUATERNION':
+			rotations = poseeval.quaternion_to_matrix(channel['rotation_quaternion'])
+		else:
+			rotations = poseeval.euler_to_matrix(channel['rotation_euler'], pose_bone.rotation_mode)
+		basis_matrices[:, index] = poseeval.compose_matrices(channel['location'], rotations, channel['scale'])
+	
+	parents = [bone_names.index(bone.parent.name) if bone.parent else -1 for bone in arm.bones]
+	rest_matrices = [numpy.array(bone.matrix_local) for bone in arm.bones]
+	pose_mats = poseeval.forward_kinematics(parents, rest_matrices, basis_matrices)
+	relative_mats = poseeval.parent_relative_matrices(parents, pose_mats)
+	
+	# 親の無いボーンはワールド空間に
+	world_mat = numpy.array(ob.matrix_world)
+	result = {}
+	for index, bone_name in enumerate(bone_names):
+		if parents[index] < 0:
+			result[bone_name] = numpy.einsum('ij,...jk->...ik', world_mat, relative_mats[:, index])
+		else:
+			result[bone_name] = relative_mats[:, index]
+	return result
 
 # メニューに登録する関数
 def menu_func(self, context):
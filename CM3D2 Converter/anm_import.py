@@ -1,5 +1,7 @@
-import os, re, bpy, math, struct, os.path, mathutils
+import os, re, bpy, math, numpy, os.path, mathutils
 from . import common
+from . import binaryio
+from . import anmfile
 
 # メインオペレーター
 class import_cm3d2_anm(bpy.types.Operator):
@@ -22,6 +24,8 @@ class import_cm3d2_anm(bpy.types.Operator):
 	is_rotation = bpy.props.BoolProperty(name="回転", default=True)
 	is_scale = bpy.props.BoolProperty(name="拡縮", default=False)
 	
+	use_tangent = bpy.props.BoolProperty(name="タンジェントをハンドルに適用", default=True, description="ファイルに保存されている接線の傾きをキーフレームのハンドルとして読み込みます")
+	
 	
 	@classmethod
 	def poll(cls, context):
@@ -46,6 +50,7 @@ class import_cm3d2_anm(bpy.types.Operator):
 		box.prop(self, 'remove_pre_animation', icon='DISCLOSURE_TRI_DOWN')
 		box.prop(self, 'set_frame', icon='NEXT_KEYFRAME')
 		box.prop(self, 'ignore_automatic_bone', icon='X')
+		box.prop(self, 'use_tangent', icon='IPO_BEZIER')
 		box = self.layout.box()
 		box.label("読み込むアニメーション情報")
 		column = box.column(align=True)
@@ -57,47 +62,22 @@ class import_cm3d2_anm(bpy.types.Operator):
 	
 	def execute(self, context):
 		common.preferences().anm_import_path = self.filepath
+		timer = common.PhaseTimer("import_cm3d2_anm")
 		
 		try:
-			file = open(self.filepath, 'rb')
+			reader = binaryio.open_reader(self.filepath)
 		except:
 			self.report(type={'ERROR'}, message="ファイルを開くのに失敗しました、アクセス不可かファイルが存在しません")
 			return {'CANCELLED'}
 		
-		# ヘッダー
-		ext = common.read_str(file)
-		if ext != 'CM3D2_ANIM':
-			self.report(type={'ERROR'}, message="これはカスタムメイド3D2のモーションファイルではありません")
+		try:
+			with reader:
+				anm = anmfile.read_anm(reader)
+		except anmfile.CM3D2ImportException as e:
+			self.report(type={'ERROR'}, message=str(e))
 			return {'CANCELLED'}
-		struct.unpack('<i', file.read(4))[0]
-		
-		global_flag = struct.unpack('<?', file.read(1))[0]
-		
-		anm_data = {}
-		
-		for anm_data_index in range(9**9):
-			path = common.read_str(file)
-			
-			base_bone_name = path.split('/')[-1]
-			if base_bone_name not in anm_data:
-				anm_data[base_bone_name] = {'path':path}
-				anm_data[base_bone_name]['channels'] = {}
-			
-			for channel_index in range(9**9):
-				channel_id = struct.unpack('<B', file.read(1))[0]
-				channel_id_str = channel_id
-				if channel_id <= 1:
-					break
-				anm_data[base_bone_name]['channels'][channel_id_str] = []
-				channel_data_count = struct.unpack('<i', file.read(4))[0]
-				for channel_data_index in range(channel_data_count):
-					frame = struct.unpack('<f', file.read(4))[0]
-					data = struct.unpack('<3f', file.read(4*3))
-					
-					anm_data[base_bone_name]['channels'][channel_id_str].append({'frame':frame, 'f0':data[0], 'f1':data[1], 'f2':data[2]})
-			
-			if channel_id == 0:
-				break
+		anm_data = anm.bone_tracks()
+		timer.phase("read", bones=len(anm_data))
 		
 		fps = context.scene.render.fps
 		
@@ -112,7 +92,21 @@ class import_cm3d2_anm(bpy.types.Operator):
 					for fcurve in anim.action.fcurves:
 						anim.action.fcurves.remove(fcurve)
 		
+		anim = ob.animation_data
+		if not anim:
+			anim = ob.animation_data_create()
+		if not anim.action:
+			anim.action = context.blend_data.actions.new(ob.name + "Action")
+		action = anim.action
+		
+		# CM3D2 → Blender の軸変換 (位置は x, y, z / 回転は w, x, y, z の並び)
+		loc_swap_parent = numpy.array([[0, -1, 0], [-1, 0, 0], [0, 0, 1]], dtype=numpy.float32)
+		loc_swap_root = numpy.array([[1, 0, 0], [0, 0, 1], [0, 1, 0]], dtype=numpy.float32)
+		quat_swap = numpy.array([[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, -1]], dtype=numpy.float32)
+		fix_quat = mathutils.Euler((math.radians(90), math.radians(90), 0.0), 'XYZ').to_quaternion()
+		
 		max_frame = 0
+		bone_count = 0
 		bpy.ops.object.mode_set(mode='OBJECT')
 		for bone_name, bone_data in anm_data.items():
 			
@@ -126,88 +120,112 @@ class import_cm3d2_anm(bpy.types.Operator):
 				if bone_name not in pose.bones:
 					continue
 			bone = arm.bones[bone_name]
-			pose_bone = pose.bones[bone_name]
-			
-			locs = {}
-			quats = {}
-			for channel_id, channel_data in bone_data['channels'].items():
-				
-				if channel_id in [100, 101, 102, 103]:
-					for data in channel_data:
-						frame = data['frame']
-						if frame not in quats:
-							quats[frame] = [None, None, None, None]
-						
-						if channel_id == 103:
-							quats[frame][0] = data['f0']
-						elif channel_id == 100:
-							quats[frame][1] = data['f0']
-						elif channel_id == 101:
-							quats[frame][2] = data['f0']
-						elif channel_id == 102:
-							quats[frame][3] = data['f0']
-				
-				elif channel_id in [104, 105, 106]:
-					for data in channel_data:
-						frame = data['frame']
-						if frame not in locs:
-							locs[frame] = [None, None, None]
-						
-						if channel_id == 104:
-							locs[frame][0] = data['f0']
-						elif channel_id == 105:
-							locs[frame][1] = data['f0']
-						elif channel_id == 106:
-							locs[frame][2] = data['f0']
+			bone_count += 1
+			data_path_prefix = 'pose.bones["%s"].' % bpy.utils.escape_identifier(bone_name)
 			
+			# 位置/回転とも元の値に対する一次変換なので、値とタンジェントを行列でまとめて変換する
 			if self.is_location:
-				for frame, loc in locs.items():
-					loc = mathutils.Vector(loc) * self.scale
-					bone_loc = bone.head_local.copy()
-					
-					if bone.parent:
-						loc.x, loc.y, loc.z = -loc.y, -loc.x, loc.z
-						
-						bone_loc = bone_loc - bone.parent.head_local
-						bone_loc.rotate(bone.parent.matrix_local.to_quaternion().inverted())
-					else:
-						loc.x, loc.y, loc.z = loc.x, loc.z, loc.y
-					
-					result_loc = loc - bone_loc
-					pose_bone.location = result_loc.copy()
-					
-					pose_bone.keyframe_insert('location', frame=frame * fps)
-					if max_frame < frame * fps:
-						max_frame = frame * fps
+				times, locs, in_tangents, out_tangents = anmfile.merge_locations(bone_data['channels'], True)
+				bone_loc = bone.head_local.copy()
+				if bone.parent:
+					matrix = loc_swap_parent * self.scale
+					bone_loc = bone_loc - bone.parent.head_local
+					bone_loc.rotate(bone.parent.matrix_local.to_quaternion().inverted())
+				else:
+					matrix = loc_swap_root * self.scale
+				
+				frames = times * fps
+				values = locs.dot(matrix.T) - numpy.array(bone_loc, dtype=numpy.float32)
+				for index in range(3):
+					set_fcurve_keyframes(action, data_path_prefix + 'location', index, bone_name, frames, values[:, index],
+						in_tangents.dot(matrix[index]) / fps, out_tangents.dot(matrix[index]) / fps, self.use_tangent)
+				if len(frames) and max_frame < frames.max():
+					max_frame = float(frames.max())
 			
 			if self.is_rotation:
-				for frame, quat in quats.items():
-					quat = mathutils.Quaternion(quat)
-					bone_quat = bone.matrix.to_quaternion()
-					
-					if bone.parent:
-						quat.w, quat.x, quat.y, quat.z = quat.w, quat.y, quat.x, -quat.z
-					else:
-						quat.w, quat.x, quat.y, quat.z = quat.w, quat.y, quat.x, -quat.z
-						
-						fix_quat = mathutils.Euler((math.radians(90), math.radians(90), 0.0), 'XYZ').to_quaternion()
-						fix_quat2 = mathutils.Euler((0.0, math.radians(-90), 0.0), 'XYZ').to_quaternion()
-						quat = fix_quat * quat
-					
-					result_quat = bone_quat.inverted() * quat
-					pose_bone.rotation_quaternion = result_quat.copy()
-					
-					pose_bone.keyframe_insert('rotation_quaternion', frame=frame * fps)
-					if max_frame < frame * fps:
-						max_frame = frame * fps
+				times, quats, in_tangents, out_tangents = anmfile.merge_rotations(bone_data['channels'], True)
+				quat = bone.matrix.to_quaternion().inverted()
+				if not bone.parent:
+					quat = quat * fix_quat
+				matrix = quaternion_left_matrix(quat).dot(quat_swap)
+				
+				frames = times * fps
+				values = quats.dot(matrix.T)
+				for index in range(4):
+					set_fcurve_keyframes(action, data_path_prefix + 'rotation_quaternion', index, bone_name, frames, values[:, index],
+						in_tangents.dot(matrix[index]) / fps, out_tangents.dot(matrix[index]) / fps, self.use_tangent)
+				if len(frames) and max_frame < frames.max():
+					max_frame = float(frames.max())
+		timer.phase("keyframes", bones=bone_count, frames=int(max_frame))
 		
 		if self.set_frame:
 			context.scene.frame_start = 0
 			context.scene.frame_end = max_frame
 			context.scene.frame_set(0)
 		
+		timer.finish()
 		return {'FINISHED'}
 
+# クォータニオン q に対して p * q を計算する行列 (w, x, y, z の並び)
+def quaternion_left_matrix(p):
+	return numpy.array([
+		[p.w, -p.x, -p.y, -p.z],
+		[p.x, p.w, -p.z, p.y],
+		[p.y, p.z, p.w, -p.x],
+		[p.z, -p.y, p.x, p.w],
+		], dtype=numpy.float32)
+
+# キーフレームをまとめて fcurve に追加 (タンジェントは1フレームあたりの傾き)
+def set_fcurve_keyframes(action, data_path, index, group, frames, values, in_tangents, out_tangents, use_tangent=True):
+	count = len(frames)
+	if not count:
+		return
+	fcurve = action.fcurves.find(data_path, index)
+	if not fcurve:
+		fcurve = action.fcurves.new(data_path, index, group)
+	points = fcurve.keyframe_points
+	
+	# 読み込むフレームと同じフレームにある既存のキーは keyframe_insert と同じく置き換える
+	if len(points):
+		pre_frames = numpy.empty(len(points) * 2, dtype=numpy.float32)
+		points.foreach_get('co', pre_frames)
+		pre_frames = pre_frames[0::2]
+		nearest = numpy.clip(numpy.searchsorted(frames, pre_frames), 1, max(count - 1, 1))
+		distances = numpy.minimum(numpy.abs(frames[nearest - 1] - pre_frames), numpy.abs(frames[numpy.minimum(nearest, count - 1)] - pre_frames))
+		for point_index in reversed(numpy.flatnonzero(distances < 0.01).tolist()):
+			points.remove(points[point_index], fast=True)
+	
+	pre_count = len(points)
+	pre_co = numpy.empty(pre_count * 2, dtype=numpy.float32)
+	pre_left = numpy.empty(pre_count * 2, dtype=numpy.float32)
+	pre_right = numpy.empty(pre_count * 2, dtype=numpy.float32)
+	points.foreach_get('co', pre_co)
+	points.foreach_get('handle_left', pre_left)
+	points.foreach_get('handle_right', pre_right)
+	points.add(count)
+	
+	# ハンドルの長さは隣のキーまでの 1/3
+	if 2 <= count:
+		spans = numpy.diff(frames)
+		left_spans = numpy.concatenate((spans[:1], spans)) / 3
+		right_spans = numpy.concatenate((spans, spans[-1:])) / 3
+	else:
+		left_spans = right_spans = numpy.ones(1, dtype=numpy.float32) / 3
+	
+	co = numpy.column_stack((frames, values))
+	left = numpy.column_stack((frames - left_spans, values - in_tangents * left_spans))
+	right = numpy.column_stack((frames + right_spans, values + out_tangents * right_spans))
+	
+	if use_tangent:
+		for point in points[pre_count:]:
+			point.handle_left_type = 'FREE'
+			point.handle_right_type = 'FREE'
+	
+	points.foreach_set('co', numpy.concatenate((pre_co, co.ravel())))
+	points.foreach_set('handle_left', numpy.concatenate((pre_left, left.ravel())))
+	points.foreach_set('handle_right', numpy.concatenate((pre_right, right.ravel())))
+	fcurve.update()
+
 # メニューに登録する関数
 def menu_func(self, context):
 	self.layout.operator(import_cm3d2_anm.bl_idname, icon_value=common.preview_collections['main']['KISS'].icon_id)
@@ -0,0 +1,243 @@
+# .anm ファイルの読み書き (bpy非依存)
+import math
+import collections
+import numpy
+from . import binaryio
+from .binaryio import CM3D2ImportException, as_reader
+
+# キーフレームの並び (時間, 値, 入力側タンジェント, 出力側タンジェント) を (N, 4) で扱う
+KEYFRAME_DTYPE = numpy.dtype('<f4')
+# 回転チャンネルのID (x, y, z, w)
+ROTATION_CHANNELS = (100, 101, 102, 103)
+# 位置チャンネルのID (x, y, z)
+LOCATION_CHANNELS = (104, 105, 106)
+
+class AnmData:
+	"""読み込んだ .anm の内容を保持するクラス"""
+
+	def __init__(self):
+		self.version = 0
+		# ボーン毎のトラック ((ボーンのパス, {チャンネルID: (N, 4) の配列}) のリスト)
+		self.tracks = []
+
+	def bone_tracks(self):
+		"""ボーン名 (パスの末尾) 毎にチャンネルをまとめた辞書を返す"""
+		result = collections.OrderedDict()
+		for path, channels in self.tracks:
+			name = path.split('/')[-1]
+			if name not in result:
+				result[name] = {'path': path, 'channels': {}}
+			result[name]['channels'].update(channels)
+		return result
+
+def read_channel(reader):
+	"""チャンネル1つ分のキーフレームを (N, 4) の float32 配列で返す"""
+	count = reader.read_int()
+	if count < 0:
+		raise CM3D2ImportException("キーフレーム数が不正です")
+	return reader.read_array(KEYFRAME_DTYPE, count * 4).reshape(-1, 4)
+
+def read_anm(file):
+	"""ファイルオブジェクトか BinaryReader から .anm を読み込んで AnmData を返す"""
+	reader = as_reader(file)
+	anm = AnmData()
+
+	if reader.read_str() != 'CM3D2_ANIM':
+		raise CM3D2ImportException("これはカスタムメイド3D2のモーションファイルではありません")
+	anm.version = reader.read_int()
+
+	# 各トラックの前に 1、ファイル末尾に 0 が置かれている
+	flag = reader.read_uint8()
+	while flag == 1:
+		path = reader.read_str()
+		channels = {}
+		while True:
+			channel_id = reader.read_uint8()
+			if channel_id <= 1:
+				break
+			channels[channel_id] = read_channel(reader)
+		anm.tracks.append((path, channels))
+		flag = channel_id
+	return anm
+
+def read_anm_file(filepath):
+	"""ファイルパスを指定して .anm を読み込む"""
+	with binaryio.open_reader(filepath) as reader:
+		return read_anm(reader)
+
+def merge_channels(channels, channel_ids, defaults, tangents=False):
+	"""複数チャンネルの時間を揃えて (時間の配列, (T, チャンネル数) の値の配列) を返す
+	あるチャンネルにだけキーが無い時間の値は前後のキーから線形補間し、
+	チャンネル自体が無い場合は defaults の値で埋めます。
+	tangents が真なら入力側/出力側タンジェントの配列も続けて返します。
+	"""
+	arrays = [channels.get(channel_id) for channel_id in channel_ids]
+	present = [array for array in arrays if array is not None and len(array)]
+	columns = (1, 2, 3) if tangents else (1,)
+	if present:
+		times = numpy.unique(numpy.concatenate([array[:, 0] for array in present]))
+	else:
+		times = numpy.zeros(0, dtype=numpy.float32)
+
+	results = [numpy.zeros((len(times), len(channel_ids)), dtype=numpy.float32) for column in columns]
+	for index, (array, default) in enumerate(zip(arrays, defaults)):
+		if array is None or not len(array):
+			results[0][:, index] = default
+			continue
+		order = numpy.argsort(array[:, 0], kind='mergesort')
+		for result, column in zip(results, columns):
+			result[:, index] = numpy.interp(times, array[order, 0], array[order, column])
+	return (times,) + tuple(results)
+
+def merge_rotations(channels, tangents=False):
+	"""回転チャンネルをまとめて (時間, (T, 4) の w, x, y, z) を返す"""
+	x, y, z, w = ROTATION_CHANNELS
+	return merge_channels(channels, (w, x, y, z), (1.0, 0.0, 0.0, 0.0), tangents)
+
+def merge_locations(channels, tangents=False):
+	"""位置チャンネルをまとめて (時間, (T, 3) の x, y, z) を返す"""
+	return merge_channels(channels, LOCATION_CHANNELS, (0.0, 0.0, 0.0), tangents)
+
+def compute_tangents(times, values):
+	"""各キーの傾きを前後のキーへの傾きの平均で求める (端のキーは片側の傾き)"""
+	times = numpy.asarray(times, dtype=numpy.float64)
+	values = numpy.asarray(values, dtype=numpy.float64)
+	tangents = numpy.zeros(values.shape)
+	if len(times) <= 1:
+		return tangents
+	slopes = numpy.diff(values, axis=0) / numpy.diff(times).reshape((-1,) + (1,) * (values.ndim - 1))
+	tangents[0] = slopes[0]
+	tangents[-1] = slopes[-1]
+	tangents[1:-1] = (slopes[:-1] + slopes[1:]) / 2
+	return tangents
+
+def hermite_segment(time0, time1, value0, value1, tangent0, tangent1, times):
+	"""2つのキーの間を、キーの傾きを使ったエルミート曲線で補間した値を返す"""
+	span = time1 - time0
+	s = (numpy.asarray(times, dtype=numpy.float64) - time0) / span
+	s2 = s * s
+	s3 = s2 * s
+	return (2 * s3 - 3 * s2 + 1) * value0 + (s3 - 2 * s2 + s) * span * tangent0 + (3 * s2 - 2 * s3) * value1 + (s3 - s2) * span * tangent1
+
+def farthest_fits(times, values, tangents, tolerance, window):
+	"""各キーから window 個先までで、間のキーが全て tolerance に収まる最も遠いキーを調べる
+	(最も遠いキーのインデックスの配列, window 個先まで全て収まったかの配列) を返します (最後の2つのキーの分は含みません)。
+	"""
+	count = len(times)
+	starts = numpy.arange(count - 2)[:, None, None]
+	lengths = numpy.arange(2, window + 1)[None, :, None]
+	offsets = numpy.arange(1, window)[None, None, :]
+	ends = numpy.minimum(starts + lengths, count - 1)
+	inner = numpy.minimum(starts + offsets, count - 1)
+	rebuilt = hermite_segment(times[starts], times[ends], values[starts], values[ends], tangents[starts], tangents[ends], times[inner])
+	errors = numpy.where(offsets < lengths, numpy.abs(rebuilt - values[inner]), 0.0)
+	# 最後のキーを越える区間は収まったことにする
+	fits = (errors.max(axis=2) <= tolerance) | (count - 1 < starts[:, :, 0] + lengths[:, :, 0])
+	is_all_fit = fits.all(axis=1)
+	starts = starts[:, 0, 0]
+	farthest = numpy.where(is_all_fit, numpy.minimum(starts + window, count - 1), starts + numpy.argmin(fits, axis=1) + 1)
+	return farthest, is_all_fit & (starts + window < count - 1)
+
+def reduce_keyframes(times, values, tangents, tolerance, window=4):
+	"""間のキーをエルミート曲線で復元した誤差が tolerance 以内になるようキーを間引き、
+	残すキーのインデックスの配列を返す (最初と最後のキーは必ず残ります)
+	全てのキーから window 個先までの区間をまとめて調べておき、それより長く収まる区間だけ個別に伸ばします。
+	"""
+	times = numpy.asarray(times, dtype=numpy.float64)
+	values = numpy.asarray(values, dtype=numpy.float64)
+	tangents = numpy.asarray(tangents, dtype=numpy.float64)
+	count = len(times)
+	if count <= 2:
+		return numpy.arange(count)
+
+	def fits(start, end):
+		rebuilt = hermite_segment(times[start], times[end], values[start], values[end], tangents[start], tangents[end], times[start + 1:end])
+		return numpy.abs(rebuilt - values[start + 1:end]).max() <= tolerance
+
+	farthest, is_open = farthest_fits(times, values, tangents, tolerance, window)
+	indices = [0]
+	start = 0
+	while start < count - 1:
+		if count - 2 <= start:
+			end = count - 1
+		elif not is_open[start]:
+			end = int(farthest[start])
+		else:
+			# window 個先まで全て収まった区間は、倍々に伸ばして収まらなくなったら二分探索で詰める
+			low, high, step = int(farthest[start]), None, window * 2
+			while low < count - 1:
+				end = min(start + step, count - 1)
+				if not fits(start, end):
+					high = end
+					break
+				low = end
+				step *= 2
+			if high is not None:
+				while 1 < high - low:
+					middle = (low + high) // 2
+					if fits(start, middle):
+						low = middle
+					else:
+						high = middle
+			end = low
+		indices.append(end)
+		start = end
+	return numpy.array(indices)
+
+def write_channel(writer, channel_id, keyframes):
+	"""チャンネル1つ分の (N, 4) のキーフレーム配列をまとめて書き込む"""
+	writer.write_uint8(channel_id)
+	writer.write_int(len(keyframes))
+	writer.write_array(keyframes, KEYFRAME_DTYPE)
+
+def channel_tolerances(location_tolerance, rotation_tolerance):
+	"""位置の距離/回転の角度の許容誤差から、チャンネルID毎の成分の許容誤差の辞書を返す
+	各成分の誤差をこれに抑えれば、位置の距離/回転の角度の誤差も許容範囲に収まります。
+	"""
+	tolerances = {}
+	for channel_id in LOCATION_CHANNELS:
+		tolerances[channel_id] = location_tolerance / math.sqrt(3)
+	for channel_id in ROTATION_CHANNELS:
+		tolerances[channel_id] = math.sin(rotation_tolerance / 4)
+	return tolerances
+
+def encode_keyframes(times, values, tolerance=None, is_smooth=True):
+	"""1チャンネル分の時間と値からタンジェントを求め、tolerance があればキーを間引いて
+	書き込む (N, 4) のキーフレーム配列を返す
+	"""
+	times = numpy.asarray(times, dtype=numpy.float64)
+	values = numpy.asarray(values, dtype=numpy.float64)
+	if is_smooth:
+		tangents = compute_tangents(times, values)
+	else:
+		tangents = numpy.zeros(len(times))
+	if tolerance is not None:
+		indices = reduce_keyframes(times, values, tangents, tolerance)
+		times, values, tangents = times[indices], values[indices], tangents[indices]
+	return numpy.column_stack((times, values, tangents, tangents))
+
+def write_track(writer, path, channels, tolerances=None, is_smooth=True):
+	"""ボーン1つ分のトラックを書き込み、間引いたキーの数を返す
+	channels は (チャンネルID, 時間の配列, 値の配列) のリスト、tolerances はチャンネルID毎の許容誤差の辞書です。
+	"""
+	tolerances = tolerances or {}
+	writer.write_bool(True)
+	writer.write_str(path)
+	removed_count = 0
+	for channel_id, times, values in channels:
+		keyframes = encode_keyframes(times, values, tolerances.get(channel_id), is_smooth)
+		removed_count += len(times) - len(keyframes)
+		write_channel(writer, channel_id, keyframes)
+	return removed_count
+
+def write_anm(file, anm, tolerances=None, is_smooth=True):
+	"""AnmData をファイルオブジェクトに書き込み、間引いたキーの数を返す"""
+	writer = binaryio.BinaryWriter(file)
+	writer.write_str('CM3D2_ANIM')
+	writer.write_int(anm.version)
+	removed_count = 0
+	for path, channels in anm.tracks:
+		track = [(channel_id, channels[channel_id][:, 0], channels[channel_id][:, 1]) for channel_id in sorted(channels)]
+		removed_count += write_track(writer, path, track, tolerances, is_smooth)
+	writer.write_bool(False)
+	return removed_count
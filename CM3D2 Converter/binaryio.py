@@ -0,0 +1,249 @@
+# CM3D2専用ファイル共通のバイナリ読み書き (bpy非依存)
+import io
+import struct
+import numpy
+
+# よく使う型の struct.Struct を事前に作っておく
+BOOL = struct.Struct('<?')
+INT8 = struct.Struct('<b')
+UINT8 = struct.Struct('<B')
+UINT16 = struct.Struct('<H')
+INT32 = struct.Struct('<i')
+FLOAT = struct.Struct('<f')
+FLOAT2 = struct.Struct('<2f')
+FLOAT3 = struct.Struct('<3f')
+FLOAT4 = struct.Struct('<4f')
+
+class CM3D2ImportException(Exception):
+	"""ファイル形式が不正な場合に送出される例外"""
+	pass
+
+def encode_varint(value):
+	"""7ビット毎に区切った長さ表現のバイト列を返す"""
+	data = bytearray()
+	while 0x80 <= value:
+		data.append((value & 0x7F) | 0x80)
+		value >>= 7
+	data.append(value)
+	return bytes(data)
+
+def encode_str(raw_str):
+	"""長さ付き文字列のバイト列を返す"""
+	data = raw_str.encode('utf-8')
+	return encode_varint(len(data)) + data
+
+# CM3D2専用ファイル用の文字列書き込み
+def write_str(file, raw_str):
+	file.write(encode_str(raw_str))
+
+# CM3D2専用ファイル用の文字列読み込み
+def read_str(file):
+	length, shift = 0, 0
+	while True:
+		data = file.read(1)
+		if not data:
+			raise CM3D2ImportException("ファイルが途中で終わっています")
+		byte = data[0]
+		length |= (byte & 0x7F) << shift
+		if not byte & 0x80:
+			break
+		shift += 7
+	return decode_str(file.read(length))
+
+def decode_str(data):
+	"""文字列のバイト列を UTF-8 としてデコードする (不正なバイト列は CM3D2ImportException にする)"""
+	try:
+		return data.decode('utf-8')
+	except UnicodeDecodeError:
+		raise CM3D2ImportException("文字列が UTF-8 ではありません、ファイルが壊れている可能性があります")
+
+class BinaryReader:
+	"""先読みバッファ付きでCM3D2形式のバイナリを読み込むクラス
+	file にファイルオブジェクトを渡すとまとめて先読みしながら読み込み、
+	buffer に bytes や mmap を渡すとコピーせずにその上を読み進めます。
+	"""
+
+	def __init__(self, file=None, buffer=None, offset=0, buffer_size=64 * 1024):
+		self.file = file
+		self.buffer_size = buffer_size
+		if buffer is not None:
+			self.__data = buffer
+			self.__pos = offset
+			self.__base = 0
+		else:
+			self.__data = b''
+			self.__pos = 0
+			self.__base = file.tell() if file is not None else 0
+
+	def __fill(self, size):
+		"""残りが size バイト未満なら先読みする"""
+		available = len(self.__data) - self.__pos
+		if size <= available or self.file is None:
+			return
+		chunk = self.file.read(max(size - available, self.buffer_size))
+		self.__base += self.__pos
+		self.__data = self.__data[self.__pos:] + chunk
+		self.__pos = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+
+	def tell(self):
+		return self.__base + self.__pos
+
+	def seek(self, offset, whence=0):
+		if whence == 1:
+			offset += self.tell()
+		elif whence == 2:
+			if self.file is None:
+				offset += len(self.__data)
+			else:
+				offset += self.file.seek(0, 2)
+				self.file.seek(self.__base + len(self.__data))
+		if self.file is None or self.__base <= offset <= self.__base + len(self.__data):
+			self.__pos = offset - self.__base
+		else:
+			self.file.seek(offset)
+			self.__data, self.__pos, self.__base = b'', 0, offset
+		return offset
+
+	def skip(self, size):
+		"""size バイト読み飛ばす"""
+		self.seek(size, 1)
+
+	def read(self, size):
+		self.__fill(size)
+		data = self.__data[self.__pos:self.__pos + size]
+		self.__pos += len(data)
+		return bytes(data)
+
+	def read_exact(self, size):
+		data = self.read(size)
+		if len(data) != size:
+			raise CM3D2ImportException("ファイルが途中で終わっています")
+		return data
+
+	def unpack(self, st):
+		"""事前に作った struct.Struct で読み込む"""
+		self.__fill(st.size)
+		try:
+			values = st.unpack_from(self.__data, self.__pos)
+		except struct.error:
+			raise CM3D2ImportException("ファイルが途中で終わっています")
+		self.__pos += st.size
+		return values
+
+	def read_varint(self):
+		value, shift = 0, 0
+		while True:
+			self.__fill(1)
+			if len(self.__data) <= self.__pos:
+				raise CM3D2ImportException("ファイルが途中で終わっています")
+			byte = self.__data[self.__pos]
+			self.__pos += 1
+			value |= (byte & 0x7F) << shift
+			if not byte & 0x80:
+				return value
+			shift += 7
+
+	def read_str(self):
+		return decode_str(self.read_exact(self.read_varint()))
+
+	def skip_str(self):
+		self.skip(self.read_varint())
+
+	def read_bool(self):
+		return self.unpack(BOOL)[0]
+
+	def read_uint8(self):
+		return self.unpack(UINT8)[0]
+
+	def read_uint16(self):
+		return self.unpack(UINT16)[0]
+
+	def read_int(self):
+		return self.unpack(INT32)[0]
+
+	def read_float(self):
+		return self.unpack(FLOAT)[0]
+
+	def read_array(self, dtype, count):
+		"""指定した型の配列を count 個分まとめて読み込む"""
+		dtype = numpy.dtype(dtype)
+		size = dtype.itemsize * count
+		self.__fill(size)
+		if len(self.__data) - self.__pos < size:
+			raise CM3D2ImportException("ファイルが途中で終わっています")
+		array = numpy.frombuffer(self.__data, dtype=dtype, count=count, offset=self.__pos)
+		self.__pos += size
+		if self.file is None:
+			# 元のバッファ (mmap 等) を閉じられるようにコピーしておく
+			array = array.copy()
+		return array
+
+class BinaryWriter:
+	"""CM3D2形式のバイナリを書き込むクラス"""
+
+	def __init__(self, file):
+		self.file = file
+
+	def write(self, data):
+		self.file.write(data)
+
+	def pack(self, st, *values):
+		"""事前に作った struct.Struct で書き込む"""
+		self.file.write(st.pack(*values))
+
+	def write_varint(self, value):
+		self.file.write(encode_varint(value))
+
+	def write_str(self, raw_str):
+		self.file.write(encode_str(raw_str))
+
+	def write_strs(self, raw_strs):
+		"""複数の文字列を一度に書き込む"""
+		self.file.write(b''.join(encode_str(s) for s in raw_strs))
+
+	def write_bool(self, value):
+		self.file.write(BOOL.pack(value))
+
+	def write_uint8(self, value):
+		self.file.write(UINT8.pack(value))
+
+	def write_int8(self, value):
+		self.file.write(INT8.pack(value))
+
+	def write_uint16(self, value):
+		self.file.write(UINT16.pack(value))
+
+	def write_int(self, value):
+		self.file.write(INT32.pack(value))
+
+	def write_float(self, value):
+		self.file.write(FLOAT.pack(value))
+
+	def write_array(self, array, dtype):
+		"""配列を指定した型に変換して一度に書き込む"""
+		self.file.write(numpy.ascontiguousarray(array, dtype=dtype).tobytes())
+
+	def tell(self):
+		return self.file.tell()
+
+def as_reader(file):
+	"""ファイルオブジェクトなら BinaryReader で包んで返す"""
+	return file if isinstance(file, BinaryReader) else BinaryReader(file)
+
+def as_writer(file):
+	"""ファイルオブジェクトなら BinaryWriter で包んで返す"""
+	return file if isinstance(file, BinaryWriter) else BinaryWriter(file)
+
+def open_reader(filepath, buffer_size=64 * 1024):
+	"""ファイルパスを指定して BinaryReader を返す (with 文で閉じられます)"""
+	return BinaryReader(io.open(filepath, 'rb', buffering=0), buffer_size=buffer_size)
@@ -1,5 +1,8 @@
-import bpy, os, re, math, bmesh, struct, shutil, mathutils
+import bpy, os, re, csv, json, math, time, bmesh, struct, shutil, mathutils
 from . import fileutil
+from . import binaryio
+from . import texindex
+from . import texcache
 
 # アドオン情報
 bl_info = {
@@ -22,6 +25,65 @@ preview_collections = {}
 def preferences():
 	return bpy.context.user_preferences.addons[__name__.split('.')[0]].preferences
 
+# 処理の段階毎の時間と件数を記録する
+class PhaseTimer:
+	def __init__(self, name):
+		self.name = name
+		self.records = []
+		self.start_time = time.time()
+		self.last_time = self.start_time
+	
+	# 前回の記録からここまでを1つの段階として記録する (counts には頂点数/面数/ボーン数などを渡す)
+	def phase(self, phase_name, **counts):
+		now = time.time()
+		record = {'operator': self.name, 'phase': phase_name, 'seconds': round(now - self.last_time, 6)}
+		record.update(counts)
+		self.records.append(record)
+		self.last_time = now
+	
+	# 開始からの経過秒数
+	def total(self):
+		return time.time() - self.start_time
+	
+	# 設定が有効なら記録をコンソールと出力先ファイルに書き出す
+	def finish(self):
+		prefs = preferences()
+		if not prefs.is_profile_phases:
+			return
+		self.records.append({'operator': self.name, 'phase': "total", 'seconds': round(self.total(), 6)})
+		for record in self.records:
+			print("[" + self.name + "] " + record['phase'] + ": " + str(round(record['seconds'], 3)) + " 秒 " + format_phase_counts(record))
+		if prefs.profile_path:
+			try:
+				write_phase_records(bpy.path.abspath(prefs.profile_path), self.records)
+			except (IOError, OSError, ValueError) as e:
+				print("処理時間の記録の書き込みに失敗しました: " + str(e))
+
+# 記録の件数部分を「名前=値」の並びにする
+def format_phase_counts(record):
+	return " ".join(key + "=" + str(record[key]) for key in sorted(record) if key not in ('operator', 'phase', 'seconds'))
+
+# 処理時間の記録をファイル (.csv か .json) に追記
+def write_phase_records(filepath, records):
+	if os.path.splitext(filepath)[1].lower() == '.csv':
+		is_new = not os.path.exists(filepath)
+		with open(filepath, 'a', encoding='utf-8', newline='') as file:
+			writer = csv.writer(file)
+			if is_new:
+				writer.writerow(['operator', 'phase', 'seconds', 'counts'])
+			for record in records:
+				writer.writerow([record['operator'], record['phase'], record['seconds'], format_phase_counts(record)])
+	else:
+		data = []
+		if os.path.exists(filepath):
+			with open(filepath, 'r', encoding='utf-8') as file:
+				data = json.load(file)
+			if not isinstance(data, list):
+				raise ValueError("記録の出力先のJSONがリストではありません: " + filepath)
+		data.append({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'records': records})
+		with open(filepath, 'w', encoding='utf-8') as file:
+			json.dump(data, file, ensure_ascii=False, indent=1)
+
 # データ名末尾の「.001」などを削除
 def remove_serial_number(name, enable=True):
 	return re.sub(r'\.\d{3,}$', "", name) if enable else name
@@ -32,23 +94,11 @@ def line_trim(line, enable=True):
 
 # CM3D2専用ファイル用の文字列書き込み
 def write_str(file, raw_str):
-	b_str = format(len(raw_str.encode('utf-8')), 'b')
-	for i in range(9):
-		if 7 < len(b_str):
-			file.write( struct.pack('<B', int("1"+b_str[-7:], 2)) )
-			b_str = b_str[:-7]
-		else:
-			file.write( struct.pack('<B', int(b_str, 2)) )
-			break
-	file.write(raw_str.encode('utf-8'))
+	binaryio.write_str(file, raw_str)
 
 # CM3D2専用ファイル用の文字列読み込み
-def read_str(file, total_b = ""):
-	for i in range(9):
-		b_str = format(struct.unpack('<B', file.read(1))[0], '08b')
-		total_b = b_str[1:] + total_b
-		if b_str[0] == '0': break
-	return file.read(int(total_b, 2)).decode('utf-8')
+def read_str(file):
+	return binaryio.read_str(file)
 
 # ボーン/ウェイト名を Blender → CM3D2
 def encode_bone_name(name, enable=True):
@@ -58,6 +108,113 @@ def encode_bone_name(name, enable=True):
 def decode_bone_name(name, enable=True):
 	return re.sub(r'([_ ])([rRlL])([_ ].*)$', r'\1*\3.\2', name) if enable else name
 
+# ボーン情報を配列で保存する時のカスタムプロパティ名
+BONE_DATA_ARRAY_KEYS = ('BoneNames', 'BoneUnknowns', 'BoneParents', 'BoneTransforms', 'LocalBoneNames', 'LocalBoneMatrices')
+
+# カスタムプロパティに配列のボーン情報があるか
+def has_bone_data_arrays(target):
+	return all(key in target for key in BONE_DATA_ARRAY_KEYS)
+
+# カスタムプロパティにボーン情報 (文字列/配列のどちらか) があるか
+def has_bone_data(target):
+	return ('BoneData:0' in target and 'LocalBoneData:0' in target) or has_bone_data_arrays(target)
+
+# カスタムプロパティのボーン情報の数 (BoneData と LocalBoneData の合計)
+def get_bone_data_count(target):
+	if has_bone_data_arrays(target):
+		return len(target['BoneUnknowns']) + len(target['LocalBoneMatrices']) // 16
+	return sum(1 for key in target.keys() if re.search(r'^(Local)?BoneData:\d+$', key))
+
+# ボーン情報 (名前, 不明フラグ, 親インデックス, 位置, 回転(w, x, y, z) / 名前, 4x4行列) を配列にまとめてカスタムプロパティに保存
+def set_bone_data_arrays(target, bone_data, local_bone_data):
+	target['BoneNames'] = "\n".join(data['name'] for data in bone_data)
+	target['BoneUnknowns'] = [int(data['unknown']) for data in bone_data]
+	target['BoneParents'] = [int(data['parent_index']) for data in bone_data]
+	target['BoneTransforms'] = [float(f) for data in bone_data for f in list(data['co'][:3]) + list(data['rot'][:4])]
+	target['LocalBoneNames'] = "\n".join(data['name'] for data in local_bone_data)
+	target['LocalBoneMatrices'] = [float(f) for data in local_bone_data for f in data['matrix']]
+
+# 配列で保存したボーン情報を (BoneData の辞書のリスト, LocalBoneData の辞書のリスト) で返す
+def get_bone_data_arrays(target):
+	unknowns = list(target['BoneUnknowns'])
+	names = target['BoneNames'].split("\n") if unknowns else []
+	parents = list(target['BoneParents'])
+	transforms = list(target['BoneTransforms'])
+	bone_data = []
+	for index, name in enumerate(names):
+		bone_data.append({
+			'name': name,
+			'unknown': unknowns[index],
+			'parent_index': parents[index],
+			'co': transforms[index * 7:index * 7 + 3],
+			'rot': transforms[index * 7 + 3:index * 7 + 7],
+			})
+	matrices = list(target['LocalBoneMatrices'])
+	local_names = target['LocalBoneNames'].split("\n") if matrices else []
+	local_bone_data = [{'name': name, 'matrix': matrices[index * 16:index * 16 + 16]} for index, name in enumerate(local_names)]
+	return bone_data, local_bone_data
+
+# カスタムプロパティのボーン情報を (BoneData の行のリスト, LocalBoneData の行のリスト) で返す
+def get_bone_data_lines(target):
+	if not has_bone_data_arrays(target):
+		bone_lines, local_bone_lines = [], []
+		for lines, prefix in ((bone_lines, "BoneData:"), (local_bone_lines, "LocalBoneData:")):
+			pass_count = 0
+			for i in range(99999):
+				name = prefix + str(i)
+				if name in target:
+					lines.append(target[name])
+				else:
+					pass_count += 1
+				if 10 < pass_count:
+					break
+		return bone_lines, local_bone_lines
+	bone_data, local_bone_data = get_bone_data_arrays(target)
+	bone_lines = []
+	for data in bone_data:
+		parent_name = bone_data[data['parent_index']]['name'] if 0 <= data['parent_index'] else "None"
+		bone_lines.append(",".join([data['name'], str(data['unknown']), parent_name, " ".join(map(str, data['co'])), " ".join(map(str, data['rot']))]))
+	local_bone_lines = [data['name'] + "," + " ".join(map(str, data['matrix'])) for data in local_bone_data]
+	return bone_lines, local_bone_lines
+
+# BoneData/LocalBoneData の行を (BoneData の辞書のリスト, LocalBoneData の辞書のリスト) にする (親は名前で探す)
+def parse_bone_data_lines(bone_lines, local_bone_lines):
+	bone_lines = [line.split(',') for line in bone_lines if line.count(',') == 4]
+	bone_name_indices = {data[0]: index for index, data in enumerate(bone_lines)}
+	bone_data = []
+	for data in bone_lines:
+		bone_data.append({
+			'name': data[0],
+			'unknown': int(data[1]),
+			'parent_index': bone_name_indices.get(data[2], -1),
+			'co': list(map(float, data[3].split())),
+			'rot': list(map(float, data[4].split())),
+			})
+	local_bone_lines = [line.split(',') for line in local_bone_lines if line.count(',') == 1]
+	local_bone_data = [{'name': data[0], 'matrix': list(map(float, data[1].split()))} for data in local_bone_lines]
+	return bone_data, local_bone_data
+
+# カスタムプロパティのボーン情報に、まだ無い名前のボーンの行を足して保存し直す
+def add_bone_data_lines(target, bone_lines, local_bone_lines, is_array=False):
+	old_bone_lines, old_local_bone_lines = get_bone_data_lines(target)
+	for old_lines, lines in ((old_bone_lines, bone_lines), (old_local_bone_lines, local_bone_lines)):
+		names = set(line.split(',')[0] for line in old_lines)
+		old_lines.extend(line for line in lines if line.split(',')[0] not in names)
+	remove_bone_data(target)
+	if is_array:
+		set_bone_data_arrays(target, *parse_bone_data_lines(old_bone_lines, old_local_bone_lines))
+	else:
+		for index, line in enumerate(old_bone_lines):
+			target["BoneData:" + str(index)] = line
+		for index, line in enumerate(old_local_bone_lines):
+			target["LocalBoneData:" + str(index)] = line
+
+# カスタムプロパティのボーン情報を削除 (文字列/配列の両方、BaseBone は残す)
+def remove_bone_data(target):
+	for key in list(target.keys()):
+		if key in BONE_DATA_ARRAY_KEYS or re.search(r'^(Local)?BoneData:\d+$', key):
+			del target[key]
+
 # CM3D2用マテリアルを設定に合わせて装飾
 def decorate_material(mate, enable=True, me=None, mate_index=-1):
 	if not enable: return
@@ -347,14 +504,16 @@ def default_cm3d2_dir(base_dir, file_name, new_ext):
 	base_dir = os.path.splitext(base_dir)[0] + "." + new_ext
 	return base_dir
 
-# 一時ファイル書き込みと自動バックアップを行うファイルオブジェクトを返す
-def open_temporary(filepath, mode, is_backup=False):
+# 上書き時のバックアップファイルのパスを返す (バックアップしないなら None)
+def get_backup_filepath(filepath, is_backup=True):
 	backup_ext = preferences().backup_ext
 	if is_backup and backup_ext:
-		backup_filepath = filepath + '.' + backup_ext
-	else:
-		backup_filepath = None
-	return fileutil.TemporaryFileWriter(filepath, mode, backup_filepath=backup_filepath)
+		return filepath + '.' + backup_ext
+	return None
+
+# 一時ファイル書き込みと自動バックアップを行うファイルオブジェクトを返す
+def open_temporary(filepath, mode, is_backup=False):
+	return fileutil.TemporaryFileWriter(filepath, mode, backup_filepath=get_backup_filepath(filepath, is_backup))
 
 # ファイルを上書きするならバックアップ処理
 def file_backup(filepath, enable=True):
@@ -362,16 +521,6 @@ def file_backup(filepath, enable=True):
 	if enable and backup_ext and os.path.exists(filepath):
 		shutil.copyfile(filepath, filepath+"."+backup_ext)
 
-# サブフォルダを再帰的に検索してリスト化
-def fild_tex_all_files(dir):
-	for root, dirs, files in os.walk(dir):
-		yield root
-		for file in files:
-			if os.path.splitext(file)[1].lower() == ".tex":
-				yield os.path.join(root, file)
-			elif os.path.splitext(file)[1].lower() == ".png":
-				yield os.path.join(root, file)
-
 # テクスチャ置き場のパスのリストを返す
 def get_default_tex_paths():
 	default_paths = [preferences().default_tex_path0, preferences().default_tex_path1, preferences().default_tex_path2, preferences().default_tex_path3]
@@ -398,64 +547,77 @@ def get_default_tex_paths():
 		tex_dirs = [preferences().__getattribute__('default_tex_path' + str(i)) for i in range(4) if preferences().__getattribute__('default_tex_path' + str(i))]
 	return tex_dirs
 
-# テクスチャ置き場の全ファイルを返す
-def get_tex_storage_files():
-	files = []
-	tex_dirs = get_default_tex_paths()
-	for tex_dir in tex_dirs:
-		tex_dir = bpy.path.abspath(tex_dir)
-		files.extend(fild_tex_all_files(tex_dir))
-	return files
+# アドオンのキャッシュ置き場のパスを返す
+def get_cache_dir():
+	return bpy.utils.user_resource('DATAFILES', path="cm3d2_converter", create=True)
+
+# tex から取り出した PNG のキャッシュを返す
+png_cache = None
+def get_png_cache():
+	global png_cache
+	if png_cache is None:
+		png_cache = texcache.PNGCache(os.path.join(get_cache_dir(), "png"))
+	png_cache.max_size = preferences().png_cache_size * 1024 * 1024
+	return png_cache
+
+# tex から取り出した PNG を画像に読み込み、元の tex のパスを記録して CM3D2内のパスを返す
+def load_cached_tex(img, tex_path):
+	png_path, in_path = get_png_cache().extract(tex_path)
+	img.filepath = png_path
+	img['cm3d2_tex_path'] = tex_path
+	img.reload()
+	return in_path
+
+# 画像の元ファイルのパスを返す (tex から取り出した PNG ならその tex のパス)
+def get_image_source_path(img):
+	if 'cm3d2_tex_path' in img:
+		return img['cm3d2_tex_path']
+	return bpy.path.abspath(img.filepath)
+
+# 開いたファイルの画像のうち、キャッシュから削除された PNG を元の tex から取り出し直す
+@bpy.app.handlers.persistent
+def restore_cached_tex_images(dummy):
+	for img in bpy.data.images:
+		if 'cm3d2_tex_path' not in img or img.packed_file:
+			continue
+		if os.path.exists(bpy.path.abspath(img.filepath)):
+			continue
+		try:
+			load_cached_tex(img, img['cm3d2_tex_path'])
+		except (IOError, OSError, binaryio.CM3D2ImportException):
+			continue
+
+# テクスチャ置き場の索引を更新して返す
+tex_index = None
+def get_tex_index():
+	global tex_index
+	if tex_index is None:
+		tex_index = texindex.TextureIndex(os.path.join(get_cache_dir(), "tex_index.json"))
+	tex_index.update([bpy.path.abspath(path) for path in get_default_tex_paths()])
+	return tex_index
 
 # テクスチャを検索して空の画像へ置換
-def replace_cm3d2_tex(img, pre_files=[]):
-	source_png_name = remove_serial_number(img.name).lower() + ".png"
-	source_tex_name = remove_serial_number(img.name).lower() + ".tex"
+def replace_cm3d2_tex(img, tex_index=None):
+	if tex_index is None:
+		tex_index = get_tex_index()
 	
-	tex_dirs = get_default_tex_paths()
+	source_name = remove_serial_number(img.name).lower()
+	path = tex_index.find(source_name + ".png")
+	if path:
+		img.filepath = path
+		if 'cm3d2_tex_path' in img:
+			del img['cm3d2_tex_path']
+		img.reload()
+		return True
 	
-	for tex_dir in tex_dirs:
-		
-		if len(pre_files):
-			files = pre_files
-		else:
-			files = fild_tex_all_files(tex_dir)
-		
-		for path in files:
-			path = bpy.path.abspath(path)
-			file_name = os.path.basename(path).lower()
-			
-			if file_name == source_png_name:
-				img.filepath = path
-				img.reload()
-				return True
-			
-			elif file_name == source_tex_name:
-				try:
-					file = open(path, 'rb')
-				except: return False
-				
-				header_ext = read_str(file)
-				if header_ext == 'CM3D2_TEX':
-					file.seek(4, 1)
-					read_str(file)
-					png_size = struct.unpack('<i', file.read(4))[0]
-					png_path = os.path.splitext(path)[0] + ".png"
-					try:
-						png_file = open(png_path, 'wb')
-					except: return False
-					png_file.write(file.read(png_size))
-					png_file.close() ; file.close()
-					img.filepath = png_path
-					img.reload()
-					return True
-				else:
-					file.close()
-					return False
-		
-		if len(pre_files):
-			return False
-	return False
+	path = tex_index.find(source_name + ".tex")
+	if not path:
+		return False
+	try:
+		load_cached_tex(img, path)
+	except (IOError, OSError, binaryio.CM3D2ImportException):
+		return False
+	return True
 
 # col f タイプの設定値を値に合わせて着色
 def set_texture_color(slot):
@@ -1,8 +1,8 @@
 import bpy
 import os
 import re
-import struct
 from . import common
+from . import binaryio
 
 class export_cm3d2_mate(bpy.types.Operator):
 	bl_idname = 'material.export_cm3d2_mate'
@@ -69,15 +69,16 @@ class export_cm3d2_mate(bpy.types.Operator):
 		return {'FINISHED'}
 
 	def write_material(self, context, file):
+		writer = binaryio.BinaryWriter(file)
 		mate = context.material
 		
-		common.write_str(file, 'CM3D2_MATERIAL')
-		file.write(struct.pack('<i', self.version))
+		writer.write_str('CM3D2_MATERIAL')
+		writer.write_int(self.version)
 		
-		common.write_str(file, self.name1)
-		common.write_str(file, self.name2)
-		common.write_str(file, mate['shader1'])
-		common.write_str(file, mate['shader2'])
+		writer.write_str(self.name1)
+		writer.write_str(self.name2)
+		writer.write_str(mate['shader1'])
+		writer.write_str(mate['shader2'])
 		
 		for tex_slot in mate.texture_slots:
 			if not tex_slot:
@@ -90,16 +91,16 @@ class export_cm3d2_mate(bpy.types.Operator):
 					type = 'col'
 				else:
 					type = 'f'
-			common.write_str(file, type)
-			common.write_str(file, common.remove_serial_number(tex.name))
+			writer.write_str(type)
+			writer.write_str(common.remove_serial_number(tex.name))
 			if type == 'tex':
 				try:
 					img = tex.image
 				except:
 					raise common.CM3D2ExportException("texタイプの設定値の取得に失敗しました、中止します")
 				if img:
-					common.write_str(file, 'tex2d')
-					common.write_str(file, common.remove_serial_number(img.name))
+					writer.write_str('tex2d')
+					writer.write_str(common.remove_serial_number(img.name))
 					if 'cm3d2_path' in img:
 						path = img['cm3d2_path']
 					else:
@@ -108,20 +109,20 @@ class export_cm3d2_mate(bpy.types.Operator):
 					path = re.sub(r'^[\/\.]*', "", path)
 					if not re.search(r'^assets/texture/', path, re.I):
 						path = "Assets/texture/texture/" + os.path.basename(path)
-					common.write_str(file, path)
+					writer.write_str(path)
 					col = tex_slot.color
-					file.write(struct.pack('<3f', col[0], col[1], col[2]))
-					file.write(struct.pack('<f', tex_slot.diffuse_color_factor))
+					writer.pack(binaryio.FLOAT3, col[0], col[1], col[2])
+					writer.write_float(tex_slot.diffuse_color_factor)
 				else:
-					common.write_str(file, 'null')
+					writer.write_str('null')
 			elif type == 'col':
 				col = tex_slot.color
-				file.write(struct.pack('<3f', col[0], col[1], col[2]))
-				file.write(struct.pack('<f', tex_slot.diffuse_color_factor))
+				writer.pack(binaryio.FLOAT3, col[0], col[1], col[2])
+				writer.write_float(tex_slot.diffuse_color_factor)
 			elif type == 'f':
-				file.write(struct.pack('<f', tex_slot.diffuse_color_factor))
+				writer.write_float(tex_slot.diffuse_color_factor)
 		
-		common.write_str(file, 'end')
+		writer.write_str('end')
 
 class export_cm3d2_mate_text(bpy.types.Operator):
 	bl_idname = 'text.export_cm3d2_mate_text'
@@ -202,16 +203,17 @@ class export_cm3d2_mate_text(bpy.types.Operator):
 		return {'FINISHED'}
 
 	def write_material(self, context, file):
+		writer = binaryio.BinaryWriter(file)
 		txt = context.edit_text
 		lines = txt.as_string().split('\n')
 		
-		common.write_str(file, 'CM3D2_MATERIAL')
-		file.write(struct.pack('<i', self.version))
+		writer.write_str('CM3D2_MATERIAL')
+		writer.write_int(self.version)
 		
-		common.write_str(file, self.name1)
-		common.write_str(file, self.name2)
-		common.write_str(file, lines[3])
-		common.write_str(file, lines[4])
+		writer.write_str(self.name1)
+		writer.write_str(self.name2)
+		writer.write_str(lines[3])
+		writer.write_str(lines[4])
 		
 		line_seek = 5
 		try:
@@ -222,35 +224,35 @@ class export_cm3d2_mate_text(bpy.types.Operator):
 					line_seek += 1
 					continue
 				if lines[line_seek] == 'tex':
-					common.write_str(file, common.line_trim(lines[line_seek]))
-					common.write_str(file, common.line_trim(lines[line_seek + 1]))
-					common.write_str(file, common.line_trim(lines[line_seek + 2]))
+					writer.write_str(common.line_trim(lines[line_seek]))
+					writer.write_str(common.line_trim(lines[line_seek + 1]))
+					writer.write_str(common.line_trim(lines[line_seek + 2]))
 					line_seek += 3
 					if common.line_trim(lines[line_seek - 1]) == 'tex2d':
-						common.write_str(file, common.line_trim(lines[line_seek]))
-						common.write_str(file, common.line_trim(lines[line_seek + 1]))
+						writer.write_str(common.line_trim(lines[line_seek]))
+						writer.write_str(common.line_trim(lines[line_seek + 1]))
 						floats = common.line_trim(lines[line_seek + 2]).split(' ')
 						for f in floats:
-							file.write(struct.pack('<f', float(f)))
+							writer.write_float(float(f))
 						line_seek += 3
 				elif lines[line_seek] == 'col':
-					common.write_str(file, common.line_trim(lines[line_seek]))
-					common.write_str(file, common.line_trim(lines[line_seek + 1]))
+					writer.write_str(common.line_trim(lines[line_seek]))
+					writer.write_str(common.line_trim(lines[line_seek + 1]))
 					floats = common.line_trim(lines[line_seek + 2]).split(' ')
 					for f in floats:
-						file.write(struct.pack('<f', float(f)))
+						writer.write_float(float(f))
 					line_seek += 3
 				elif lines[line_seek] == 'f':
-					common.write_str(file, common.line_trim(lines[line_seek]))
-					common.write_str(file, common.line_trim(lines[line_seek + 1]))
+					writer.write_str(common.line_trim(lines[line_seek]))
+					writer.write_str(common.line_trim(lines[line_seek + 1]))
 					f = float(common.line_trim(lines[line_seek + 2]))
-					file.write(struct.pack('<f', f))
+					writer.write_float(f)
 					line_seek += 3
 				else:
 					raise common.CM3D2ExportException("tex col f 以外の設定値が見つかりました、中止します")
 		except:
 			raise common.CM3D2ExportException("mateファイルの出力に失敗、中止します。 構文を見直して下さい")
-		common.write_str(file, 'end')
+		writer.write_str('end')
 
 # テキストメニューに項目を登録
 def TEXT_MT_text(self, context):
@@ -1,5 +1,6 @@
-import os, re, bpy, struct, os.path, shutil
+import os, re, bpy, os.path, shutil
 from . import common
+from . import binaryio
 
 class import_cm3d2_mate(bpy.types.Operator):
 	bl_idname = 'material.import_cm3d2_mate'
@@ -41,16 +42,16 @@ class import_cm3d2_mate(bpy.types.Operator):
 		me = ob.data
 		
 		try:
-			file = open(self.filepath, 'rb')
+			reader = binaryio.open_reader(self.filepath)
 		except:
 			self.report(type={'ERROR'}, message="ファイルを開くのに失敗しました、アクセス不可かファイルが存在しません")
 			return {'CANCELLED'}
-		if common.read_str(file) != 'CM3D2_MATERIAL':
+		if reader.read_str() != 'CM3D2_MATERIAL':
 			self.report(type={'ERROR'}, message="これはmateファイルではありません、中止します")
 			return {'CANCELLED'}
-		struct.unpack('<i', file.read(4))[0]
-		common.read_str(file)
-		mate_name = common.read_str(file)
+		reader.read_int()
+		reader.read_str()
+		mate_name = reader.read_str()
 		
 		if not context.material_slot:
 			bpy.ops.object.material_slot_add()
@@ -58,51 +59,55 @@ class import_cm3d2_mate(bpy.types.Operator):
 		mate = context.blend_data.materials.new(mate_name)
 		context.material_slot.material = mate
 		
-		mate['shader1'] = common.read_str(file)
-		mate['shader2'] = common.read_str(file)
+		mate['shader1'] = reader.read_str()
+		mate['shader2'] = reader.read_str()
+		
+		tex_storage_index = None
+		if self.is_replace_cm3d2_tex:
+			tex_storage_index = common.get_tex_index()
 		
 		slot_index = 0
 		already_texs = []
 		for i in range(99999):
-			type = common.read_str(file)
+			type = reader.read_str()
 			if type == 'tex':
 				slot = mate.texture_slots.create(slot_index)
-				tex_name = common.read_str(file)
+				tex_name = reader.read_str()
 				tex = context.blend_data.textures.new(tex_name, 'IMAGE')
 				slot.texture = tex
-				sub_type = common.read_str(file)
+				sub_type = reader.read_str()
 				if sub_type == 'tex2d':
-					img = context.blend_data.images.new(common.read_str(file), 128, 128)
-					img['cm3d2_path'] = common.read_str(file)
+					img = context.blend_data.images.new(reader.read_str(), 128, 128)
+					img['cm3d2_path'] = reader.read_str()
 					img.filepath = img['cm3d2_path']
 					img.source = 'FILE'
 					tex.image = img
-					slot.color = struct.unpack('<3f', file.read(4*3))
-					slot.diffuse_color_factor = struct.unpack('<f', file.read(4))[0]
+					slot.color = reader.unpack(binaryio.FLOAT3)
+					slot.diffuse_color_factor = reader.read_float()
 					
 					# tex探し
 					if self.is_replace_cm3d2_tex:
-						if common.replace_cm3d2_tex(img) and tex_name=='_MainTex':
+						if common.replace_cm3d2_tex(img, tex_storage_index) and tex_name=='_MainTex':
 							for face in me.polygons:
 								if face.material_index == ob.active_material_index:
 									me.uv_textures.active.data[face.index].image = img
 			
 			elif type == 'col':
 				slot = mate.texture_slots.create(slot_index)
-				tex_name = common.read_str(file)
+				tex_name = reader.read_str()
 				tex = context.blend_data.textures.new(tex_name, 'BLEND')
 				mate.use_textures[slot_index] = False
 				slot.use_rgb_to_intensity = True
-				slot.color = struct.unpack('<3f', file.read(4*3))
-				slot.diffuse_color_factor = struct.unpack('<f', file.read(4))[0]
+				slot.color = reader.unpack(binaryio.FLOAT3)
+				slot.diffuse_color_factor = reader.read_float()
 				slot.texture = tex
 			
 			elif type == 'f':
 				slot = mate.texture_slots.create(slot_index)
-				tex_name = common.read_str(file)
+				tex_name = reader.read_str()
 				tex = context.blend_data.textures.new(tex_name, 'BLEND')
 				mate.use_textures[slot_index] = False
-				slot.diffuse_color_factor = struct.unpack('<f', file.read(4))[0]
+				slot.diffuse_color_factor = reader.read_float()
 				slot.texture = tex
 			
 			elif type == 'end':
@@ -119,7 +124,7 @@ class import_cm3d2_mate(bpy.types.Operator):
 			
 			slot_index += 1
 		
-		file.close()
+		reader.close()
 		common.decorate_material(mate, self.is_decorate, me, ob.active_material_index)
 		return {'FINISHED'}
 
@@ -165,17 +170,17 @@ class import_cm3d2_mate_text(bpy.types.Operator):
 			txt.clear()
 		
 		try:
-			file = open(self.filepath, 'rb')
+			reader = binaryio.open_reader(self.filepath)
 		except:
 			self.report(type={'ERROR'}, message="ファイルを開くのに失敗しました、アクセス不可かファイルが存在しません")
 			return {'CANCELLED'}
-		if common.read_str(file) != 'CM3D2_MATERIAL':
+		if reader.read_str() != 'CM3D2_MATERIAL':
 			self.report(type={'ERROR'}, message="これはmateファイルではありません、中止します")
 			return {'CANCELLED'}
 		
-		version = str(struct.unpack('<i', file.read(4))[0])
-		name1 = common.read_str(file)
-		name2 = common.read_str(file)
+		version = str(reader.read_int())
+		name1 = reader.read_str()
+		name2 = reader.read_str()
 		if not txt:
 			txt = context.blend_data.texts.new(os.path.basename(name2))
 			context.area.type = 'TEXT_EDITOR'
@@ -183,38 +188,38 @@ class import_cm3d2_mate_text(bpy.types.Operator):
 		txt.write( version + "\n" )
 		txt.write( name1 + "\n" )
 		txt.write( name2 + "\n" )
-		txt.write( common.read_str(file) + "\n" )
-		txt.write( common.read_str(file) + "\n" )
+		txt.write( reader.read_str() + "\n" )
+		txt.write( reader.read_str() + "\n" )
 		txt.write("\n")
 		
 		for i in range(99999):
-			type = common.read_str(file)
+			type = reader.read_str()
 			if type == 'tex':
 				txt.write( type + "\n" )
-				txt.write( "\t" + common.read_str(file) + "\n" )
-				tex_type = common.read_str(file)
+				txt.write( "\t" + reader.read_str() + "\n" )
+				tex_type = reader.read_str()
 				txt.write( "\t" + tex_type + "\n" )
 				if tex_type == 'tex2d':
-					txt.write( "\t" + common.read_str(file) + "\n" )
-					txt.write( "\t" + common.read_str(file) + "\n" )
-					fs = struct.unpack('<4f', file.read(4*4))
+					txt.write( "\t" + reader.read_str() + "\n" )
+					txt.write( "\t" + reader.read_str() + "\n" )
+					fs = reader.unpack(binaryio.FLOAT4)
 					txt.write( "\t" + " ".join([str(fs[0]), str(fs[1]), str(fs[2]), str(fs[3])]) + "\n" )
 			elif type == 'col':
 				txt.write( type + "\n" )
-				txt.write( "\t" + common.read_str(file) + "\n" )
-				fs = struct.unpack('<4f', file.read(4*4))
+				txt.write( "\t" + reader.read_str() + "\n" )
+				fs = reader.unpack(binaryio.FLOAT4)
 				txt.write( "\t" + " ".join([str(fs[0]), str(fs[1]), str(fs[2]), str(fs[3])]) + "\n" )
 			elif type == 'f':
 				txt.write( type + "\n" )
-				txt.write( "\t" + common.read_str(file) + "\n" )
-				txt.write( "\t" + str(struct.unpack('<f', file.read(4))[0]) + "\n" )
+				txt.write( "\t" + reader.read_str() + "\n" )
+				txt.write( "\t" + str(reader.read_float()) + "\n" )
 			elif type == 'end':
 				break
 			else:
 				self.report(type={'ERROR'}, message="未知の設定値タイプが見つかりました、中止します")
 				return {'CANCELLED'}
 		
-		file.close()
+		reader.close()
 		txt.current_line_index = 0
 		return {'FINISHED'}
 
@@ -12,10 +12,8 @@ def menu_func(self, context):
 	is_boxed = False
 	
 	bone_data_count = 0
-	if 'BoneData:0' in arm and 'LocalBoneData:0' in arm:
-		for key in arm.keys():
-			if re.search(r'^(Local)?BoneData:\d+$', key):
-				bone_data_count += 1
+	if common.has_bone_data(arm):
+		bone_data_count = common.get_bone_data_count(arm)
 	enabled_clipboard = False
 	clipboard = context.window_manager.clipboard
 	if 'BoneData:' in clipboard and 'LocalBoneData:' in clipboard:
@@ -160,33 +158,20 @@ class copy_armature_bone_data_property(bpy.types.Operator):
 		if ob:
 			if ob.type == 'ARMATURE':
 				arm = ob.data
-				if 'BoneData:0' in arm and 'LocalBoneData:0' in arm:
+				if common.has_bone_data(arm):
 					return True
 		return False
 	
 	def execute(self, context):
 		output_text = ""
 		ob = context.active_object.data
-		pass_count = 0
 		if 'BaseBone' in ob:
 			output_text += "BaseBone:" + ob['BaseBone'] + "\n"
-		for i in range(99999):
-			name = "BoneData:" + str(i)
-			if name in ob:
-				output_text += "BoneData:" + ob[name] + "\n"
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
-		pass_count = 0
-		for i in range(99999):
-			name = "LocalBoneData:" + str(i)
-			if name in ob:
-				output_text += "LocalBoneData:" + ob[name] + "\n"
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
+		bone_lines, local_bone_lines = common.get_bone_data_lines(ob)
+		for line in bone_lines:
+			output_text += "BoneData:" + line + "\n"
+		for line in local_bone_lines:
+			output_text += "LocalBoneData:" + line + "\n"
 		context.window_manager.clipboard = output_text
 		self.report(type={'INFO'}, message="ボーン情報をクリップボードにコピーしました")
 		return {'FINISHED'}
@@ -210,24 +195,7 @@ class paste_armature_bone_data_property(bpy.types.Operator):
 	def execute(self, context):
 		import re
 		ob = context.active_object.data
-		pass_count = 0
-		for i in range(99999):
-			name = "BoneData:" + str(i)
-			if name in ob:
-				del ob[name]
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
-		pass_count = 0
-		for i in range(99999):
-			name = "LocalBoneData:" + str(i)
-			if name in ob:
-				del ob[name]
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
+		common.remove_bone_data(ob)
 		bone_data_count = 0
 		local_bone_data_count = 0
 		for line in context.window_manager.clipboard.split("\n"):
@@ -263,7 +231,7 @@ class remove_armature_bone_data_property(bpy.types.Operator):
 		if ob:
 			if ob.type == 'ARMATURE':
 				arm = ob.data
-				if 'BoneData:0' in arm and 'LocalBoneData:0' in arm:
+				if common.has_bone_data(arm):
 					return True
 		return False
 	
@@ -275,25 +243,8 @@ class remove_armature_bone_data_property(bpy.types.Operator):
 	
 	def execute(self, context):
 		ob = context.active_object.data
-		pass_count = 0
 		if 'BaseBone' in ob:
 			del ob['BaseBone']
-		for i in range(99999):
-			name = "BoneData:" + str(i)
-			if name in ob:
-				del ob[name]
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
-		pass_count = 0
-		for i in range(99999):
-			name = "LocalBoneData:" + str(i)
-			if name in ob:
-				del ob[name]
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
+		common.remove_bone_data(ob)
 		self.report(type={'INFO'}, message="ボーン情報を削除しました")
 		return {'FINISHED'}
@@ -382,7 +382,7 @@ class new_cm3d2(bpy.types.Operator):
 			f_list.append(_RimPower)
 			f_list.append(_RimShift)
 		
-		tex_storage_files = common.get_tex_storage_files()
+		tex_storage_index = common.get_tex_index()
 		slot_count = 0
 		for data in tex_list:
 			slot = mate.texture_slots.create(slot_count)
@@ -402,7 +402,7 @@ class new_cm3d2(bpy.types.Operator):
 			
 			# tex探し
 			if self.is_replace_cm3d2_tex:
-				if common.replace_cm3d2_tex(img, tex_storage_files) and data[0]=='_MainTex':
+				if common.replace_cm3d2_tex(img, tex_storage_index) and data[0]=='_MainTex':
 					for face in me.polygons:
 						if face.material_index == ob.active_material_index:
 							me.uv_textures.active.data[face.index].image = img
@@ -472,6 +472,10 @@ class paste_material(bpy.types.Operator):
 		mate['shader1'] = lines[3]
 		mate['shader2'] = lines[4]
 		
+		tex_storage_index = None
+		if self.is_replace_cm3d2_tex:
+			tex_storage_index = common.get_tex_index()
+		
 		slot_index = 0
 		line_seek = 5
 		for i in range(99999):
@@ -502,7 +506,7 @@ class paste_material(bpy.types.Operator):
 					
 					# tex探し
 					if self.is_replace_cm3d2_tex:
-						if common.replace_cm3d2_tex(img) and data[0]=='_MainTex':
+						if common.replace_cm3d2_tex(img, tex_storage_index) and data[0]=='_MainTex':
 							for face in me.polygons:
 								if face.material_index == ob.active_material_index:
 									me.uv_textures.active.data[face.index].image = img
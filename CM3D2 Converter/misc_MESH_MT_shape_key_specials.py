@@ -46,8 +46,8 @@ class quick_shape_key_transfer(bpy.types.Operator):
 		self.layout.prop(self, 'is_remove_empty', icon='X')
 	
 	def execute(self, context):
-		import mathutils, time
-		start_time = time.time()
+		import mathutils
+		timer = common.PhaseTimer("quick_shape_key_transfer")
 		
 		target_ob = context.active_object
 		target_me = target_ob.data
@@ -70,6 +70,7 @@ class quick_shape_key_transfer(bpy.types.Operator):
 		bpy.ops.mesh.subdivide(number_cuts=self.subdivide_number, smoothness=0.0, quadtri=False, quadcorner='STRAIGHT_CUT', fractal=0.0, fractal_along_normal=0.0, seed=0)
 		source_ob.active_shape_key_index = 0
 		bpy.ops.object.mode_set(mode='OBJECT')
+		timer.phase("subdivide", vertices=len(source_me.vertices))
 		
 		if self.is_first_remove_all:
 			try:
@@ -88,6 +89,7 @@ class quick_shape_key_transfer(bpy.types.Operator):
 		
 		is_shapeds = {}
 		relative_keys = []
+		timer.phase("search", vertices=len(target_me.vertices))
 		context.window_manager.progress_begin(0, len(source_me.shape_keys.key_blocks))
 		context.window_manager.progress_update(0)
 		for source_shape_key_index, source_shape_key in enumerate(source_me.shape_keys.key_blocks):
@@ -124,6 +126,7 @@ class quick_shape_key_transfer(bpy.types.Operator):
 			
 			context.window_manager.progress_update(source_shape_key_index)
 		context.window_manager.progress_end()
+		timer.phase("transfer", vertices=len(target_me.vertices), shape_keys=len(source_me.shape_keys.key_blocks))
 		
 		if self.is_remove_empty:
 			for source_shape_key_name, is_shaped in is_shapeds.items():
@@ -137,8 +140,8 @@ class quick_shape_key_transfer(bpy.types.Operator):
 		context.scene.objects.active = target_ob
 		bpy.ops.object.mode_set(mode=pre_mode)
 		
-		diff_time = time.time() - start_time
-		self.report(type={'INFO'}, message=str(round(diff_time, 1)) + " Seconds")
+		timer.finish()
+		self.report(type={'INFO'}, message=str(round(timer.total(), 1)) + " Seconds")
 		return {'FINISHED'}
 
 class precision_shape_key_transfer(bpy.types.Operator):
@@ -175,8 +178,8 @@ class precision_shape_key_transfer(bpy.types.Operator):
 		self.layout.prop(self, 'is_remove_empty', icon='X')
 	
 	def execute(self, context):
-		import mathutils, time
-		start_time = time.time()
+		import mathutils
+		timer = common.PhaseTimer("precision_shape_key_transfer")
 		
 		target_ob = context.active_object
 		target_me = target_ob.data
@@ -199,6 +202,7 @@ class precision_shape_key_transfer(bpy.types.Operator):
 		bpy.ops.mesh.subdivide(number_cuts=self.subdivide_number, smoothness=0.0, quadtri=False, quadcorner='STRAIGHT_CUT', fractal=0.0, fractal_along_normal=0.0, seed=0)
 		source_ob.active_shape_key_index = 0
 		bpy.ops.object.mode_set(mode='OBJECT')
+		timer.phase("subdivide", vertices=len(source_me.vertices))
 		
 		if self.is_first_remove_all:
 			try:
@@ -243,6 +247,7 @@ class precision_shape_key_transfer(bpy.types.Operator):
 		
 		is_shapeds = {}
 		relative_keys = []
+		timer.phase("search", vertices=len(target_me.vertices))
 		context.window_manager.progress_begin(0, len(source_me.shape_keys.key_blocks))
 		context.window_manager.progress_update(0)
 		for source_shape_key_index, source_shape_key in enumerate(source_me.shape_keys.key_blocks):
@@ -288,6 +293,7 @@ class precision_shape_key_transfer(bpy.types.Operator):
 			
 			context.window_manager.progress_update(source_shape_key_index)
 		context.window_manager.progress_end()
+		timer.phase("transfer", vertices=len(target_me.vertices), shape_keys=len(source_me.shape_keys.key_blocks))
 		
 		if self.is_remove_empty:
 			for source_shape_key_name, is_shaped in is_shapeds.items():
@@ -301,8 +307,8 @@ class precision_shape_key_transfer(bpy.types.Operator):
 		context.scene.objects.active = target_ob
 		bpy.ops.object.mode_set(mode=pre_mode)
 		
-		diff_time = time.time() - start_time
-		self.report(type={'INFO'}, message=str(round(diff_time, 1)) + " Seconds")
+		timer.finish()
+		self.report(type={'INFO'}, message=str(round(timer.total(), 1)) + " Seconds")
 		return {'FINISHED'}
 
 class multiply_shape_key(bpy.types.Operator):
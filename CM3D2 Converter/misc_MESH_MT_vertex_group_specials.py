@@ -47,8 +47,8 @@ class quick_transfer_vertex_group(bpy.types.Operator):
 		self.layout.prop(self, 'is_remove_empty', icon='X')
 	
 	def execute(self, context):
-		import mathutils, time
-		start_time = time.time()
+		import mathutils
+		timer = common.PhaseTimer("quick_transfer_vertex_group")
 		
 		target_ob = context.active_object
 		target_me = target_ob.data
@@ -70,6 +70,7 @@ class quick_transfer_vertex_group(bpy.types.Operator):
 		bpy.ops.mesh.select_all(action='SELECT')
 		bpy.ops.mesh.subdivide(number_cuts=self.subdivide_number, smoothness=0.0, quadtri=False, quadcorner='STRAIGHT_CUT', fractal=0.0, fractal_along_normal=0.0, seed=0)
 		bpy.ops.object.mode_set(mode='OBJECT')
+		timer.phase("subdivide", vertices=len(source_me.vertices))
 		
 		if self.is_first_remove_all:
 			if bpy.ops.object.vertex_group_remove.poll():
@@ -83,6 +84,7 @@ class quick_transfer_vertex_group(bpy.types.Operator):
 		
 		near_vert_indexs = [kd.find(target_ob.matrix_world * v.co)[1] for v in target_me.vertices]
 		
+		timer.phase("search", vertices=len(target_me.vertices))
 		context.window_manager.progress_begin(0, len(source_ob.vertex_groups))
 		for source_vertex_group in source_ob.vertex_groups:
 			
@@ -120,6 +122,7 @@ class quick_transfer_vertex_group(bpy.types.Operator):
 			if not is_waighted and self.is_remove_empty:
 				target_ob.vertex_groups.remove(target_vertex_group)
 		context.window_manager.progress_end()
+		timer.phase("transfer", vertices=len(target_me.vertices), vertex_groups=len(source_ob.vertex_groups))
 		
 		target_ob.vertex_groups.active_index = 0
 		
@@ -127,8 +130,8 @@ class quick_transfer_vertex_group(bpy.types.Operator):
 		context.scene.objects.active = target_ob
 		bpy.ops.object.mode_set(mode=pre_mode)
 		
-		diff_time = time.time() - start_time
-		self.report(type={'INFO'}, message=str(round(diff_time, 1)) + " Seconds")
+		timer.finish()
+		self.report(type={'INFO'}, message=str(round(timer.total(), 1)) + " Seconds")
 		return {'FINISHED'}
 
 class precision_transfer_vertex_group(bpy.types.Operator):
@@ -165,8 +168,8 @@ class precision_transfer_vertex_group(bpy.types.Operator):
 		self.layout.prop(self, 'is_remove_empty', icon='X')
 	
 	def execute(self, context):
-		import mathutils, time
-		start_time = time.time()
+		import mathutils
+		timer = common.PhaseTimer("precision_transfer_vertex_group")
 		
 		target_ob = context.active_object
 		target_me = target_ob.data
@@ -188,6 +191,7 @@ class precision_transfer_vertex_group(bpy.types.Operator):
 		bpy.ops.mesh.select_all(action='SELECT')
 		bpy.ops.mesh.subdivide(number_cuts=self.subdivide_number, smoothness=0.0, quadtri=False, quadcorner='STRAIGHT_CUT', fractal=0.0, fractal_along_normal=0.0, seed=0)
 		bpy.ops.object.mode_set(mode='OBJECT')
+		timer.phase("subdivide", vertices=len(source_me.vertices))
 		
 		if self.is_first_remove_all:
 			if bpy.ops.object.vertex_group_remove.poll():
@@ -228,6 +232,7 @@ class precision_transfer_vertex_group(bpy.types.Operator):
 				context.window_manager.progress_update(vert.index)
 		context.window_manager.progress_end()
 		
+		timer.phase("search", vertices=len(target_me.vertices))
 		context.window_manager.progress_begin(0, len(source_ob.vertex_groups))
 		for source_vertex_group in source_ob.vertex_groups:
 			
@@ -271,6 +276,7 @@ class precision_transfer_vertex_group(bpy.types.Operator):
 			if not is_waighted and self.is_remove_empty:
 				target_ob.vertex_groups.remove(target_vertex_group)
 		context.window_manager.progress_end()
+		timer.phase("transfer", vertices=len(target_me.vertices), vertex_groups=len(source_ob.vertex_groups))
 		
 		target_ob.vertex_groups.active_index = 0
 		
@@ -278,8 +284,8 @@ class precision_transfer_vertex_group(bpy.types.Operator):
 		context.scene.objects.active = target_ob
 		bpy.ops.object.mode_set(mode=pre_mode)
 		
-		diff_time = time.time() - start_time
-		self.report(type={'INFO'}, message=str(round(diff_time, 1)) + " Seconds")
+		timer.finish()
+		self.report(type={'INFO'}, message=str(round(timer.total(), 1)) + " Seconds")
 		return {'FINISHED'}
 
 class quick_blur_vertex_group(bpy.types.Operator):
@@ -610,17 +616,17 @@ class remove_noassign_vertex_groups(bpy.types.Operator):
 		ob = context.active_object
 		me = ob.data
 		
-		is_keeps = [False for i in range(len(ob.vertex_groups))]
-		
+		# 頂点を一巡して使われている頂点グループを集める (全て見つかれば打ち切り)
+		threshold = self.threshold
+		group_count = len(ob.vertex_groups)
+		used_groups = set()
 		for vert in me.vertices:
-			for vge in vert.groups:
-				if not is_keeps[vge.group]:
-					if self.threshold < vge.weight:
-						is_keeps[vge.group] = True
-		
-		copy_vertex_groups = ob.vertex_groups[:]
-		for i in range(len(copy_vertex_groups)):
-			if not is_keeps[i]:
-				ob.vertex_groups.remove(copy_vertex_groups[i])
+			used_groups.update([vge.group for vge in vert.groups if threshold < vge.weight])
+			if group_count <= len(used_groups):
+				return {'FINISHED'}
+		
+		remove_groups = [vertex_group for vertex_group in ob.vertex_groups if vertex_group.index not in used_groups]
+		for vertex_group in remove_groups:
+			ob.vertex_groups.remove(vertex_group)
 		
 		return {'FINISHED'}
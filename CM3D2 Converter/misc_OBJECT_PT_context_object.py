@@ -9,10 +9,8 @@ def menu_func(self, context):
 	if ob.type != 'MESH': return
 	
 	bone_data_count = 0
-	if 'BoneData:0' in ob and 'LocalBoneData:0' in ob:
-		for key in ob.keys():
-			if re.search(r'^(Local)?BoneData:\d+$', key):
-				bone_data_count += 1
+	if common.has_bone_data(ob):
+		bone_data_count = common.get_bone_data_count(ob)
 	enabled_clipboard = False
 	clipboard = context.window_manager.clipboard
 	if 'BoneData:' in clipboard and 'LocalBoneData:' in clipboard:
@@ -24,11 +22,7 @@ def menu_func(self, context):
 		row.label(text="CM3D2用ボーン情報", icon_value=common.preview_collections['main']['KISS'].icon_id)
 		sub_row = row.row()
 		sub_row.alignment = 'RIGHT'
-		if 'BoneData:0' in ob and 'LocalBoneData:0' in ob:
-			bone_data_count = 0
-			for key in ob.keys():
-				if re.search(r'^(Local)?BoneData:\d+$', key):
-					bone_data_count += 1
+		if bone_data_count:
 			sub_row.label(text=str(bone_data_count), icon='CHECKBOX_HLT')
 		else:
 			sub_row.label(text="0", icon='CHECKBOX_DEHLT')
@@ -47,33 +41,20 @@ class copy_object_bone_data_property(bpy.types.Operator):
 	def poll(cls, context):
 		ob = context.active_object
 		if ob:
-			if 'BoneData:0' in ob and 'LocalBoneData:0' in ob:
+			if common.has_bone_data(ob):
 				return True
 		return False
 	
 	def execute(self, context):
 		output_text = ""
 		ob = context.active_object
-		pass_count = 0
 		if 'BaseBone' in ob:
 			output_text += "BaseBone:" + ob['BaseBone'] + "\n"
-		for i in range(99999):
-			name = "BoneData:" + str(i)
-			if name in ob:
-				output_text += "BoneData:" + ob[name] + "\n"
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
-		pass_count = 0
-		for i in range(99999):
-			name = "LocalBoneData:" + str(i)
-			if name in ob:
-				output_text += "LocalBoneData:" + ob[name] + "\n"
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
+		bone_lines, local_bone_lines = common.get_bone_data_lines(ob)
+		for line in bone_lines:
+			output_text += "BoneData:" + line + "\n"
+		for line in local_bone_lines:
+			output_text += "LocalBoneData:" + line + "\n"
 		context.window_manager.clipboard = output_text
 		self.report(type={'INFO'}, message="ボーン情報をクリップボードにコピーしました")
 		return {'FINISHED'}
@@ -96,24 +77,7 @@ class paste_object_bone_data_property(bpy.types.Operator):
 	def execute(self, context):
 		import re
 		ob = context.active_object
-		pass_count = 0
-		for i in range(99999):
-			name = "BoneData:" + str(i)
-			if name in ob:
-				del ob[name]
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
-		pass_count = 0
-		for i in range(99999):
-			name = "LocalBoneData:" + str(i)
-			if name in ob:
-				del ob[name]
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
+		common.remove_bone_data(ob)
 		bone_data_count = 0
 		local_bone_data_count = 0
 		for line in context.window_manager.clipboard.split("\n"):
@@ -147,7 +111,7 @@ class remove_object_bone_data_property(bpy.types.Operator):
 	def poll(cls, context):
 		ob = context.active_object
 		if ob:
-			if 'BoneData:0' in ob and 'LocalBoneData:0' in ob:
+			if common.has_bone_data(ob):
 				return True
 		return False
 	
@@ -159,25 +123,8 @@ class remove_object_bone_data_property(bpy.types.Operator):
 	
 	def execute(self, context):
 		ob = context.active_object
-		pass_count = 0
 		if 'BaseBone' in ob:
 			del ob['BaseBone']
-		for i in range(99999):
-			name = "BoneData:" + str(i)
-			if name in ob:
-				del ob[name]
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
-		pass_count = 0
-		for i in range(99999):
-			name = "LocalBoneData:" + str(i)
-			if name in ob:
-				del ob[name]
-			else:
-				pass_count += 1
-			if 10 < pass_count:
-				break
+		common.remove_bone_data(ob)
 		self.report(type={'INFO'}, message="ボーン情報を削除しました")
 		return {'FINISHED'}
@@ -1,5 +1,6 @@
 import os, re, sys, bpy, time, bmesh, mathutils
 from . import common
+from . import binaryio
 
 # メニュー等に項目追加
 def menu_func(self, context):
@@ -372,28 +373,27 @@ class set_default_toon_textures(bpy.types.Operator):
 		return False
 	
 	def execute(self, context):
-		import os.path, struct
+		import os.path
 		img = context.texture.image
 		img.name = self.name
 		
-		png_path = os.path.join( os.path.dirname(bpy.path.abspath(img.filepath)), self.name + ".png" )
+		# tex から取り出した画像ならキャッシュではなく元の tex のフォルダから探す
+		png_path = os.path.join( os.path.dirname(common.get_image_source_path(img)), self.name + ".png" )
 		tex_path = os.path.splitext(png_path)[0] + ".tex"
-		if not os.path.exists(png_path):
-			if os.path.exists(tex_path):
-				tex_file = open(tex_path, 'rb')
-				header_ext = common.read_str(tex_file)
-				if header_ext == 'CM3D2_TEX':
-					tex_file.seek(4, 1)
-					common.read_str(tex_file)
-					png_size = struct.unpack('<i', tex_file.read(4))[0]
-					png_file = open(png_path, 'wb')
-					png_file.write(tex_file.read(png_size))
-					png_file.close()
-				tex_file.close()
-		img.filepath = png_path
-		img.reload()
+		is_loaded = False
+		if not os.path.exists(png_path) and os.path.exists(tex_path):
+			try:
+				common.load_cached_tex(img, tex_path)
+				is_loaded = True
+			except (IOError, OSError, binaryio.CM3D2ImportException):
+				pass
+		if not is_loaded:
+			img.filepath = png_path
+			if 'cm3d2_tex_path' in img:
+				del img['cm3d2_tex_path']
+			img.reload()
 		
-		img['cm3d2_path'] = bpy.path.abspath(img.filepath)
+		img['cm3d2_path'] = png_path
 		return {'FINISHED'}
 
 class auto_set_color_value(bpy.types.Operator):
@@ -528,8 +528,13 @@ class quick_export_cm3d2_tex(bpy.types.Operator):
 		
 		override = context.copy()
 		override['edit_image'] = img
-		filepath = os.path.splitext( bpy.path.abspath(img.filepath) )[0] + ".tex"
-		path = "assets/texture/texture/" + os.path.basename( bpy.path.abspath(img.filepath) )
+		# tex から取り出した画像は元の tex に保存し、キャッシュのフォルダには書き込まない
+		source_path = common.get_image_source_path(img)
+		if common.get_png_cache().contains(source_path):
+			self.report(type={'ERROR'}, message="元のtexファイルが分からないため保存できません")
+			return {'CANCELLED'}
+		filepath = os.path.splitext(source_path)[0] + ".tex"
+		path = "assets/texture/texture/" + os.path.basename(source_path)
 		if 'cm3d2_path' in img:
 			path = img['cm3d2_path']
 		if os.path.exists(filepath):
@@ -1,61 +1,31 @@
-import bpy, bmesh, mathutils
-import os, re, struct, time, math
-from operator import itemgetter
+import bpy, mathutils
+import os, re, time, math, numpy
 from . import common
+from . import modelfile
 
 
+# オブジェクトに合ったボーン情報元を返す
+# (オブジェクト自身のボーン情報があれば優先する、アーマチュアを他のmodelとまとめてインポートした場合もこれで元のボーン情報になる)
+def get_bone_info_mode(context, ob, bone_info_mode='OBJECT_PROPERTY'):
+	if common.has_bone_data(ob):
+		return 'OBJECT_PROPERTY'
+	if "BoneData" in context.blend_data.texts:
+		if "LocalBoneData" in context.blend_data.texts:
+			bone_info_mode = 'TEXT'
+	arm_ob = ob.parent
+	if arm_ob:
+		if arm_ob.type == 'ARMATURE':
+			bone_info_mode = 'ARMATURE_PROPERTY'
+	else:
+		for mod in ob.modifiers:
+			if mod.type == 'ARMATURE':
+				if mod.object:
+					bone_info_mode = 'ARMATURE_PROPERTY'
+					break
+	return bone_info_mode
 
-# メインオペレーター
-class export_cm3d2_model(bpy.types.Operator):
-	bl_idname = 'export_mesh.export_cm3d2_model'
-	bl_label = "CM3D2モデル (.model)"
-	bl_description = "カスタムメイド3D2のmodelファイルを書き出します"
-	bl_options = {'REGISTER'}
-	
-	filepath = bpy.props.StringProperty(subtype='FILE_PATH')
-	filename_ext = ".model"
-	filter_glob = bpy.props.StringProperty(default="*.model", options={'HIDDEN'})
-	
-	scale = bpy.props.FloatProperty(name="倍率", default=0.2, min=0.01, max=100, soft_min=0.01, soft_max=100, step=10, precision=2, description="エクスポート時のメッシュ等の拡大率です")
-	
-	is_backup = bpy.props.BoolProperty(name="ファイルをバックアップ", default=True, description="ファイルに上書きする場合にバックアップファイルを複製します")
-	
-	version = bpy.props.IntProperty(name="ファイルバージョン", default=1000, min=1000, max=1111, soft_min=1000, soft_max=1111, step=1)
-	model_name = bpy.props.StringProperty(name="model名", default="*")
-	base_bone_name = bpy.props.StringProperty(name="基点ボーン名", default="*")
-	
-	items = [
-		('ARMATURE', "アーマチュア", "", 'OUTLINER_OB_ARMATURE', 1),
-		('TEXT', "テキスト", "", 'FILE_TEXT', 2),
-		('OBJECT_PROPERTY', "オブジェクト内プロパティ", "", 'OBJECT_DATAMODE', 3),
-		('ARMATURE_PROPERTY', "アーマチュア内プロパティ", "", 'ARMATURE_DATA', 4),
-		]
-	bone_info_mode = bpy.props.EnumProperty(items=items, name="ボーン情報元", default='OBJECT_PROPERTY', description="modelファイルに必要なボーン情報をどこから引っ張ってくるか選びます")
-	
-	items = [
-		('TEXT', "テキスト", "", 'FILE_TEXT', 1),
-		('MATERIAL', "マテリアル", "", 'MATERIAL', 2),
-		]
-	mate_info_mode = bpy.props.EnumProperty(items=items, name="マテリアル情報元", default='MATERIAL', description="modelファイルに必要なマテリアル情報をどこから引っ張ってくるか選びます")
-	
-	is_arrange_name = bpy.props.BoolProperty(name="データ名の連番を削除", default=True, description="「○○.001」のような連番が付属したデータ名からこれらを削除します")
-	
-	is_convert_tris = bpy.props.BoolProperty(name="四角面を三角面に", default=True, description="四角ポリゴンを三角ポリゴンに変換してから出力します、元のメッシュには影響ありません")
-	is_normalize_weight = bpy.props.BoolProperty(name="ウェイトの合計を1.0に", default=True, description="4つのウェイトの合計値が1.0になるように正規化します")
-	is_convert_bone_weight_names = bpy.props.BoolProperty(name="頂点グループ名をCM3D2用に変換", default=True, description="全ての頂点グループ名をCM3D2で使える名前にしてからエクスポートします")
-	is_apply_modifiers = bpy.props.BoolProperty(name="モディファイアを適用", default=False)
-	custom_normal_blend = bpy.props.FloatProperty(name="CM3D2用法線のブレンド率", default=0.5, min=0, max=1, soft_min=0, soft_max=1, step=3, precision=0)
-	
-	is_batch = bpy.props.BoolProperty(name="バッチモード", default=False, description="モードの切替やエラー個所の選択を行いません")
-	
-	@classmethod
-	def poll(cls, context):
-		ob = context.active_object
-		if ob:
-			if ob.type == 'MESH':
-				return True
-		return False
-	
+# modelの書き出し処理 (設定は self の属性から読むので、オペレーター以外からも使える)
+class model_exporter:
 	def report_cancel(self, report_message, report_type={'ERROR'}, resobj={'CANCELLED'}):
 		"""エラーメッセージを出力してキャンセルオブジェクトを返す"""
 		self.report(type=report_type, message=report_message)
@@ -90,101 +60,10 @@ class export_cm3d2_model(bpy.types.Operator):
 		return None
 	
 
-	def invoke(self, context, event):
-		res = self.precheck(context)
-		if res: return res
-		ob = context.active_object
-		
-		# model名とか
-		ob_names = common.remove_serial_number(ob.name, self.is_arrange_name).split('.')
-		self.model_name = ob_names[0]
-		self.base_bone_name = ob_names[1] if 2 <= len(ob_names) else 'Auto'
-		
-		# ボーン情報元のデフォルトオプションを取得
-		if "BoneData" in context.blend_data.texts:
-			if "LocalBoneData" in context.blend_data.texts:
-				self.bone_info_mode = 'TEXT'
-		if "BoneData:0" in ob:
-			if "LocalBoneData:0" in ob:
-				self.bone_info_mode = 'OBJECT_PROPERTY'
-		arm_ob = ob.parent
-		if arm_ob:
-			if arm_ob.type == 'ARMATURE':
-				self.bone_info_mode = 'ARMATURE_PROPERTY'
-		else:
-			for mod in ob.modifiers:
-				if mod.type == 'ARMATURE':
-					if mod.object:
-						self.bone_info_mode = 'ARMATURE_PROPERTY'
-						break
-		
-		# エクスポート時のデフォルトパスを取得
-		if common.preferences().model_default_path:
-			self.filepath = common.default_cm3d2_dir(common.preferences().model_default_path, self.model_name, "model")
-		else:
-			self.filepath = common.default_cm3d2_dir(common.preferences().model_export_path, self.model_name, "model")
-		
-		# バックアップ関係
-		self.is_backup = bool(common.preferences().backup_ext)
-		
-		self.scale = 1.0 / common.preferences().scale
-		context.window_manager.fileselect_add(self)
-		return {'RUNNING_MODAL'}
-
-
-	# 'is_batch' がオンなら非表示
-	def draw(self, context):
-		self.layout.prop(self, 'scale')
-		row = self.layout.row()
-		row.prop(self, 'is_backup', icon='FILE_BACKUP')
-		if not common.preferences().backup_ext:
-			row.enabled = False
-		self.layout.prop(self, 'is_arrange_name', icon='SAVE_AS')
-		box = self.layout.box()
-		box.prop(self, 'version', icon='LINENUMBERS_ON')
-		box.prop(self, 'model_name', icon='SORTALPHA')
-		
-		row = box.row()
-		row.prop(self, 'base_bone_name', icon='CONSTRAINT_BONE')
-		if self.base_bone_name == 'Auto':
-			row.enabled = False
-		
-		box = self.layout.box()
-		col = box.column(align=True)
-		col.label(text="ボーン情報元", icon='BONE_DATA')
-		col.prop(self, 'bone_info_mode', icon='BONE_DATA', expand=True)
-		col = box.column(align=True)
-		col.label(text="マテリアル情報元", icon='MATERIAL')
-		col.prop(self, 'mate_info_mode', icon='MATERIAL', expand=True)
-		box = self.layout.box()
-		box.label("メッシュオプション")
-		box.prop(self, 'is_convert_tris', icon='MESH_DATA')
-		sub_box = box.box()
-		sub_box.prop(self, 'is_normalize_weight', icon='MOD_VERTEX_WEIGHT')
-		sub_box.prop(self, 'is_convert_bone_weight_names', icon_value=common.preview_collections['main']['KISS'].icon_id)
-		sub_box = box.box()
-		sub_box.prop(self, 'is_apply_modifiers', icon='MODIFIER')
-		row = sub_box.row()
-		row.prop(self, 'custom_normal_blend', icon='SNAP_NORMAL', slider=True)
-		row.enabled = self.is_apply_modifiers
-
-
-	def execute(self, context):
-		"""モデルファイルを出力"""
-		start_time = time.time()
-		
-		if not self.is_batch:
-			common.preferences().model_export_path = self.filepath
-			common.preferences().scale = 1.0 / self.scale
-			bpy.ops.object.mode_set(mode='OBJECT')
-		
-		
-		context.window_manager.progress_begin(0, 10)
-		context.window_manager.progress_update(0)
-		
-		res = self.precheck(context)
-		if res: return res
-
+	def collect_model(self, context, timer):
+		"""アクティブオブジェクトのボーン情報とウェイトを集めて書き出す ModelData を返す (precheck は済ませておく)
+		中止する場合は CM3D2ExportException を投げます。
+		"""
 		ob = context.active_object
 		me = ob.data
 		
@@ -212,45 +91,42 @@ class export_cm3d2_model(bpy.types.Operator):
 		if self.bone_info_mode == 'ARMATURE':
 			arm_ob = ob.parent
 			if arm_ob and arm_ob.type != 'ARMATURE':
-				return self.report_cancel("メッシュオブジェクトの親がアーマチュアではありません")
+				raise common.CM3D2ExportException("メッシュオブジェクトの親がアーマチュアではありません")
 			if not arm_ob:
 				try:
 					arm_ob = next(mod for mod in ob.modifiers if mod.type == 'ARMATURE' and mod.object)
 				except StopIteration:
-					return self.report_cancel("アーマチュアが見つかりません、親にするかモディファイアにして下さい")
+					raise common.CM3D2ExportException("アーマチュアが見つかりません、親にするかモディファイアにして下さい")
 				arm_ob = arm_ob.object
 		elif self.bone_info_mode == 'TEXT':
 			if "BoneData" not in context.blend_data.texts:
-				return self.report_cancel("テキスト「BoneData」が見つかりません、中止します")
+				raise common.CM3D2ExportException("テキスト「BoneData」が見つかりません、中止します")
 			if "LocalBoneData" not in context.blend_data.texts:
-				return self.report_cancel("テキスト「LocalBoneData」が見つかりません、中止します")
+				raise common.CM3D2ExportException("テキスト「LocalBoneData」が見つかりません、中止します")
 		elif self.bone_info_mode == 'OBJECT_PROPERTY':
-			if "BoneData:0" not in ob:
-				return self.report_cancel("オブジェクトのカスタムプロパティにボーン情報がありません")
-			if "LocalBoneData:0" not in ob:
-				return self.report_cancel("オブジェクトのカスタムプロパティにボーン情報がありません")
+			if not common.has_bone_data(ob):
+				raise common.CM3D2ExportException("オブジェクトのカスタムプロパティにボーン情報がありません")
 		elif self.bone_info_mode == 'ARMATURE_PROPERTY':
 			arm_ob = ob.parent
 			if arm_ob and arm_ob.type != 'ARMATURE':
-				return self.report_cancel("メッシュオブジェクトの親がアーマチュアではありません")
+				raise common.CM3D2ExportException("メッシュオブジェクトの親がアーマチュアではありません")
 			if not arm_ob:
 				try:
 					arm_ob = next(mod for mod in ob.modifiers if mod.type == 'ARMATURE' and mod.object)
 				except StopIteration:
-					return self.report_cancel("アーマチュアが見つかりません、親にするかモディファイアにして下さい")
+					raise common.CM3D2ExportException("アーマチュアが見つかりません、親にするかモディファイアにして下さい")
 				arm_ob = arm_ob.object
-			if "BoneData:0" not in arm_ob.data:
-				return self.report_cancel("アーマチュアのカスタムプロパティにボーン情報がありません")
-			if "LocalBoneData:0" not in arm_ob.data:
-				return self.report_cancel("アーマチュアのカスタムプロパティにボーン情報がありません")
+			if not common.has_bone_data(arm_ob.data):
+				raise common.CM3D2ExportException("アーマチュアのカスタムプロパティにボーン情報がありません")
 		else:
-			return self.report_cancel("ボーン情報元のモードがおかしいです")
+			raise common.CM3D2ExportException("ボーン情報元のモードがおかしいです")
 		
 		if self.mate_info_mode == 'TEXT':
 			for index, slot in enumerate(ob.material_slots):
 				if "Material:" + str(index) not in context.blend_data.texts:
-					return self.report_cancel("マテリアル情報元のテキストが足りません")
+					raise common.CM3D2ExportException("マテリアル情報元のテキストが足りません")
 		context.window_manager.progress_update(1)
+		timer.phase("check")
 		
 		# model名とか
 		ob_names = common.remove_serial_number(ob.name, self.is_arrange_name).split('.')
@@ -274,16 +150,21 @@ class export_cm3d2_model(bpy.types.Operator):
 			target = ob if self.bone_info_mode == 'OBJECT_PROPERTY' else arm_ob.data
 			if 'BaseBone' in target:
 				base_bone_candidate = target['BaseBone']
-			bone_data = self.bone_data_parser(self.indexed_data_generator(target, prefix='BoneData:'))
+			# 配列で保存されていればそのまま使い、無ければ文字列をパースする
+			if common.has_bone_data_arrays(target):
+				bone_data, array_local_bone_data = common.get_bone_data_arrays(target)
+			else:
+				bone_data = self.bone_data_parser(self.indexed_data_generator(target, prefix='BoneData:'))
 		if len(bone_data) <= 0:
-			return self.report_cancel("テキスト「BoneData」に有効なデータがありません")
+			raise common.CM3D2ExportException("テキスト「BoneData」に有効なデータがありません")
 		
 		if self.base_bone_name not in (b['name'] for b in bone_data):
 			if base_bone_candidate and self.base_bone_name == 'Auto':
 				self.base_bone_name = base_bone_candidate
 			else:
-				return self.report_cancel("基点ボーンが存在しません")
+				raise common.CM3D2ExportException("基点ボーンが存在しません")
 		context.window_manager.progress_update(2)
+		timer.phase("bone_data", bones=len(bone_data))
 		
 		# LocalBoneData情報読み込み
 		local_bone_data = []
@@ -294,263 +175,182 @@ class export_cm3d2_model(bpy.types.Operator):
 			local_bone_data = self.local_bone_data_parser(l.body for l in local_bone_data_text.lines)
 		elif self.bone_info_mode in ['OBJECT_PROPERTY', 'ARMATURE_PROPERTY']:
 			target = ob if self.bone_info_mode == 'OBJECT_PROPERTY' else arm_ob.data
-			local_bone_data = self.local_bone_data_parser(self.indexed_data_generator(target, prefix='LocalBoneData:'))
+			if common.has_bone_data_arrays(target):
+				local_bone_data = array_local_bone_data
+			else:
+				local_bone_data = self.local_bone_data_parser(self.indexed_data_generator(target, prefix='LocalBoneData:'))
+				# 文字列のボーン情報を配列に変換して保存し直す (モディファイア適用時は元のオブジェクトに)
+				if self.is_bone_data_array and len(bone_data) and len(local_bone_data):
+					if self.bone_info_mode == 'OBJECT_PROPERTY' and self.is_apply_modifiers:
+						target = source_ob
+					common.remove_bone_data(target)
+					common.set_bone_data_arrays(target, bone_data, local_bone_data)
 		if len(local_bone_data) <= 0:
-			return self.report_cancel("テキスト「LocalBoneData」に有効なデータがありません")
+			raise common.CM3D2ExportException("テキスト「LocalBoneData」に有効なデータがありません")
 		local_bone_name_indices = {bone['name']:index for index, bone in enumerate(local_bone_data)}
 		context.window_manager.progress_update(3)
-		
-		# ウェイト情報読み込み
-		vertices = []
-		is_over_one = 0
-		is_under_one = 0
-		for i, vert in enumerate(me.vertices):
-			vgs = []
-			for vg in vert.groups:
-				name = common.encode_bone_name(ob.vertex_groups[vg.group].name, self.is_convert_bone_weight_names)
-				index = local_bone_name_indices.get(name, -1)
-				if 0 <= index and 0.0 < vg.weight:
-					vgs.append([index, vg.weight])
-			if len(vgs) == 0:
-				if not self.is_batch:
-					self.select_no_weight_vertices(context, local_bone_name_indices)
-				return self.report_cancel("ウェイトが割り当てられていない頂点が見つかりました、中止します")
-			vgs = sorted(vgs, key=itemgetter(1), reverse=True)[0:4]
-			total = sum(vg[1] for vg in vgs)
-			if self.is_normalize_weight:
-				for vg in vgs:
-					vg[1] /= total
-			else:
-				if 1.01 < total:
-					is_over_one += 1
-				elif total < 0.99:
-					is_under_one += 1
-			if len(vgs) < 4:
-				vgs += [(0, 0.0)] * (4 - len(vgs))
-			vertices.append({
-				'index': vert.index,
-				'face_indexs': list(map(itemgetter(0), vgs)),
-				'weights': list(map(itemgetter(1), vgs)),
-				})
-		if 1 <= is_over_one:
-			self.report(type={'INFO'}, message="ウェイトの合計が1.0を超えている頂点が見つかりました" % is_over_one)
-		if 1 <= is_under_one:
-			self.report(type={'INFO'}, message="ウェイトの合計が1.0未満の頂点が見つかりました" % is_under_one)
+		timer.phase("local_bone_data", bones=len(local_bone_data))
+		
+		# ウェイト情報読み込み (頂点グループ名の変換はグループ毎に1回だけ)
+		group_local_indices = numpy.array([local_bone_name_indices.get(common.encode_bone_name(vg.name, self.is_convert_bone_weight_names), -1) for vg in ob.vertex_groups], dtype=numpy.int64)
+		memberships = numpy.array([(vert.index, vg.group, vg.weight) for vert in me.vertices for vg in vert.groups], dtype=numpy.float64).reshape(-1, 3)
+		membership_vertices = memberships[:, 0].astype(numpy.int64)
+		membership_bones = group_local_indices[memberships[:, 1].astype(numpy.int64)]
+		membership_weights = memberships[:, 2]
+		is_used = (0 <= membership_bones) & (0.0 < membership_weights)
+		weight_indices, weight_values = modelfile.top_weights(membership_vertices[is_used], membership_bones[is_used], membership_weights[is_used], len(me.vertices))
+		totals = weight_values.sum(axis=1)
+		is_no_weight = totals <= 0.0
+		if is_no_weight.any():
+			if not self.is_batch:
+				self.select_no_weight_vertices(context, is_no_weight)
+			raise common.CM3D2ExportException("ウェイトが割り当てられていない頂点が見つかりました、中止します")
+		if self.is_normalize_weight:
+			weight_values /= totals[:, None]
+		else:
+			if numpy.any(1.01 < totals):
+				self.report(type={'INFO'}, message="ウェイトの合計が1.0を超えている頂点が見つかりました")
+			if numpy.any(totals < 0.99):
+				self.report(type={'INFO'}, message="ウェイトの合計が1.0未満の頂点が見つかりました")
+		weights = modelfile.build_weight_array(weight_indices, weight_values)
 		context.window_manager.progress_update(4)
+		timer.phase("read_weights", vertices=len(me.vertices))
 			
-		try:
-			file = common.open_temporary(self.filepath, 'wb', is_backup=self.is_backup)
-		except:
-			self.report(type={'ERROR'}, message="ファイルを開くのに失敗しました、アクセス不可の可能性があります")
-			return {'CANCELLED'}
-		
-		model_datas = {
-			'bone_data': bone_data,
-			'local_bone_data': local_bone_data,
-			'vertices': vertices,
-			}
-		try:
-			with file:
-				self.write_model(context, file, **model_datas)
-		except common.CM3D2ExportException as e:
-			self.report(type={'ERROR'}, message=str(e))
-			return {'CANCELLED'}
+		model = self.build_model(context, bone_data, local_bone_data, weights, timer)
 		
 		# モディファイアを適用する場合
 		if self.is_apply_modifiers:
 			context.blend_data.objects.remove(new_ob, do_unlink=True)
 			context.blend_data.meshes.remove(new_me, do_unlink=True)
 			context.scene.objects.active = source_ob
-		
-		context.window_manager.progress_update(10)
-		diff_time = time.time() - start_time
-		self.report(type={'INFO'}, message=str(round(diff_time, 1)) + " Seconds")
-		self.report(type={'INFO'}, message="modelのエクスポートが完了しました")
-		return {'FINISHED'}
-
-
-	def write_model(self, context, file, bone_data=[], local_bone_data=[], vertices=[]):
-		"""モデルデータをファイルオブジェクトに書き込む"""
+		return model
+	
+	
+	def build_model(self, context, bone_data=[], local_bone_data=[], weights=None, timer=None):
+		"""アクティブオブジェクトから書き出す ModelData を作る (Blenderのデータを読むのはここまで)"""
+		if timer is None:
+			timer = common.PhaseTimer("build_model")
+		model = modelfile.ModelData()
 		ob = context.active_object
 		me = ob.data
 		
 		# ファイル先頭
-		common.write_str(file, 'CM3D2_MESH')
-		file.write(struct.pack('<i', self.version))
-		
-		common.write_str(file, self.model_name)
-		common.write_str(file, self.base_bone_name)
-		
-		# ボーン情報書き出し
-		file.write(struct.pack('<i', len(bone_data)))
-		for bone in bone_data:
-			common.write_str(file, bone['name'])
-			file.write(struct.pack('<b', bone['unknown']))
-		context.window_manager.progress_update(3.3)
-		for bone in bone_data:
-			file.write(struct.pack('<i', bone['parent_index']))
-		context.window_manager.progress_update(3.7)
-		for bone in bone_data:
-			file.write(struct.pack('<3f', bone['co'][0], bone['co'][1], bone['co'][2]))
-			file.write(struct.pack('<4f', bone['rot'][1], bone['rot'][2], bone['rot'][3], bone['rot'][0]))
+		model.version = self.version
+		model.name = self.model_name
+		model.base_bone_name = self.base_bone_name
+		
+		# ボーン情報
+		model.bone_names = [bone['name'] for bone in bone_data]
+		model.bone_unknowns = numpy.array([bone['unknown'] for bone in bone_data], dtype=numpy.uint8)
+		model.bone_parents = numpy.array([bone['parent_index'] for bone in bone_data], dtype=numpy.int32)
+		model.bone_cos = numpy.array([tuple(bone['co'][:3]) for bone in bone_data], dtype=numpy.float32).reshape(-1, 3)
+		model.bone_rots = numpy.array([(bone['rot'][1], bone['rot'][2], bone['rot'][3], bone['rot'][0]) for bone in bone_data], dtype=numpy.float32).reshape(-1, 4)
 		context.window_manager.progress_update(4)
+		timer.phase("bones", bones=len(bone_data))
 		
 		# 正しい頂点数などを取得
-		bm = bmesh.new()
-		bm.from_mesh(me)
-		uv_lay = bm.loops.layers.uv.active
-		vert_uvs = []
-		vert_uvs_append = vert_uvs.append
-		vert_iuv = {}
-		vert_indices = {}
-		vert_count = 0
-		for vert in bm.verts:
-			vert_uvs_append([])
-			for loop in vert.link_loops:
-				uv = loop[uv_lay].uv
-				if uv not in vert_uvs[-1]:
-					vert_uvs[-1].append(uv)
-					iuv_hash = hash(repr([vert.index, uv.x, uv.y]))
-					vert_iuv[iuv_hash] = vert_count
-					vert_indices[vert.index] = vert_count
-					vert_count += 1
+		loop_vertex_indices = numpy.empty(len(me.loops), dtype=numpy.int32)
+		me.loops.foreach_get('vertex_index', loop_vertex_indices)
+		loop_uvs = numpy.empty(len(me.loops) * 2, dtype=numpy.float32)
+		me.uv_layers.active.data.foreach_get('uv', loop_uvs)
+		split_vertex_indices, split_uvs, loop_split_indices = modelfile.split_vertices_by_uv(loop_vertex_indices, loop_uvs)
+		vert_count = len(split_vertex_indices)
 		if 65535 < vert_count:
 			raise common.CM3D2ExportException("頂点数がまだ多いです (現在%d頂点)。あと%d頂点以上減らしてください、中止します" % (vert_count, vert_count - 65535))
 		context.window_manager.progress_update(5)
+		timer.phase("split_vertices", vertices=vert_count)
 		
-		file.write(struct.pack('<2i', vert_count, len(ob.material_slots)))
-		
-		# ローカルボーン情報を書き出し
-		file.write(struct.pack('<i', len(local_bone_data)))
-		for bone in local_bone_data:
-			common.write_str(file, bone['name'])
-		context.window_manager.progress_update(5.3)
-		for bone in local_bone_data:
-			for f in bone['matrix']:
-				file.write(struct.pack('<f', f))
-		context.window_manager.progress_update(5.7)
+		# ローカルボーン情報
+		model.local_bone_names = [bone['name'] for bone in local_bone_data]
+		model.local_bone_matrices = numpy.array([bone['matrix'] for bone in local_bone_data], dtype=numpy.float32).reshape(-1, 4, 4)
+		context.window_manager.progress_update(5.5)
+		timer.phase("local_bones", bones=len(local_bone_data))
 		
 		# カスタム法線情報を取得
 		if me.has_custom_normals:
-			custom_normals = [mathutils.Vector() for i in range(len(me.vertices))]
 			me.calc_normals_split()
-			for loop in me.loops:
-				custom_normals[loop.vertex_index] = loop.normal.copy()
-		# 頂点情報を書き出し
-		for i, vert in enumerate(bm.verts):
-			co = vert.co * self.scale
-			if me.has_custom_normals:
-				no = custom_normals[vert.index]
-			else:
-				no = vert.normal.copy()
-			for uv in vert_uvs[i]:
-				file.write(struct.pack('<3f', -co.x, co.y, co.z))
-				file.write(struct.pack('<3f', -no.x, no.y, no.z))
-				file.write(struct.pack('<2f', uv.x, uv.y))
+			loop_normals = numpy.empty(len(me.loops) * 3, dtype=numpy.float32)
+			me.loops.foreach_get('normal', loop_normals)
+			# 頂点毎に最後の面の角の法線を使う
+			custom_normals = numpy.zeros((len(me.vertices), 3), dtype=numpy.float32)
+			custom_normals[loop_vertex_indices] = loop_normals.reshape(-1, 3)
+		# 頂点情報を書き出し (不明な情報は0個)
+		cos = numpy.empty(len(me.vertices) * 3, dtype=numpy.float32)
+		me.vertices.foreach_get('co', cos)
+		cos = cos.reshape(-1, 3) * numpy.float32(self.scale)
+		if me.has_custom_normals:
+			normals = custom_normals.copy()
+		else:
+			normals = numpy.empty(len(me.vertices) * 3, dtype=numpy.float32)
+			me.vertices.foreach_get('normal', normals)
+			normals = normals.reshape(-1, 3)
+		cos[:, 0] *= -1
+		normals[:, 0] *= -1
+		model.vertices = modelfile.build_vertex_array(
+			cos[split_vertex_indices],
+			normals[split_vertex_indices],
+			split_uvs)
 		context.window_manager.progress_update(6)
+		timer.phase("vertices", vertices=vert_count)
 
-		# 不明な情報を書き出し
-		unknown_count = 0
-		file.write(struct.pack('<i', unknown_count))
-
-		# ウェイト情報を書き出し
-		for vert in vertices:
-			for uv in vert_uvs[vert['index']]:
-				file.write(struct.pack('<4H', *vert['face_indexs']))
-				file.write(struct.pack('<4f', *vert['weights']))
+		# ウェイト情報
+		model.weights = weights[split_vertex_indices]
 		context.window_manager.progress_update(7)
-		
-		# 面情報を書き出し
-		progress_plus_value = 1.0 / (len(ob.material_slots) * len(bm.faces))
-		progress_count = 7.0
-		progress_reduce = (len(ob.material_slots) * len(bm.faces)) // 200 + 1
-		
-		def vert_index_from_loops(loops):
-			"""vert_index generator"""
-			for loop in loops:
-				uv = loop[uv_lay].uv
-				index = loop.vert.index
-				iuv_hash = hash(repr([index, uv.x, uv.y]))
-				vert_index = vert_iuv.get(iuv_hash)
-				if vert_index is None:
-					vert_index = vert_indices.get(index, 0)
-				yield vert_index
-		
+		timer.phase("weights", vertices=vert_count)
+		
+		# 面情報
+		loop_starts = numpy.empty(len(me.polygons), dtype=numpy.int32)
+		me.polygons.foreach_get('loop_start', loop_starts)
+		loop_totals = numpy.empty(len(me.polygons), dtype=numpy.int32)
+		me.polygons.foreach_get('loop_total', loop_totals)
+		material_indices = numpy.empty(len(me.polygons), dtype=numpy.int32)
+		me.polygons.foreach_get('material_index', material_indices)
+		# 四角面は 0-2 と 1-3 の長さを比べて分け方を決める
+		quad_diagonals = numpy.zeros(len(me.polygons), dtype=bool)
+		is_quad = loop_totals == 4
+		quad_cos = cos[loop_vertex_indices[loop_starts[is_quad][:, None] + numpy.arange(4)]]
+		quad_diagonals[is_quad] = ((quad_cos[:, 0] - quad_cos[:, 2]) ** 2).sum(axis=1) < ((quad_cos[:, 1] - quad_cos[:, 3]) ** 2).sum(axis=1)
+		if self.is_convert_tris:
+			face_indices = numpy.flatnonzero(3 <= loop_totals)
+		else:
+			face_indices = numpy.flatnonzero(loop_totals == 3)
+		tri_loops, tri_faces = modelfile.triangulate_faces(loop_starts[face_indices], loop_totals[face_indices], quad_diagonals[face_indices])
+		# マテリアル毎に面の順を保ったまま並べ替える
+		tri_materials = material_indices[face_indices[tri_faces]]
+		order = numpy.argsort(tri_materials, kind='mergesort')
+		tri_indices = loop_split_indices[tri_loops[order]]
+		material_ends = numpy.cumsum(numpy.bincount(tri_materials, minlength=len(ob.material_slots)))
 		for mate_index, slot in enumerate(ob.material_slots):
-			tris_faces = []
-			for face in bm.faces:
-				progress_count += progress_plus_value
-				if face.index % progress_reduce == 0:
-					context.window_manager.progress_update(progress_count)
-				if face.material_index != mate_index:
-					continue
-				if len(face.verts) == 3:
-					tris_faces.extend(vert_index_from_loops(reversed(face.loops)))
-				elif len(face.verts) == 4 and self.is_convert_tris:
-					v1 = face.loops[0].vert.co - face.loops[2].vert.co
-					v2 = face.loops[1].vert.co - face.loops[3].vert.co
-					if v1.length < v2.length:
-						f1 = [0, 1, 2]
-						f2 = [0, 2, 3]
-					else:
-						f1 = [0, 1, 3]
-						f2 = [1, 2, 3]
-					faces, faces2 = [], []
-					for i, vert_index in enumerate(vert_index_from_loops(reversed(face.loops))):
-						if i in f1:
-							faces.append(vert_index)
-						if i in f2:
-							faces2.append(vert_index)
-					tris_faces.extend(faces)
-					tris_faces.extend(faces2)
-				elif 5 <= len(face.verts) and self.is_convert_tris:
-					face_count = len(face.verts) - 2
-					
-					tris = []
-					seek_min, seek_max = 0, len(face.verts) - 1
-					for i in range(face_count):
-						if not i % 2:
-							tris.append([seek_min, seek_min+1, seek_max])
-							seek_min += 1
-						else:
-							tris.append([seek_min, seek_max-1, seek_max])
-							seek_max -= 1
-					
-					tris_indexs = [[] for _ in range(len(tris))]
-					for i, vert_index in enumerate(vert_index_from_loops(reversed(face.loops))):
-						for tris_index, points in enumerate(tris):
-							if i in points:
-								tris_indexs[tris_index].append(vert_index)
-					
-					tris_faces.extend(p for ps in tris_indexs for p in ps)
-			
-			file.write(struct.pack('<i', len(tris_faces)))
-			for face_index in tris_faces:
-				file.write(struct.pack('<H', face_index))
+			start = material_ends[mate_index - 1] if mate_index else 0
+			model.face_indices.append(tri_indices[start:material_ends[mate_index]].ravel().astype(numpy.uint16))
+			context.window_manager.progress_update(7 + (mate_index + 1) / len(ob.material_slots))
 		context.window_manager.progress_update(8)
+		timer.phase("faces", faces=len(tri_indices))
 		
-		# マテリアルを書き出し
-		file.write(struct.pack('<i', len(ob.material_slots)))
+		# マテリアル情報
 		for slot_index, slot in enumerate(ob.material_slots):
 			if self.mate_info_mode == 'MATERIAL':
 				mate = slot.material
-				common.write_str(file, common.remove_serial_number(mate.name, self.is_arrange_name))
-				common.write_str(file, mate['shader1'])
-				common.write_str(file, mate['shader2'])
+				material = {
+					'name1': common.remove_serial_number(mate.name, self.is_arrange_name),
+					'name2': mate['shader1'],
+					'name3': mate['shader2'],
+					'data': [],
+					}
 				for tindex, tslot in enumerate(mate.texture_slots):
 					if not tslot:
 						continue
 					tex = tslot.texture
+					tex_name = common.remove_serial_number(tex.name, self.is_arrange_name)
+					col = tslot.color
 					if mate.use_textures[tindex]:
-						common.write_str(file, 'tex')
-						common.write_str(file, common.remove_serial_number(tex.name, self.is_arrange_name))
+						tex_data = {'type': 'tex', 'name': tex_name}
 						if tex.image:
 							img = tex.image
-							common.write_str(file, 'tex2d')
+							tex_data['type2'] = 'tex2d'
 							
-							tex_name = common.remove_serial_number(img.name, self.is_arrange_name)
-							tex_name = re.sub(r"\.[Pp][Nn][Gg]$", "", tex_name)
-							common.write_str(file, tex_name)
+							img_name = common.remove_serial_number(img.name, self.is_arrange_name)
+							tex_data['name2'] = re.sub(r"\.[Pp][Nn][Gg]$", "", img_name)
 							
 							if 'cm3d2_path' in img:
 								path = img['cm3d2_path']
@@ -560,103 +360,79 @@ class export_cm3d2_model(bpy.types.Operator):
 							path = re.sub(r'^[\/\.]*', "", path)
 							if not re.search(r'^assets/texture/', path, re.I):
 								path = "Assets/texture/texture/" + os.path.basename(path)
-							common.write_str(file, path)
-							col = tslot.color
-							file.write(struct.pack('<3f', col[0], col[1], col[2]))
-							file.write(struct.pack('<f', tslot.diffuse_color_factor))
+							tex_data['path'] = path
+							tex_data['color'] = (col[0], col[1], col[2], tslot.diffuse_color_factor)
 						else:
-							common.write_str(file, 'null')
+							tex_data['type2'] = 'null'
+						material['data'].append(tex_data)
 					else:
 						if tslot.use_rgb_to_intensity:
-							common.write_str(file, 'col')
-							common.write_str(file, common.remove_serial_number(tex.name, self.is_arrange_name))
-							col = tslot.color
-							file.write(struct.pack('<3f', col[0], col[1], col[2]))
-							file.write(struct.pack('<f', tslot.diffuse_color_factor))
+							material['data'].append({'type': 'col', 'name': tex_name, 'color': (col[0], col[1], col[2], tslot.diffuse_color_factor)})
 						else:
-							common.write_str(file, 'f')
-							common.write_str(file, common.remove_serial_number(tex.name, self.is_arrange_name))
-							file.write(struct.pack('<f', tslot.diffuse_color_factor))
+							material['data'].append({'type': 'f', 'name': tex_name, 'float': tslot.diffuse_color_factor})
 			elif self.mate_info_mode == 'TEXT':
 				data = context.blend_data.texts["Material:" + str(slot_index)].as_string()
 				data = data.split('\n')
-				common.write_str(file, data[2])
-				common.write_str(file, data[3])
-				common.write_str(file, data[4])
+				material = {'name1': data[2], 'name2': data[3], 'name3': data[4], 'data': []}
 				seek = 5
 				for i in range(9**9):
 					if len(data) <= seek:
 						break
 					type = data[seek]
 					if type == 'tex':
-						common.write_str(file, type)
-						common.write_str(file, common.line_trim(data[seek + 1]))
-						common.write_str(file, common.line_trim(data[seek + 2]))
-						if common.line_trim(data[seek + 2]) == 'tex2d':
-							common.write_str(file, common.line_trim(data[seek + 3]))
-							common.write_str(file, common.line_trim(data[seek + 4]))
-							col = common.line_trim(data[seek + 5])
-							col = col.split(' ')
-							file.write(struct.pack('<4f', float(col[0]), float(col[1]), float(col[2]), float(col[3])))
+						tex_data = {'type': type, 'name': common.line_trim(data[seek + 1]), 'type2': common.line_trim(data[seek + 2])}
+						if tex_data['type2'] == 'tex2d':
+							tex_data['name2'] = common.line_trim(data[seek + 3])
+							tex_data['path'] = common.line_trim(data[seek + 4])
+							tex_data['color'] = tuple(map(float, common.line_trim(data[seek + 5]).split(' ')[:4]))
 							seek += 3
+						material['data'].append(tex_data)
 						seek += 2
 					elif type == 'col':
-						common.write_str(file, type)
-						common.write_str(file, common.line_trim(data[seek + 1]))
-						col = common.line_trim(data[seek + 2])
-						col = col.split(' ')
-						file.write(struct.pack('<4f', float(col[0]), float(col[1]), float(col[2]), float(col[3])))
+						col = tuple(map(float, common.line_trim(data[seek + 2]).split(' ')[:4]))
+						material['data'].append({'type': type, 'name': common.line_trim(data[seek + 1]), 'color': col})
 						seek += 2
 					elif type == 'f':
-						common.write_str(file, type)
-						common.write_str(file, common.line_trim(data[seek + 1]))
-						file.write(struct.pack('<f', float(common.line_trim(data[seek + 2]))))
+						material['data'].append({'type': type, 'name': common.line_trim(data[seek + 1]), 'float': float(common.line_trim(data[seek + 2]))})
 						seek += 2
 					seek += 1
-			common.write_str(file, 'end')
+			model.materials.append(material)
 		context.window_manager.progress_update(9)
+		timer.phase("materials")
 		
-		# モーフを書き出し
-		if me.shape_keys:
-			temp_me = context.blend_data.meshes.new(me.name + ".temp")
-			vs = [vert.co for vert in me.vertices]
-			es = []
-			fs = [face.vertices for face in me.polygons]
-			temp_me.from_pydata(vs, es, fs)
-			if 2 <= len(me.shape_keys.key_blocks):
-				for shape_key in me.shape_keys.key_blocks[1:]:
-					morph = []
-					vert_index = 0
-					for i in range(len(me.vertices)):
-						temp_me.vertices[i].co = shape_key.data[i].co.copy()
-					temp_me.update()
-					for i, vert in enumerate(me.vertices):
-						co_diff = shape_key.data[i].co - vert.co
-						if me.has_custom_normals:
-							no_diff = custom_normals[i] - vert.normal
-						else:
-							no_diff = temp_me.vertices[i].normal - vert.normal
-						if 0.001 < co_diff.length or 0.001 < no_diff.length:
-							co = co_diff * self.scale
-							for d in vert_uvs[i]:
-								morph.append((vert_index, co, no_diff))
-								vert_index += 1
-						else:
-							vert_index += len(vert_uvs[i])
-					if not len(morph):
-						continue
-					common.write_str(file, 'morph')
-					common.write_str(file, shape_key.name)
-					file.write(struct.pack('<i', len(morph)))
-					for index, vec, normal in morph:
-						file.write(struct.pack('<H', index))
-						file.write(struct.pack('<3f', -vec.x, vec.y, vec.z))
-						file.write(struct.pack('<3f', -normal.x, normal.y, normal.z))
-			context.blend_data.meshes.remove(temp_me)
-		common.write_str(file, 'end')
+		# モーフ情報
+		if me.shape_keys and 2 <= len(me.shape_keys.key_blocks):
+			base_cos = numpy.empty(len(me.vertices) * 3, dtype=numpy.float32)
+			me.vertices.foreach_get('co', base_cos)
+			base_cos = base_cos.reshape(-1, 3)
+			if me.has_custom_normals:
+				base_normals = numpy.empty(len(me.vertices) * 3, dtype=numpy.float32)
+				me.vertices.foreach_get('normal', base_normals)
+				normal_diffs = custom_normals - base_normals.reshape(-1, 3)
+			else:
+				base_normals = modelfile.vertex_normals(base_cos, loop_vertex_indices, loop_starts, loop_totals)
+			shape_cos = numpy.empty(len(me.vertices) * 3, dtype=numpy.float32)
+			for shape_key in me.shape_keys.key_blocks[1:]:
+				shape_key.data.foreach_get('co', shape_cos)
+				co_diffs = shape_cos.reshape(-1, 3) - base_cos
+				if not me.has_custom_normals:
+					normal_diffs = modelfile.vertex_normals(shape_cos, loop_vertex_indices, loop_starts, loop_totals) - base_normals
+				is_changed = (0.001 ** 2 < (co_diffs ** 2).sum(axis=1)) | (0.001 ** 2 < (normal_diffs ** 2).sum(axis=1))
+				# 書き出す頂点に展開
+				split_indices = numpy.flatnonzero(is_changed[split_vertex_indices])
+				if not len(split_indices):
+					continue
+				source_indices = split_vertex_indices[split_indices]
+				morph_cos = co_diffs[source_indices] * self.scale
+				morph_normals = numpy.array(normal_diffs[source_indices], dtype=numpy.float32)
+				morph_cos[:, 0] *= -1
+				morph_normals[:, 0] *= -1
+				model.morphs.append((shape_key.name, modelfile.build_morph_array(split_indices, morph_cos, morph_normals)))
+		timer.phase("morphs", shape_keys=len(model.morphs))
+		return model
  
  
-	def select_no_weight_vertices(self, context, local_bone_name_indices):
+	def select_no_weight_vertices(self, context, is_no_weight):
 		"""ウェイトが割り当てられていない頂点を選択する"""
 		ob = context.active_object
 		me = ob.data
@@ -664,13 +440,7 @@ class export_cm3d2_model(bpy.types.Operator):
 		bpy.ops.mesh.select_all(action='DESELECT')
 		bpy.ops.object.mode_set(mode='OBJECT')
 		context.tool_settings.mesh_select_mode = (True, False, False)
-		for vert in me.vertices:
-			for vg in vert.groups:
-				name = common.encode_bone_name(ob.vertex_groups[vg.group].name, self.is_convert_bone_weight_names)
-				if name in local_bone_name_indices and 0.0 < vg.weight:
-					break
-			else:
-				vert.select = True
+		me.vertices.foreach_set('select', is_no_weight.tolist())
 		bpy.ops.object.mode_set(mode='EDIT')
 
 	def armature_bone_data_parser(self, ob):
@@ -847,6 +617,329 @@ class export_cm3d2_model(bpy.types.Operator):
 
 
 
+# メインオペレーター
+class export_cm3d2_model(model_exporter, bpy.types.Operator):
+	bl_idname = 'export_mesh.export_cm3d2_model'
+	bl_label = "CM3D2モデル (.model)"
+	bl_description = "カスタムメイド3D2のmodelファイルを書き出します"
+	bl_options = {'REGISTER'}
+	
+	filepath = bpy.props.StringProperty(subtype='FILE_PATH')
+	filename_ext = ".model"
+	filter_glob = bpy.props.StringProperty(default="*.model", options={'HIDDEN'})
+	
+	scale = bpy.props.FloatProperty(name="倍率", default=0.2, min=0.01, max=100, soft_min=0.01, soft_max=100, step=10, precision=2, description="エクスポート時のメッシュ等の拡大率です")
+	
+	is_backup = bpy.props.BoolProperty(name="ファイルをバックアップ", default=True, description="ファイルに上書きする場合にバックアップファイルを複製します")
+	
+	version = bpy.props.IntProperty(name="ファイルバージョン", default=1000, min=1000, max=1111, soft_min=1000, soft_max=1111, step=1)
+	model_name = bpy.props.StringProperty(name="model名", default="*")
+	base_bone_name = bpy.props.StringProperty(name="基点ボーン名", default="*")
+	
+	items = [
+		('ARMATURE', "アーマチュア", "", 'OUTLINER_OB_ARMATURE', 1),
+		('TEXT', "テキスト", "", 'FILE_TEXT', 2),
+		('OBJECT_PROPERTY', "オブジェクト内プロパティ", "", 'OBJECT_DATAMODE', 3),
+		('ARMATURE_PROPERTY', "アーマチュア内プロパティ", "", 'ARMATURE_DATA', 4),
+		]
+	bone_info_mode = bpy.props.EnumProperty(items=items, name="ボーン情報元", default='OBJECT_PROPERTY', description="modelファイルに必要なボーン情報をどこから引っ張ってくるか選びます")
+	is_bone_data_array = bpy.props.BoolProperty(name="プロパティのボーン情報を配列に変換", default=False, description="ボーン毎の文字列のカスタムプロパティを読み込んだ場合、次回から速く読めるよう数値の配列に変換して保存し直します")
+	
+	items = [
+		('TEXT', "テキスト", "", 'FILE_TEXT', 1),
+		('MATERIAL', "マテリアル", "", 'MATERIAL', 2),
+		]
+	mate_info_mode = bpy.props.EnumProperty(items=items, name="マテリアル情報元", default='MATERIAL', description="modelファイルに必要なマテリアル情報をどこから引っ張ってくるか選びます")
+	
+	is_arrange_name = bpy.props.BoolProperty(name="データ名の連番を削除", default=True, description="「○○.001」のような連番が付属したデータ名からこれらを削除します")
+	
+	is_convert_tris = bpy.props.BoolProperty(name="四角面を三角面に", default=True, description="四角ポリゴンを三角ポリゴンに変換してから出力します、元のメッシュには影響ありません")
+	is_normalize_weight = bpy.props.BoolProperty(name="ウェイトの合計を1.0に", default=True, description="4つのウェイトの合計値が1.0になるように正規化します")
+	is_convert_bone_weight_names = bpy.props.BoolProperty(name="頂点グループ名をCM3D2用に変換", default=True, description="全ての頂点グループ名をCM3D2で使える名前にしてからエクスポートします")
+	is_apply_modifiers = bpy.props.BoolProperty(name="モディファイアを適用", default=False)
+	custom_normal_blend = bpy.props.FloatProperty(name="CM3D2用法線のブレンド率", default=0.5, min=0, max=1, soft_min=0, soft_max=1, step=3, precision=0)
+	
+	is_batch = bpy.props.BoolProperty(name="バッチモード", default=False, description="モードの切替やエラー個所の選択を行いません")
+	
+	@classmethod
+	def poll(cls, context):
+		ob = context.active_object
+		if ob:
+			if ob.type == 'MESH':
+				return True
+		return False
+	
+	def invoke(self, context, event):
+		res = self.precheck(context)
+		if res: return res
+		ob = context.active_object
+		
+		# model名とか
+		ob_names = common.remove_serial_number(ob.name, self.is_arrange_name).split('.')
+		self.model_name = ob_names[0]
+		self.base_bone_name = ob_names[1] if 2 <= len(ob_names) else 'Auto'
+		
+		# ボーン情報元のデフォルトオプションを取得
+		self.bone_info_mode = get_bone_info_mode(context, ob, self.bone_info_mode)
+		
+		# エクスポート時のデフォルトパスを取得
+		if common.preferences().model_default_path:
+			self.filepath = common.default_cm3d2_dir(common.preferences().model_default_path, self.model_name, "model")
+		else:
+			self.filepath = common.default_cm3d2_dir(common.preferences().model_export_path, self.model_name, "model")
+		
+		# バックアップ関係
+		self.is_backup = bool(common.preferences().backup_ext)
+		self.is_bone_data_array = common.preferences().is_bone_data_array
+		
+		self.scale = 1.0 / common.preferences().scale
+		context.window_manager.fileselect_add(self)
+		return {'RUNNING_MODAL'}
+
+
+	# 'is_batch' がオンなら非表示
+	def draw(self, context):
+		self.layout.prop(self, 'scale')
+		row = self.layout.row()
+		row.prop(self, 'is_backup', icon='FILE_BACKUP')
+		if not common.preferences().backup_ext:
+			row.enabled = False
+		self.layout.prop(self, 'is_arrange_name', icon='SAVE_AS')
+		box = self.layout.box()
+		box.prop(self, 'version', icon='LINENUMBERS_ON')
+		box.prop(self, 'model_name', icon='SORTALPHA')
+		
+		row = box.row()
+		row.prop(self, 'base_bone_name', icon='CONSTRAINT_BONE')
+		if self.base_bone_name == 'Auto':
+			row.enabled = False
+		
+		box = self.layout.box()
+		col = box.column(align=True)
+		col.label(text="ボーン情報元", icon='BONE_DATA')
+		col.prop(self, 'bone_info_mode', icon='BONE_DATA', expand=True)
+		row = col.row()
+		row.prop(self, 'is_bone_data_array', icon='LINENUMBERS_ON')
+		row.enabled = self.bone_info_mode in ['OBJECT_PROPERTY', 'ARMATURE_PROPERTY']
+		col = box.column(align=True)
+		col.label(text="マテリアル情報元", icon='MATERIAL')
+		col.prop(self, 'mate_info_mode', icon='MATERIAL', expand=True)
+		box = self.layout.box()
+		box.label("メッシュオプション")
+		box.prop(self, 'is_convert_tris', icon='MESH_DATA')
+		sub_box = box.box()
+		sub_box.prop(self, 'is_normalize_weight', icon='MOD_VERTEX_WEIGHT')
+		sub_box.prop(self, 'is_convert_bone_weight_names', icon_value=common.preview_collections['main']['KISS'].icon_id)
+		sub_box = box.box()
+		sub_box.prop(self, 'is_apply_modifiers', icon='MODIFIER')
+		row = sub_box.row()
+		row.prop(self, 'custom_normal_blend', icon='SNAP_NORMAL', slider=True)
+		row.enabled = self.is_apply_modifiers
+
+
+	def execute(self, context):
+		"""モデルファイルを出力"""
+		timer = common.PhaseTimer("export_cm3d2_model")
+		
+		if not self.is_batch:
+			common.preferences().model_export_path = self.filepath
+			common.preferences().scale = 1.0 / self.scale
+			bpy.ops.object.mode_set(mode='OBJECT')
+		
+		
+		context.window_manager.progress_begin(0, 10)
+		context.window_manager.progress_update(0)
+		
+		res = self.precheck(context)
+		if res: return res
+		
+		try:
+			model = self.collect_model(context, timer)
+		except common.CM3D2ExportException as e:
+			self.report(type={'ERROR'}, message=str(e))
+			return {'CANCELLED'}
+		
+		try:
+			file = common.open_temporary(self.filepath, 'wb', is_backup=self.is_backup)
+		except:
+			self.report(type={'ERROR'}, message="ファイルを開くのに失敗しました、アクセス不可の可能性があります")
+			return {'CANCELLED'}
+		with file:
+			modelfile.write_model(file, model)
+		timer.phase("write", vertices=model.vertex_count, faces=model.face_count)
+		
+		context.window_manager.progress_update(10)
+		timer.finish()
+		self.report(type={'INFO'}, message=str(round(timer.total(), 1)) + " Seconds")
+		self.report(type={'INFO'}, message="modelのエクスポートが完了しました")
+		return {'FINISHED'}
+
+
+# 一括エクスポートで1オブジェクト分の設定を持って model_exporter の処理を行う
+class batch_model_exporter(model_exporter):
+	def __init__(self, operator, bone_info_mode):
+		self.scale = operator.scale
+		self.version = operator.version
+		self.model_name = '*'
+		self.base_bone_name = '*'
+		self.bone_info_mode = bone_info_mode
+		self.is_bone_data_array = False
+		self.mate_info_mode = 'MATERIAL'
+		self.is_arrange_name = operator.is_arrange_name
+		self.is_convert_tris = operator.is_convert_tris
+		self.is_normalize_weight = operator.is_normalize_weight
+		self.is_convert_bone_weight_names = operator.is_convert_bone_weight_names
+		self.is_apply_modifiers = False
+		self.is_batch = True
+		self.messages = []
+	
+	def report(self, type, message):
+		self.messages.append(message)
+
+# 一括エクスポートのオペレーター
+class export_cm3d2_model_batch(bpy.types.Operator):
+	bl_idname = 'export_mesh.export_cm3d2_model_batch'
+	bl_label = "CM3D2モデルを一括エクスポート (.model)"
+	bl_description = "選択中 (またはグループ内) の全てのメッシュをオブジェクト名のmodelファイルとしてフォルダに書き出します"
+	bl_options = {'REGISTER'}
+	
+	directory = bpy.props.StringProperty(subtype='DIR_PATH')
+	filter_glob = bpy.props.StringProperty(default="*.model", options={'HIDDEN'})
+	
+	items = [
+		('SELECTED', "選択中のオブジェクト", "", 'RESTRICT_SELECT_OFF', 1),
+		('GROUP', "グループ", "", 'GROUP', 2),
+		]
+	target_mode = bpy.props.EnumProperty(items=items, name="書き出すオブジェクト", default='SELECTED')
+	group_name = bpy.props.StringProperty(name="グループ")
+	
+	scale = bpy.props.FloatProperty(name="倍率", default=0.2, min=0.01, max=100, soft_min=0.01, soft_max=100, step=10, precision=2, description="エクスポート時のメッシュ等の拡大率です")
+	is_backup = bpy.props.BoolProperty(name="ファイルをバックアップ", default=True, description="ファイルに上書きする場合にバックアップファイルを複製します")
+	version = bpy.props.IntProperty(name="ファイルバージョン", default=1000, min=1000, max=1111, soft_min=1000, soft_max=1111, step=1)
+	is_arrange_name = bpy.props.BoolProperty(name="データ名の連番を削除", default=True, description="「○○.001」のような連番が付属したデータ名からこれらを削除します")
+	is_convert_tris = bpy.props.BoolProperty(name="四角面を三角面に", default=True, description="四角ポリゴンを三角ポリゴンに変換してから出力します、元のメッシュには影響ありません")
+	is_normalize_weight = bpy.props.BoolProperty(name="ウェイトの合計を1.0に", default=True, description="4つのウェイトの合計値が1.0になるように正規化します")
+	is_convert_bone_weight_names = bpy.props.BoolProperty(name="頂点グループ名をCM3D2用に変換", default=True, description="全ての頂点グループ名をCM3D2で使える名前にしてからエクスポートします")
+	
+	@classmethod
+	def poll(cls, context):
+		return True
+	
+	def invoke(self, context, event):
+		if common.preferences().model_default_path:
+			self.directory = os.path.dirname(common.default_cm3d2_dir(common.preferences().model_default_path, "", "model"))
+		else:
+			self.directory = os.path.dirname(common.default_cm3d2_dir(common.preferences().model_export_path, "", "model"))
+		self.is_backup = bool(common.preferences().backup_ext)
+		self.scale = 1.0 / common.preferences().scale
+		context.window_manager.fileselect_add(self)
+		return {'RUNNING_MODAL'}
+	
+	def draw(self, context):
+		self.layout.prop(self, 'target_mode', expand=True)
+		row = self.layout.row()
+		row.prop_search(self, 'group_name', context.blend_data, "groups", icon='GROUP')
+		row.enabled = self.target_mode == 'GROUP'
+		self.layout.prop(self, 'scale')
+		row = self.layout.row()
+		row.prop(self, 'is_backup', icon='FILE_BACKUP')
+		if not common.preferences().backup_ext:
+			row.enabled = False
+		self.layout.prop(self, 'is_arrange_name', icon='SAVE_AS')
+		self.layout.prop(self, 'version', icon='LINENUMBERS_ON')
+		box = self.layout.box()
+		box.label("メッシュオプション")
+		box.prop(self, 'is_convert_tris', icon='MESH_DATA')
+		box.prop(self, 'is_normalize_weight', icon='MOD_VERTEX_WEIGHT')
+		box.prop(self, 'is_convert_bone_weight_names', icon_value=common.preview_collections['main']['KISS'].icon_id)
+	
+	def get_objects(self, context):
+		"""書き出すメッシュオブジェクトのリストを名前順で返す"""
+		if self.target_mode == 'GROUP':
+			if self.group_name not in context.blend_data.groups:
+				return []
+			obs = context.blend_data.groups[self.group_name].objects
+		else:
+			obs = context.selected_objects
+		return sorted((ob for ob in obs if ob.type == 'MESH'), key=lambda ob: ob.name)
+	
+	def execute(self, context):
+		timer = common.PhaseTimer("export_cm3d2_model_batch")
+		
+		obs = self.get_objects(context)
+		if not obs:
+			self.report(type={'ERROR'}, message="書き出すメッシュオブジェクトがありません")
+			return {'CANCELLED'}
+		if context.active_object:
+			bpy.ops.object.mode_set(mode='OBJECT')
+		common.preferences().scale = 1.0 / self.scale
+		
+		# Blenderのデータからの取り出しはオブジェクト毎に順番に行い、書き込みは後でまとめる
+		pre_active = context.active_object
+		pre_selected = list(context.selected_objects)
+		filepaths = {}
+		jobs = []
+		notes = {}
+		failures = []
+		try:
+			for ob in obs:
+				name = common.remove_serial_number(ob.name, self.is_arrange_name).split('.')[0]
+				filepath = os.path.join(self.directory, name + ".model")
+				if filepath in filepaths:
+					failures.append((ob.name, "「" + filepaths[filepath] + "」と同じファイル名になります"))
+					continue
+				filepaths[filepath] = ob.name
+				for other in context.selected_objects:
+					other.select = False
+				ob.select = True
+				context.scene.objects.active = ob
+				exporter = batch_model_exporter(self, get_bone_info_mode(context, ob))
+				if exporter.precheck(context):
+					failures.append((ob.name, exporter.messages[-1]))
+					continue
+				try:
+					model = exporter.collect_model(context, common.PhaseTimer("export_cm3d2_model"))
+				except common.CM3D2ExportException as e:
+					failures.append((ob.name, str(e)))
+					continue
+				notes[ob.name] = exporter.messages
+				jobs.append((filepath, model, common.get_backup_filepath(filepath, self.is_backup)))
+		finally:
+			for ob in context.selected_objects:
+				ob.select = False
+			for ob in pre_selected:
+				ob.select = True
+			context.scene.objects.active = pre_active
+		timer.phase("build", objects=len(obs))
+		
+		# NumPy配列の書き出しと一時ファイルの置き換えはスレッドで並列に行う
+		results = modelfile.write_model_files(jobs)
+		timer.phase("write", files=len(jobs))
+		timer.finish()
+		
+		print("CM3D2 Converter: model一括エクスポート (" + self.directory + ")")
+		written = 0
+		for (filepath, model, backup_filepath), result in zip(jobs, results):
+			ob_name = filepaths[filepath]
+			if isinstance(result, Exception):
+				failures.append((ob_name, "ファイルの書き込みに失敗しました、アクセス不可の可能性があります (" + str(result) + ")"))
+				continue
+			seconds, filesize = result
+			print("  %s -> %s: %d頂点 / %d面 / %dモーフ / %.1f KB / %.3f 秒" % (ob_name, os.path.basename(filepath), model.vertex_count, model.face_count, len(model.morphs), filesize / 1024.0, seconds))
+			for message in notes[ob_name]:
+				print("    " + message)
+			written += 1
+		for ob_name, message in failures:
+			print("  %s: 失敗 %s" % (ob_name, message))
+			self.report(type={'WARNING'}, message=ob_name + ": " + message)
+		
+		if not written:
+			self.report(type={'ERROR'}, message="modelファイルを1つも書き出せませんでした")
+			return {'CANCELLED'}
+		self.report(type={'INFO'}, message="%d個のmodelのエクスポートが完了しました (失敗 %d個 / %s 秒)" % (written, len(failures), round(timer.total(), 1)))
+		return {'FINISHED'}
+
 # メニューを登録する関数
 def menu_func(self, context):
 	self.layout.operator(export_cm3d2_model.bl_idname, icon_value=common.preview_collections['main']['KISS'].icon_id)
+	self.layout.operator(export_cm3d2_model_batch.bl_idname, icon_value=common.preview_collections['main']['KISS'].icon_id)
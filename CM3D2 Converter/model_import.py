@@ -1,7 +1,7 @@
-import bpy, bmesh, mathutils
-import math, struct, time, os
-from collections import Counter
+import bpy, mathutils
+import math, time, os, numpy
 from . import common
+from . import modelfile
 
 # メインオペレーター
 class import_cm3d2_model(bpy.types.Operator):
@@ -11,9 +11,12 @@ class import_cm3d2_model(bpy.types.Operator):
 	bl_options = {'REGISTER'}
 	
 	filepath = bpy.props.StringProperty(subtype='FILE_PATH')
+	directory = bpy.props.StringProperty(subtype='DIR_PATH')
+	files = bpy.props.CollectionProperty(type=bpy.types.OperatorFileListElement)
 	filename_ext = ".model"
 	filter_glob = bpy.props.StringProperty(default="*.model", options={'HIDDEN'})
 	
+	is_import_directory = bpy.props.BoolProperty(name="フォルダ内を全て読み込む", default=False, description="選択したファイルではなく、フォルダ内の全てのmodelファイルを読み込みます")
 	scale = bpy.props.FloatProperty(name="倍率", default=5, min=0.1, max=100, soft_min=0.1, soft_max=100, step=100, precision=1, description="インポート時のメッシュ等の拡大率です")
 	
 	is_mesh = bpy.props.BoolProperty(name="メッシュ生成", default=True, description="ポリゴンを読み込みます、大抵の場合オンでOKです")
@@ -34,6 +37,7 @@ class import_cm3d2_model(bpy.types.Operator):
 	is_bone_data_text = bpy.props.BoolProperty(name="テキスト", default=True, description="ボーン情報をテキストとして読み込みます")
 	is_bone_data_obj_property = bpy.props.BoolProperty(name="オブジェクトのカスタムプロパティ", default=True, description="メッシュオブジェクトのカスタムプロパティにボーン情報を埋め込みます")
 	is_bone_data_arm_property = bpy.props.BoolProperty(name="アーマチュアのカスタムプロパティ", default=True, description="アーマチュアデータのカスタムプロパティにボーン情報を埋め込みます")
+	is_bone_data_array = bpy.props.BoolProperty(name="カスタムプロパティを配列で保存", default=False, description="カスタムプロパティのボーン情報をボーン毎の文字列ではなく、数値の配列にまとめて保存します")
 	
 	@classmethod
 	def poll(cls, context):
@@ -47,10 +51,12 @@ class import_cm3d2_model(bpy.types.Operator):
 		self.scale = common.preferences().scale
 		self.is_replace_cm3d2_tex = common.preferences().is_replace_cm3d2_tex
 		self.is_convert_bone_weight_names = common.preferences().is_convert_bone_weight_names
+		self.is_bone_data_array = common.preferences().is_bone_data_array
 		context.window_manager.fileselect_add(self)
 		return {'RUNNING_MODAL'}
 	
 	def draw(self, context):
+		self.layout.prop(self, 'is_import_directory', icon='FILE_FOLDER')
 		self.layout.prop(self, 'scale')
 		box = self.layout.box()
 		box.prop(self, 'is_mesh', icon='MESH_DATA')
@@ -79,153 +85,131 @@ class import_cm3d2_model(bpy.types.Operator):
 		box.prop(self, 'is_bone_data_text', icon='TEXT')
 		box.prop(self, 'is_bone_data_obj_property', icon='OBJECT_DATA')
 		box.prop(self, 'is_bone_data_arm_property', icon='ARMATURE_DATA')
+		box.prop(self, 'is_bone_data_array', icon='LINENUMBERS_ON')
+	
+	def get_filepaths(self):
+		"""読み込む .model のパスのリストを返す"""
+		directory = self.directory or os.path.dirname(self.filepath)
+		if self.is_import_directory:
+			try:
+				names = sorted(name for name in os.listdir(directory) if name.lower().endswith(".model"))
+			except OSError:
+				names = []
+		else:
+			names = [file.name for file in self.files if file.name]
+		if names:
+			return [os.path.join(directory, name) for name in names]
+		return [self.filepath]
 	
 	def execute(self, context):
-		start_time = time.time()
+		timer = common.PhaseTimer("import_cm3d2_model")
 		
 		common.preferences().model_import_path = self.filepath
 		common.preferences().scale = self.scale
-		context.window_manager.progress_begin(0, 10)
-		context.window_manager.progress_update(0)
 		
-		try:
-			file = open(self.filepath, 'rb')
-		except:
-			self.report(type={'ERROR'}, message="ファイルを開くのに失敗しました、アクセス不可かファイルが存在しません")
-			return {'CANCELLED'}
+		# ファイルの読み込みはスレッドで並列に行い、Blenderのデータ作成だけ順番に行う
+		filepaths = self.get_filepaths()
+		models = modelfile.read_model_files(filepaths)
+		timer.phase("read", files=len(filepaths))
 		
-		# ヘッダー
-		ext = common.read_str(file)
-		if ext != 'CM3D2_MESH':
-			self.report(type={'ERROR'}, message="これはカスタムメイド3D2のモデルファイルではありません")
+		# このインポートで作ったアーマチュア ((オブジェクト, ボーン名 → ボーン情報) のリスト)
+		armatures = []
+		imported_paths = []
+		for filepath, model in zip(filepaths, models):
+			if isinstance(model, modelfile.CM3D2ImportException):
+				message = str(model)
+			elif isinstance(model, Exception):
+				message = "ファイルを開くのに失敗しました、アクセス不可かファイルが存在しません"
+			else:
+				self.import_model(context, model, armatures, timer)
+				imported_paths.append(filepath)
+				continue
+			if len(filepaths) == 1:
+				self.report(type={'ERROR'}, message=message)
+				return {'CANCELLED'}
+			self.report(type={'WARNING'}, message=os.path.basename(filepath) + ": " + message)
+		if not imported_paths:
+			self.report(type={'ERROR'}, message="読み込めるmodelファイルがありませんでした")
 			return {'CANCELLED'}
-		struct.unpack('<i', file.read(4))[0]
-		context.window_manager.progress_update(0.1)
+		
+		timer.finish()
+		require_time_str = str(round(timer.total(), 1))
+		filesize = sum(os.path.getsize(filepath) for filepath in imported_paths)
+		filesize_str = str(filesize) + " バイト"
+		if 1024 * 1024 < filesize:
+			filesize_str = str(round(filesize / (1024 * 1024.0), 1)) + " MB"
+		elif 1024 < filesize:
+			filesize_str = str(round(filesize / 1024.0, 1)) + " KB"
+		if len(imported_paths) == 1:
+			self.report(type={'INFO'}, message="modelのインポートが完了しました (" + filesize_str + " / " + require_time_str + " 秒)")
+		else:
+			self.report(type={'INFO'}, message=str(len(imported_paths)) + "個のmodelのインポートが完了しました (" + filesize_str + " / " + require_time_str + " 秒)")
+		
+		return {'FINISHED'}
+	
+	def import_model(self, context, model, armatures, timer):
+		context.window_manager.progress_begin(0, 10)
+		context.window_manager.progress_update(0.5)
 		
 		# 名前群を取得
-		model_name1 = common.read_str(file)
-		model_name2 = common.read_str(file)
-		context.window_manager.progress_update(0.2)
+		model_name1 = model.name
+		model_name2 = model.base_bone_name
 		
-		# ボーン情報読み込み
+		# ボーン情報
 		bone_data = []
-		bone_count = struct.unpack('<i', file.read(4))[0]
-		for i in range(bone_count):
-			bone_data.append({})
-			bone_data[i]['name'] = common.read_str(file)
-			bone_data[i]['unknown'] = struct.unpack('<B', file.read(1))[0]
-		for i in range(bone_count):
-			parent_index = struct.unpack('<i', file.read(4))[0]
-			parent_name = None
-			if parent_index != -1:
-				parent_name = bone_data[parent_index]['name']
-			bone_data[i]['parent_index'] = parent_index
-			bone_data[i]['parent_name'] = parent_name
-		for i in range(bone_count):
-			x, y, z = struct.unpack('<3f', file.read(3*4))
-			bone_data[i]['co'] = mathutils.Vector((x, y, z))
-			
-			x, y, z = struct.unpack('<3f', file.read(3*4))
-			w = struct.unpack('<f', file.read(4))[0]
-			bone_data[i]['rot'] = mathutils.Quaternion((w, x, y, z))
-		context.window_manager.progress_update(0.3)
-		
-		vertex_count, mesh_count, local_bone_count = struct.unpack('<3i', file.read(3*4))
+		for i, name in enumerate(model.bone_names):
+			parent_index = int(model.bone_parents[i])
+			x, y, z, w = model.bone_rots[i].tolist()
+			bone_data.append({
+				'name': name,
+				'unknown': int(model.bone_unknowns[i]),
+				'parent_index': parent_index,
+				'parent_name': model.bone_names[parent_index] if parent_index != -1 else None,
+				'co': mathutils.Vector(model.bone_cos[i].tolist()),
+				'rot': mathutils.Quaternion((w, x, y, z)),
+				})
 		
-		# ローカルボーン情報読み込み
+		# ローカルボーン情報
 		local_bone_data = []
-		for i in range(local_bone_count):
-			local_bone_data.append({})
-			local_bone_data[i]['name'] = common.read_str(file)
-		for i in range(local_bone_count):
-			row0 = struct.unpack('<4f', file.read(4*4))
-			row1 = struct.unpack('<4f', file.read(4*4))
-			row2 = struct.unpack('<4f', file.read(4*4))
-			row3 = struct.unpack('<4f', file.read(4*4))
-			local_bone_data[i]['matrix'] = mathutils.Matrix([row0, row1, row2, row3])
-		context.window_manager.progress_update(0.4)
+		for name, matrix in zip(model.local_bone_names, model.local_bone_matrices):
+			local_bone_data.append({'name': name, 'matrix': mathutils.Matrix(matrix.tolist())})
 		
-		# 頂点情報読み込み
-		vertex_data = []
-		for i in range(vertex_count):
-			co = struct.unpack('<3f', file.read(3*4))
-			no = struct.unpack('<3f', file.read(3*4))
-			uv = struct.unpack('<2f', file.read(2*4))
-			vertex_data.append({'co': co, 'normal': no, 'uv': uv})
-		comparison_data = list(hash(repr(v['co'] + v['normal'])) for v in vertex_data)
-		comparison_counter = Counter(comparison_data)
-		comparison_data = list((comparison_counter[h] > 1) for h in comparison_data)
-		del comparison_counter
-		unknown_count = struct.unpack('<i', file.read(4))[0]
-		for i in range(unknown_count):
-			struct.unpack('<4f', file.read(4*4))
-		for i in range(vertex_count):
-			indexes = struct.unpack('<4H', file.read(4*2))
-			values  = struct.unpack('<4f', file.read(4*4))
-			vertex_data[i]['weights'] = list({
-					'index': index,
-					'value': value,
-					'name': local_bone_data[index]['name'],
-				} for index, value in zip(indexes, values))
-		context.window_manager.progress_update(0.5)
+		# 頂点情報
+		vertex_data = model.vertices
 		
-		# 面情報読み込み
-		face_data = []
-		for i in range(mesh_count):
-			face_count = int(struct.unpack('<i', file.read(4))[0] / 3)
-			face_data.append([tuple(reversed(struct.unpack('<3H', file.read(3*2)))) for j in range(face_count)])
-		context.window_manager.progress_update(0.6)
+		# 面情報 (元の頂点インデックスの (F, 3) の配列)
+		face_data = model.all_faces()
+		face_material_indices = model.face_material_indices()
 		
-		# マテリアル情報読み込み
-		material_data = []
-		material_count = struct.unpack('<i', file.read(4))[0]
-		for i in range(material_count):
-			material_data.append({})
-			material_data[i]['name1'] = common.read_str(file)
-			material_data[i]['name2'] = common.read_str(file)
-			material_data[i]['name3'] = common.read_str(file)
-			material_data[i]['data'] = []
-			while True:
-				data_type = common.read_str(file)
-				if data_type == 'tex':
-					material_data[i]['data'].append({'type':data_type})
-					material_data[i]['data'][-1]['name'] = common.read_str(file)
-					material_data[i]['data'][-1]['type2'] = common.read_str(file)
-					if material_data[i]['data'][-1]['type2'] == 'tex2d':
-						material_data[i]['data'][-1]['name2'] = common.read_str(file)
-						material_data[i]['data'][-1]['path'] = common.read_str(file)
-						material_data[i]['data'][-1]['color'] = struct.unpack('<4f', file.read(4*4))
-				elif data_type == 'col':
-					material_data[i]['data'].append({'type':data_type})
-					material_data[i]['data'][-1]['name'] = common.read_str(file)
-					material_data[i]['data'][-1]['color'] = struct.unpack('<4f', file.read(4*4))
-				elif data_type == 'f':
-					material_data[i]['data'].append({'type':data_type})
-					material_data[i]['data'][-1]['name'] = common.read_str(file)
-					material_data[i]['data'][-1]['float'] = struct.unpack('<f', file.read(4))[0]
-				else:
-					break
-		context.window_manager.progress_update(0.8)
+		# UVの切れ目で分かれている頂点を、位置と法線が完全に一致するものだけ結合する
+		if self.is_remove_doubles:
+			vertex_remap, vertex_first = modelfile.weld_vertices(vertex_data)
+			mesh_face_data = vertex_remap[face_data]
+			# 結合で潰れた面は取り除く
+			is_valid_face = (mesh_face_data[:, 0] != mesh_face_data[:, 1]) & (mesh_face_data[:, 1] != mesh_face_data[:, 2]) & (mesh_face_data[:, 2] != mesh_face_data[:, 0])
+			face_data = face_data[is_valid_face]
+			mesh_face_data = mesh_face_data[is_valid_face]
+			face_material_indices = face_material_indices[is_valid_face]
+			mesh_vertex_data = vertex_data[vertex_first]
+			mesh_weights = model.weights[vertex_first]
+		else:
+			vertex_remap = None
+			mesh_face_data = face_data
+			mesh_vertex_data = vertex_data
+			mesh_weights = model.weights
+		
+		# マテリアル情報
+		material_data = model.materials
 		
-		# その他情報読み込み
+		# その他情報
 		misc_data = []
-		while True:
-			data_type = common.read_str(file)
-			if data_type == 'morph':
-				misc_data.append({'type':data_type})
-				misc_data[-1]['name'] = common.read_str(file)
-				morph_vert_count = struct.unpack('<i', file.read(4))[0]
-				misc_data[-1]['data'] = []
-				for i in range(morph_vert_count):
-					misc_data[-1]['data'].append({})
-					misc_data[-1]['data'][i]['index'] = struct.unpack('<H', file.read(2))[0]
-					misc_data[-1]['data'][i]['co'] = mathutils.Vector(struct.unpack('<3f', file.read(3*4)))
-					misc_data[-1]['data'][i]['normal'] = struct.unpack('<3f', file.read(3*4))
-			else:
-				break
+		for name, data in model.morphs:
+			if vertex_remap is not None:
+				data = modelfile.remap_morph(data, vertex_remap)
+			misc_data.append({'type': 'morph', 'name': name, 'data': data})
 		
-		file.close()
 		context.window_manager.progress_update(1)
+		timer.phase("prepare", vertices=len(vertex_data), faces=len(face_data))
 		
 		try:
 			bpy.ops.object.mode_set(mode='OBJECT')
@@ -234,80 +218,83 @@ class import_cm3d2_model(bpy.types.Operator):
 		bpy.ops.object.select_all(action='DESELECT')
 		
 		# アーマチュア作成
+		is_merged_armature = False
 		if self.is_armature:
-			arm = bpy.data.armatures.new(model_name1 + ".armature")
-			arm_ob = bpy.data.objects.new(model_name1 + ".armature", arm)
-			bpy.context.scene.objects.link(arm_ob)
+			# 共通するボーンの情報が全て一致する、このインポートで作ったアーマチュアがあればそこにボーンを足す
+			bone_keys = {data['name']: (data['unknown'], data['parent_name'], tuple(data['co']), tuple(data['rot'])) for data in bone_data}
+			for other_ob, other_keys in armatures:
+				common_names = set(bone_keys) & set(other_keys)
+				if common_names and all(bone_keys[name] == other_keys[name] for name in common_names):
+					arm_ob, arm = other_ob, other_ob.data
+					other_keys.update(bone_keys)
+					is_merged_armature = True
+					break
+			else:
+				arm = bpy.data.armatures.new(model_name1 + ".armature")
+				arm_ob = bpy.data.objects.new(model_name1 + ".armature", arm)
+				bpy.context.scene.objects.link(arm_ob)
+				armatures.append((arm_ob, bone_keys))
 			arm_ob.select = True
 			bpy.context.scene.objects.active = arm_ob
 			bpy.ops.object.mode_set(mode='EDIT')
 			
-			# 基幹ボーンのみ作成
-			child_data = []
-			for data in bone_data:
-				if not data['parent_name']:
-					bone = arm.edit_bones.new(common.decode_bone_name(data['name'], self.is_convert_bone_weight_names))
-					bone.head, bone.tail = (0, 0, 0), (0, 1, 0)
-					
-					co = data['co'].copy() * self.scale
-					rot = data['rot']
-					
-					co_mat = mathutils.Matrix.Translation(co)
-					rot_mat = rot.to_matrix().to_4x4()
-					mat = co_mat * rot_mat
-					
-					fix_mat_scale = mathutils.Matrix.Scale(-1, 4, (1, 0, 0))
-					fix_mat_before = mathutils.Euler((math.radians(90), 0, 0), 'XYZ').to_matrix().to_4x4()
-					fix_mat_after = mathutils.Euler((0, 0, math.radians(90)), 'XYZ').to_matrix().to_4x4()
-					
-					bone.matrix = fix_mat_scale * fix_mat_before * mat * fix_mat_after
-					
-					if data['unknown']: bone["UnknownFlag"] = 1
-					else: bone["UnknownFlag"] = 0
-				else:
-					child_data.append(data)
-			context.window_manager.progress_update(1.333)
+			# 親が先に来るように作成順を決める (親が見つからないボーンは作成しない)
+			bone_names = [common.decode_bone_name(data['name'], self.is_convert_bone_weight_names) for data in bone_data]
+			bone_order = [i for i, data in enumerate(bone_data) if data['parent_index'] == -1]
+			is_ordered = [data['parent_index'] == -1 for data in bone_data]
+			remaining = [i for i, data in enumerate(bone_data) if data['parent_index'] != -1]
+			while remaining:
+				next_remaining = []
+				for i in remaining:
+					parent_index = bone_data[i]['parent_index']
+					if 0 <= parent_index < len(bone_data) and is_ordered[parent_index]:
+						bone_order.append(i)
+						is_ordered[i] = True
+					else:
+						next_remaining.append(i)
+				if len(next_remaining) == len(remaining):
+					break
+				remaining = next_remaining
 			
-			# 子ボーンを追加していく
-			while len(child_data):
-				data = child_data.pop(0)
-				if common.decode_bone_name(data['parent_name'], self.is_convert_bone_weight_names) in arm.edit_bones:
-					bone = arm.edit_bones.new(common.decode_bone_name(data['name'], self.is_convert_bone_weight_names))
-					parent = arm.edit_bones[common.decode_bone_name(data['parent_name'], self.is_convert_bone_weight_names)]
-					bone.parent = parent
+			fix_mat_scale = mathutils.Matrix.Scale(-1, 4, (1, 0, 0))
+			fix_mat_before = mathutils.Euler((math.radians(90), 0, 0), 'XYZ').to_matrix().to_4x4()
+			fix_mat_after = mathutils.Euler((0, 0, math.radians(90)), 'XYZ').to_matrix().to_4x4()
+			fix_mat = fix_mat_scale * fix_mat_before
+			
+			# 親の行列を使い回してボーンを作成していく
+			edit_bones = {}
+			world_mats = {}
+			created_bone_names = set()
+			for progress_index, i in enumerate(bone_order):
+				data = bone_data[i]
+				parent_index = data['parent_index']
+				local_mat = mathutils.Matrix.Translation(data['co']) * data['rot'].to_matrix().to_4x4()
+				if parent_index == -1:
+					world_mats[i] = local_mat
+				else:
+					world_mats[i] = world_mats[parent_index] * local_mat
+				
+				# まとめる先のアーマチュアに既にあるボーンはそのまま使う
+				if is_merged_armature and bone_names[i] in arm.edit_bones:
+					edit_bones[i] = arm.edit_bones[bone_names[i]]
+				else:
+					bone = arm.edit_bones.new(bone_names[i])
 					bone.head, bone.tail = (0, 0, 0), (0, 1, 0)
+					if parent_index == -1:
+						mat = mathutils.Matrix.Translation(data['co'] * self.scale) * data['rot'].to_matrix().to_4x4()
+					else:
+						bone.parent = edit_bones[parent_index]
+						mat = world_mats[i] * self.scale
+					edit_bones[i] = bone
+					created_bone_names.add(bone.name)
 					
-					parent_mats = []
-					current_bone = bone
-					while current_bone:
-						for b in bone_data:
-							if common.decode_bone_name(b['name'], self.is_convert_bone_weight_names) == current_bone.name:
-								local_co = b['co'].copy()
-								local_rot = b['rot'].copy()
-								break
-						
-						local_co_mat = mathutils.Matrix.Translation(local_co)
-						local_rot_mat = local_rot.to_matrix().to_4x4()
-						parent_mats.append(local_co_mat * local_rot_mat)
-						
-						current_bone = current_bone.parent
-					parent_mats.reverse()
-					
-					mat = mathutils.Matrix()
-					for local_mat in parent_mats:
-						mat *= local_mat
-					mat *= self.scale
-					
-					fix_mat_scale = mathutils.Matrix.Scale(-1, 4, (1, 0, 0))
-					fix_mat_before = mathutils.Euler((math.radians(90), 0, 0), 'XYZ').to_matrix().to_4x4()
-					fix_mat_after = mathutils.Euler((0, 0, math.radians(90)), 'XYZ').to_matrix().to_4x4()
-					
-					bone.matrix = fix_mat_scale * fix_mat_before * mat * fix_mat_after
+					bone.matrix = fix_mat * mat * fix_mat_after
 					
 					if data['unknown']: bone["UnknownFlag"] = 1
 					else: bone["UnknownFlag"] = 0
-				else:
-					child_data.append(data)
+				
+				if progress_index == len(bone_order) // 2:
+					context.window_manager.progress_update(1.333)
 			context.window_manager.progress_update(1.666)
 			
 			# ボーン整頓
@@ -337,12 +324,9 @@ class import_cm3d2_model(bpy.types.Operator):
 			
 			# 一部ボーン削除
 			if self.is_armature_clean:
-				for bone in arm.edit_bones:
-					for b in local_bone_data:
-						name = common.decode_bone_name(b['name'], self.is_convert_bone_weight_names)
-						if bone.name == name:
-							break
-					else:
+				local_bone_name_set = set(common.decode_bone_name(b['name'], self.is_convert_bone_weight_names) for b in local_bone_data)
+				for bone in arm.edit_bones[:]:
+					if bone.name in created_bone_names and bone.name not in local_bone_name_set:
 						arm.edit_bones.remove(bone)
 			
 			arm.layers[16] = True
@@ -351,29 +335,25 @@ class import_cm3d2_model(bpy.types.Operator):
 			bpy.ops.armature.select_all(action='DESELECT')
 			bpy.ops.object.mode_set(mode='OBJECT')
 		context.window_manager.progress_update(2)
+		timer.phase("armature", bones=len(bone_data))
 		
 		if self.is_mesh:
 			# メッシュ作成
 			me = context.blend_data.meshes.new(model_name1)
-			verts, faces = [], []
-			for data in vertex_data:
-				co = list(data['co'][:])
-				co[0] = -co[0]
-				co[0] *= self.scale
-				co[1] *= self.scale
-				co[2] *= self.scale
-				verts.append(co)
+			verts = mesh_vertex_data['co'] * (-self.scale, self.scale, self.scale)
+			verts = verts.tolist()
 			context.window_manager.progress_update(2.25)
-			for data in face_data:
-				faces.extend(data)
+			faces = mesh_face_data.tolist()
 			context.window_manager.progress_update(2.5)
 			me.from_pydata(verts, [], faces)
+			# 面のマテリアル番号とスムーズを一括で設定
+			me.polygons.foreach_set('material_index', face_material_indices)
+			me.polygons.foreach_set('use_smooth', [True] * len(me.polygons))
 			# オブジェクト化
 			ob = context.blend_data.objects.new(model_name1, me)
 			context.scene.objects.link(ob)
 			ob.select = True
 			context.scene.objects.active = ob
-			bpy.ops.object.shade_smooth()
 			context.window_manager.progress_update(2.75)
 			# オブジェクト変形
 			for bone in bone_data:
@@ -391,60 +371,60 @@ class import_cm3d2_model(bpy.types.Operator):
 					
 					break
 			context.window_manager.progress_update(3)
+			timer.phase("mesh", vertices=len(me.vertices), faces=len(me.polygons))
 			
 			# 頂点グループ作成
-			for data in local_bone_data:
-				ob.vertex_groups.new(common.decode_bone_name(data['name'], self.is_convert_bone_weight_names))
+			# 割り当てのない頂点グループは最初から作らない
+			local_bone_names = [common.decode_bone_name(data['name'], self.is_convert_bone_weight_names) for data in local_bone_data]
+			used_local_bones = set(modelfile.used_local_bones(mesh_weights).tolist())
+			for index, name in enumerate(local_bone_names):
+				if not self.is_remove_empty_vertex_group or index in used_local_bones:
+					ob.vertex_groups.new(name)
+			vertex_groups = {index: ob.vertex_groups[local_bone_names[index]] for index in used_local_bones}
 			context.window_manager.progress_update(3.333)
-			for vert_index, data in enumerate(vertex_data):
-				for weight in data['weights']:
-					if 0.0 < weight['value']:
-						vertex_group = ob.vertex_groups[common.decode_bone_name(weight['name'], self.is_convert_bone_weight_names)]
-						vertex_group.add([vert_index], weight['value'], 'REPLACE')
+			# 同じボーン/同じウェイト値の頂点はまとめて割り当てる
+			for local_bone_index, value, vert_indices in modelfile.group_weights(mesh_weights):
+				vertex_groups[local_bone_index].add(vert_indices.tolist(), value, 'REPLACE')
 			context.window_manager.progress_update(3.666)
 			if self.is_vertex_group_sort:
 				bpy.ops.object.vertex_group_sort(sort_type='NAME')
-			if self.is_remove_empty_vertex_group:
-				for vg in ob.vertex_groups[:]:
-					for vert in me.vertices:
-						for group in vert.groups:
-							if group.group == vg.index:
-								if 0.0 < group.weight:
-									break
-						else:
-							continue
-						break
-					else:
-						ob.vertex_groups.remove(vg)
 			ob.vertex_groups.active_index = 0
 			context.window_manager.progress_update(4)
+			timer.phase("vertex_groups", vertices=len(me.vertices), bones=len(local_bone_data))
 			
-			# UV作成
-			bpy.ops.mesh.uv_texture_add()
-			bm = bmesh.new()
-			bm.from_mesh(me)
-			for face in bm.faces:
-				for loop in face.loops:
-					loop[bm.loops.layers.uv.active].uv = vertex_data[loop.vert.index]['uv']
-			bm.to_mesh(me)
-			bm.free()
+			# UV作成 (結合前の頂点の UV を面の角毎に設定)
+			me.uv_textures.new()
+			loop_uvs = vertex_data['uv'][face_data]
+			me.uv_layers.active.data.foreach_set('uv', loop_uvs.ravel())
+			# UVが繋がっていない辺にシームをつける
+			if self.is_seam:
+				seam_edges = modelfile.uv_seam_edges(mesh_face_data, loop_uvs)
+				edge_vertices = numpy.empty((len(me.edges), 2), dtype=numpy.int64)
+				me.edges.foreach_get('vertices', edge_vertices.ravel())
+				edge_vertices.sort(axis=1)
+				stride = len(me.vertices)
+				use_seams = numpy.in1d(edge_vertices[:, 0] * stride + edge_vertices[:, 1], seam_edges[:, 0] * stride + seam_edges[:, 1])
+				me.edges.foreach_set('use_seam', use_seams.tolist())
 			context.window_manager.progress_update(5)
+			timer.phase("uv", vertices=len(me.vertices), faces=len(me.polygons))
 			
 			# モーフ追加
 			morph_count = 0
+			base_verts = numpy.empty((len(me.vertices), 3), dtype=numpy.float32)
+			me.vertices.foreach_get('co', base_verts.ravel())
 			for data in misc_data:
 				if data['type'] == 'morph':
 					if morph_count == 0:
 						bpy.ops.object.shape_key_add(from_mix=False)
 						me.shape_keys.name = model_name1
 					shape_key = ob.shape_key_add(name=data['name'], from_mix=False)
-					for vert in data['data']:
-						co = vert['co']
-						co.x = -co.x
-						co *= self.scale
-						shape_key.data[vert['index']].co = shape_key.data[vert['index']].co + co
+					# 基本形の座標に差分をまとめて足し、一括で書き込む
+					morph_verts = base_verts.copy()
+					numpy.add.at(morph_verts, data['data']['index'].astype(numpy.int64), data['data']['co'] * (-self.scale, self.scale, self.scale))
+					shape_key.data.foreach_set('co', morph_verts.ravel())
 					morph_count += 1
 			context.window_manager.progress_update(6)
+			timer.phase("morphs", vertices=len(me.vertices), shape_keys=morph_count)
 			
 			# マテリアル追加
 			progress_count_total = 0.0
@@ -453,9 +433,8 @@ class import_cm3d2_model(bpy.types.Operator):
 			progress_plus_value = 1.0 / progress_count_total
 			progress_count = 6.0
 			
-			tex_storage_files = common.get_tex_storage_files()
+			tex_storage_index = common.get_tex_index()
 			
-			face_seek = 0
 			for index, data in enumerate(material_data):
 				override = context.copy()
 				override['object'] = ob
@@ -465,10 +444,6 @@ class import_cm3d2_model(bpy.types.Operator):
 				mate['shader2'] = data['name3']
 				
 				ob.material_slots[-1].material = mate
-				# 面にマテリアル割り当て
-				for i in range(face_seek, face_seek + len(face_data[index])):
-					me.polygons[i].material_index = index
-				face_seek += len(face_data[index])
 				
 				# テクスチャ追加
 				already_texs = []
@@ -495,10 +470,10 @@ class import_cm3d2_model(bpy.types.Operator):
 							
 							# tex探し
 							if self.is_replace_cm3d2_tex:
-								if common.replace_cm3d2_tex(img, tex_storage_files) and tex_data['name']=='_MainTex':
-									for face in me.polygons:
-										if face.material_index == index:
-											me.uv_textures.active.data[face.index].image = img
+								if common.replace_cm3d2_tex(img, tex_storage_index) and tex_data['name']=='_MainTex':
+									uv_texture_data = me.uv_textures.active.data
+									for face_index in numpy.flatnonzero(face_material_indices == index).tolist():
+										uv_texture_data[face_index].image = img
 					
 					elif tex_data['type'] == 'col':
 						slot = mate.texture_slots.create(tex_index)
@@ -523,23 +498,12 @@ class import_cm3d2_model(bpy.types.Operator):
 				common.decorate_material(mate, self.is_decorate, me, index)
 			ob.active_material_index = 0
 			context.window_manager.progress_update(7)
+			timer.phase("materials", materials=len(material_data))
 			
-			# メッシュ整頓
-			if self.is_remove_doubles:
-				for is_comparison, vert in zip(comparison_data, me.vertices):
-					if is_comparison:
-						vert.select = True
-				bpy.ops.object.mode_set(mode='EDIT')
-				bpy.ops.mesh.remove_doubles(threshold=0.000001)
-				bpy.ops.object.mode_set(mode='OBJECT')
-			if self.is_seam:
-				bpy.ops.object.mode_set(mode='EDIT')
-				bpy.ops.mesh.select_all(action='SELECT')
-				bpy.ops.uv.seams_from_islands()
-				bpy.ops.object.mode_set(mode='OBJECT')
-			bpy.ops.object.mode_set(mode='EDIT')
-			bpy.ops.mesh.select_all(action='DESELECT')
-			bpy.ops.object.mode_set(mode='OBJECT')
+			# メッシュ整頓 (選択を解除)
+			me.vertices.foreach_set('select', [False] * len(me.vertices))
+			me.edges.foreach_set('select', [False] * len(me.edges))
+			me.polygons.foreach_set('select', [False] * len(me.polygons))
 			
 			if self.is_armature:
 				mod = ob.modifiers.new("Armature", 'ARMATURE')
@@ -584,6 +548,10 @@ class import_cm3d2_model(bpy.types.Operator):
 				txt.current_line_index = 0
 		context.window_manager.progress_update(9)
 		
+		# 他のmodelとアーマチュアをまとめた場合、メッシュは自分のボーン情報を必ず持つ (エクスポート時にそれを使う)
+		is_bone_data_obj_property = self.is_mesh and (self.is_bone_data_obj_property or is_merged_armature)
+		bone_lines, local_bone_lines = [], []
+		
 		# ボーン情報のテキスト埋め込み
 		if self.is_bone_data_text:
 			if "BoneData" in context.blend_data.texts:
@@ -601,16 +569,18 @@ class import_cm3d2_model(bpy.types.Operator):
 			s += " ".join([str(data['co'][0]), str(data['co'][1]), str(data['co'][2])]) + ","
 			s += " ".join([str(data['rot'][0]), str(data['rot'][1]), str(data['rot'][2]), str(data['rot'][3])])
 			
+			bone_lines.append(s)
 			if self.is_bone_data_text:
 				txt.write(s + "\n")
-			if self.is_mesh and self.is_bone_data_obj_property:
+			if is_bone_data_obj_property and not self.is_bone_data_array:
 				ob["BoneData:" + str(i)] = s
-			if self.is_armature and self.is_bone_data_arm_property:
+			if self.is_armature and self.is_bone_data_arm_property and not is_merged_armature and not self.is_bone_data_array:
 				arm["BoneData:" + str(i)] = s
 		if self.is_bone_data_text:
 			txt['BaseBone'] = model_name2
 			txt.current_line_index = 0
 		context.window_manager.progress_update(10)
+		timer.phase("texts", bones=len(bone_data))
 		
 		# ローカルボーン情報のテキスト埋め込み
 		if self.is_bone_data_text:
@@ -630,33 +600,90 @@ class import_cm3d2_model(bpy.types.Operator):
 				mat_list[j] = str(f)
 			s += " ".join(mat_list)
 			
+			local_bone_lines.append(s)
 			if self.is_bone_data_text:
 				txt.write(s + "\n")
-			if self.is_mesh and self.is_bone_data_obj_property:
+			if is_bone_data_obj_property and not self.is_bone_data_array:
 				ob["LocalBoneData:" + str(i)] = s
-			if self.is_armature and self.is_bone_data_arm_property:
+			if self.is_armature and self.is_bone_data_arm_property and not is_merged_armature and not self.is_bone_data_array:
 				arm["LocalBoneData:" + str(i)] = s
 		if self.is_bone_data_text:
 			txt['BaseBone'] = model_name2
 			txt.current_line_index = 0
 		
-		if self.is_mesh and self.is_bone_data_obj_property:
+		# カスタムプロパティに配列でまとめて保存
+		if self.is_bone_data_array:
+			array_local_bone_data = [{'name': data['name'], 'matrix': [f for row in data['matrix'] for f in row]} for data in local_bone_data]
+			if is_bone_data_obj_property:
+				common.set_bone_data_arrays(ob, bone_data, array_local_bone_data)
+			if self.is_armature and self.is_bone_data_arm_property and not is_merged_armature:
+				common.set_bone_data_arrays(arm, bone_data, array_local_bone_data)
+		
+		if is_bone_data_obj_property:
 			ob['BaseBone'] = model_name2
-		if self.is_armature and self.is_bone_data_arm_property:
+		if self.is_armature and self.is_bone_data_arm_property and not is_merged_armature:
 			arm['BaseBone'] = model_name2
-		context.window_manager.progress_end()
 		
-		require_time_str = str(round(time.time() - start_time, 1))
-		filesize = os.path.getsize(self.filepath)
-		filesize_str = str(filesize) + " バイト"
-		if 1024 * 1024 < filesize:
-			filesize_str = str(round(filesize / (1024 * 1024.0), 1)) + " MB"
-		elif 1024 < filesize:
-			filesize_str = str(round(filesize / 1024.0, 1)) + " KB"
-		self.report(type={'INFO'}, message="modelのインポートが完了しました (" + filesize_str + " / " + require_time_str + " 秒)")
+		# まとめたアーマチュアのボーン情報には、このmodelで増えたボーンを足す
+		if self.is_armature and self.is_bone_data_arm_property and is_merged_armature:
+			common.add_bone_data_lines(arm, bone_lines, local_bone_lines, self.is_bone_data_array)
+		context.window_manager.progress_end()
+
+class import_cm3d2_model_info(bpy.types.Operator):
+	bl_idname = 'text.import_cm3d2_model_info'
+	bl_label = "model情報を開く"
+	bl_description = "modelファイルのボーン・マテリアル・モーフの名前だけを読み込んでテキストとして開きます"
+	bl_options = {'REGISTER', 'UNDO'}
+	
+	filepath = bpy.props.StringProperty(subtype='FILE_PATH')
+	filename_ext = ".model"
+	filter_glob = bpy.props.StringProperty(default="*.model", options={'HIDDEN'})
+	
+	@classmethod
+	def poll(cls, context):
+		return True
+	
+	def invoke(self, context, event):
+		if common.preferences().model_default_path:
+			self.filepath = common.default_cm3d2_dir(common.preferences().model_default_path, "", "model")
+		else:
+			self.filepath = common.default_cm3d2_dir(common.preferences().model_import_path, "", "model")
+		context.window_manager.fileselect_add(self)
+		return {'RUNNING_MODAL'}
+	
+	def execute(self, context):
+		# 頂点やモーフ本体は読まずに名前群だけを取得
+		try:
+			with modelfile.ModelFileReader(self.filepath) as reader:
+				lines = [reader.name, reader.base_bone_name, ""]
+				lines.append("頂点数: " + str(reader.vertex_count))
+				lines.append("")
+				lines.append("BoneData")
+				lines.extend("\t" + name for name in reader.bone_names)
+				lines.append("LocalBoneData")
+				lines.extend("\t" + name for name in reader.local_bone_names)
+				lines.append("Material")
+				lines.extend("\t" + data['name1'] + " (" + data['name2'] + ")" for data in reader.materials)
+				lines.append("Morph")
+				lines.extend("\t" + name for name in reader.morph_names)
+		except OSError:
+			self.report(type={'ERROR'}, message="ファイルを開くのに失敗しました、アクセス不可かファイルが存在しません")
+			return {'CANCELLED'}
+		except modelfile.CM3D2ImportException as e:
+			self.report(type={'ERROR'}, message=str(e))
+			return {'CANCELLED'}
 		
+		txt = context.blend_data.texts.new(os.path.basename(self.filepath))
+		txt.write("\n".join(lines) + "\n")
+		txt.current_line_index = 0
+		if 'space_data' in dir(context) and context.space_data and context.space_data.type == 'TEXT_EDITOR':
+			context.space_data.text = txt
 		return {'FINISHED'}
 
 # メニューを登録する関数
 def menu_func(self, context):
 	self.layout.operator(import_cm3d2_model.bl_idname, icon_value=common.preview_collections['main']['KISS'].icon_id)
+
+# テキストメニューに項目を登録
+def TEXT_MT_text(self, context):
+	self.layout.operator(import_cm3d2_model_info.bl_idname, icon_value=common.preview_collections['main']['KISS'].icon_id)
@@ -0,0 +1,734 @@
+# .model ファイルの読み書き (bpy非依存)
+import os
+import mmap
+import time
+import numpy
+import concurrent.futures
+from . import binaryio
+from . import fileutil
+from .binaryio import BinaryReader, BinaryWriter, CM3D2ImportException, as_reader, as_writer
+
+# 頂点データの並び (位置, 法線, UV)
+VERTEX_DTYPE = numpy.dtype([('co', '<f4', (3,)), ('normal', '<f4', (3,)), ('uv', '<f4', (2,))])
+# ウェイトデータの並び (ローカルボーンのインデックス4つ, ウェイト値4つ)
+WEIGHT_DTYPE = numpy.dtype([('index', '<u2', (4,)), ('value', '<f4', (4,))])
+# モーフデータの並び (頂点インデックス, 位置差分, 法線差分)
+MORPH_DTYPE = numpy.dtype([('index', '<u2'), ('co', '<f4', (3,)), ('normal', '<f4', (3,))])
+
+class ModelData:
+	"""読み込んだ .model の内容を保持するクラス"""
+
+	def __init__(self):
+		self.version = 0
+		self.name = ""
+		self.base_bone_name = ""
+		# ボーン情報 (名前, 不明フラグ, 親インデックス, 位置, 回転(x, y, z, w))
+		self.bone_names = []
+		self.bone_unknowns = numpy.zeros(0, dtype=numpy.uint8)
+		self.bone_parents = numpy.zeros(0, dtype=numpy.int32)
+		self.bone_cos = numpy.zeros((0, 3), dtype=numpy.float32)
+		self.bone_rots = numpy.zeros((0, 4), dtype=numpy.float32)
+		# ローカルボーン情報 (名前, 4x4行列)
+		self.local_bone_names = []
+		self.local_bone_matrices = numpy.zeros((0, 4, 4), dtype=numpy.float32)
+		# 頂点/ウェイト情報 (VERTEX_DTYPE, WEIGHT_DTYPE の構造化配列)
+		self.vertices = numpy.zeros(0, dtype=VERTEX_DTYPE)
+		self.unknown_data = numpy.zeros((0, 4), dtype=numpy.float32)
+		self.weights = numpy.zeros(0, dtype=WEIGHT_DTYPE)
+		# マテリアル毎の面インデックス (<u2 の配列)
+		self.face_indices = []
+		# マテリアル情報 (辞書のリスト)
+		self.materials = []
+		# モーフ情報 ((名前, MORPH_DTYPE の構造化配列) のリスト)
+		self.morphs = []
+
+	@property
+	def vertex_count(self):
+		return len(self.vertices)
+
+	@property
+	def face_count(self):
+		return sum(len(indices) for indices in self.face_indices) // 3
+
+	def faces(self, mesh_index):
+		"""マテリアル毎の三角面を (N, 3) の配列で返す (Blender向けに頂点順は反転済み)"""
+		return self.face_indices[mesh_index].reshape(-1, 3)[:, ::-1]
+
+	def all_faces(self):
+		"""全マテリアルの三角面を連結して返す"""
+		if not self.face_indices:
+			return numpy.zeros((0, 3), dtype=numpy.uint16)
+		return numpy.concatenate([self.faces(i) for i in range(len(self.face_indices))])
+
+	def face_material_indices(self):
+		"""面毎のマテリアルインデックスを返す"""
+		counts = [len(indices) // 3 for indices in self.face_indices]
+		return numpy.repeat(numpy.arange(len(counts), dtype=numpy.int32), counts)
+
+def read_material(reader):
+	"""マテリアル1つ分を辞書で返す"""
+	material = {
+		'name1': reader.read_str(),
+		'name2': reader.read_str(),
+		'name3': reader.read_str(),
+		'data': [],
+		}
+	while True:
+		data_type = reader.read_str()
+		if data_type == 'tex':
+			tex_data = {'type': data_type, 'name': reader.read_str(), 'type2': reader.read_str()}
+			if tex_data['type2'] == 'tex2d':
+				tex_data['name2'] = reader.read_str()
+				tex_data['path'] = reader.read_str()
+				tex_data['color'] = reader.unpack(binaryio.FLOAT4)
+			material['data'].append(tex_data)
+		elif data_type == 'col':
+			material['data'].append({
+				'type': data_type,
+				'name': reader.read_str(),
+				'color': reader.unpack(binaryio.FLOAT4),
+				})
+		elif data_type == 'f':
+			material['data'].append({
+				'type': data_type,
+				'name': reader.read_str(),
+				'float': reader.read_float(),
+				})
+		else:
+			break
+	return material
+
+def read_model(file):
+	"""ファイルオブジェクト (または BinaryReader) から .model を読み込み ModelData を返す"""
+	reader = as_reader(file)
+	model = ModelData()
+
+	# ヘッダー
+	if reader.read_str() != 'CM3D2_MESH':
+		raise CM3D2ImportException("これはカスタムメイド3D2のモデルファイルではありません")
+	model.version = reader.read_int()
+	model.name = reader.read_str()
+	model.base_bone_name = reader.read_str()
+
+	# ボーン情報
+	bone_count = reader.read_int()
+	unknowns = []
+	for i in range(bone_count):
+		model.bone_names.append(reader.read_str())
+		unknowns.append(reader.read_uint8())
+	model.bone_unknowns = numpy.array(unknowns, dtype=numpy.uint8)
+	model.bone_parents = reader.read_array('<i4', bone_count)
+	transforms = reader.read_array('<f4', bone_count * 7).reshape(bone_count, 7)
+	model.bone_cos = transforms[:, :3]
+	model.bone_rots = transforms[:, 3:]
+
+	vertex_count, mesh_count, local_bone_count = (reader.read_int() for i in range(3))
+
+	# ローカルボーン情報
+	model.local_bone_names = [reader.read_str() for i in range(local_bone_count)]
+	model.local_bone_matrices = reader.read_array('<f4', local_bone_count * 16).reshape(local_bone_count, 4, 4)
+
+	# 頂点情報
+	model.vertices = reader.read_array(VERTEX_DTYPE, vertex_count)
+	unknown_count = reader.read_int()
+	model.unknown_data = reader.read_array('<f4', unknown_count * 4).reshape(unknown_count, 4)
+	model.weights = reader.read_array(WEIGHT_DTYPE, vertex_count)
+
+	# 面情報
+	for i in range(mesh_count):
+		model.face_indices.append(reader.read_array('<u2', reader.read_int()))
+
+	# マテリアル情報
+	material_count = reader.read_int()
+	for i in range(material_count):
+		model.materials.append(read_material(reader))
+
+	# その他情報
+	while True:
+		data_type = reader.read_str()
+		if data_type != 'morph':
+			break
+		name = reader.read_str()
+		model.morphs.append((name, reader.read_array(MORPH_DTYPE, reader.read_int())))
+
+	return model
+
+def read_model_file(filepath):
+	"""ファイルパスを指定して .model を読み込む"""
+	with binaryio.open_reader(filepath) as reader:
+		return read_model(reader)
+
+def read_model_files(filepaths, max_workers=4):
+	"""複数の .model をスレッドで並列に読み込む
+	ファイル毎に ModelData か、読み込みに失敗した時の例外を入れたリストを返します。
+	"""
+	def read(filepath):
+		try:
+			return read_model_file(filepath)
+		except (IOError, OSError, ValueError, CM3D2ImportException) as e:
+			return e
+	if len(filepaths) <= 1:
+		return [read(filepath) for filepath in filepaths]
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+		return list(executor.map(read, filepaths))
+
+def build_vertex_array(cos, normals, uvs):
+	"""位置, 法線, UV の配列から頂点データの構造化配列を作る"""
+	vertices = numpy.empty(len(cos), dtype=VERTEX_DTYPE)
+	vertices['co'] = numpy.reshape(cos, (-1, 3))
+	vertices['normal'] = numpy.reshape(normals, (-1, 3))
+	vertices['uv'] = numpy.reshape(uvs, (-1, 2))
+	return vertices
+
+def build_weight_array(indices, values):
+	"""ローカルボーンのインデックスとウェイト値の (N, 4) 配列からウェイトデータを作る"""
+	weights = numpy.empty(len(indices), dtype=WEIGHT_DTYPE)
+	weights['index'] = numpy.reshape(indices, (-1, 4))
+	weights['value'] = numpy.reshape(values, (-1, 4))
+	return weights
+
+def build_morph_array(indices, cos, normals):
+	"""頂点インデックス, 位置差分, 法線差分の配列からモーフデータを作る"""
+	morph = numpy.empty(len(indices), dtype=MORPH_DTYPE)
+	morph['index'] = indices
+	morph['co'] = numpy.reshape(cos, (-1, 3))
+	morph['normal'] = numpy.reshape(normals, (-1, 3))
+	return morph
+
+def weld_vertices(vertices):
+	"""位置と法線が完全に一致する頂点をまとめる
+	(元の頂点 → まとめた頂点のインデックス, まとめた頂点毎の元の頂点のインデックス) を返します。
+	まとめた頂点は元の並びで最初に現れた順に並びます。
+	"""
+	count = len(vertices)
+	if not count:
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	keys = numpy.column_stack((vertices['co'], vertices['normal']))
+	order = numpy.lexsort(keys.T[::-1])
+	sorted_keys = keys[order]
+	is_new = numpy.concatenate(([True], (sorted_keys[1:] != sorted_keys[:-1]).any(axis=1)))
+	group_ids = numpy.cumsum(is_new) - 1
+	# グループ毎に最初に現れた頂点を代表にする
+	first_indices = numpy.full(group_ids[-1] + 1, count, dtype=numpy.int64)
+	numpy.minimum.at(first_indices, group_ids, order)
+	rank = numpy.empty(len(first_indices), dtype=numpy.int64)
+	rank[numpy.argsort(first_indices, kind='mergesort')] = numpy.arange(len(first_indices))
+	remap = numpy.empty(count, dtype=numpy.int64)
+	remap[order] = rank[group_ids]
+	return remap, numpy.sort(first_indices)
+
+def remap_morph(morph, remap):
+	"""モーフの頂点インデックスを remap で付け替える (同じ頂点への重複は最初のものを残す)"""
+	indices = remap[morph['index']]
+	first = numpy.sort(numpy.unique(indices, return_index=True)[1])
+	result = morph[first].copy()
+	result['index'] = indices[first]
+	return result
+
+def uv_seam_edges(faces, loop_uvs):
+	"""UV が繋がっていない辺を (N, 2) の頂点インデックスの配列で返す
+	faces は (F, 3) の頂点インデックス、loop_uvs は (F, 3, 2) の面の角毎の UV です。
+	"""
+	faces = numpy.asarray(faces, dtype=numpy.int64)
+	if not len(faces):
+		return numpy.zeros((0, 2), dtype=numpy.int64)
+	v0 = faces.ravel()
+	v1 = faces[:, [1, 2, 0]].ravel()
+	uv0 = loop_uvs.reshape(-1, 2)
+	uv1 = loop_uvs[:, [1, 2, 0]].reshape(-1, 2)
+	# 辺の向きを揃えて、同じ辺の UV が全て一致するか比べる
+	swap = v1 < v0
+	low = numpy.where(swap, v1, v0)
+	high = numpy.where(swap, v0, v1)
+	uvs = numpy.where(swap[:, None], numpy.column_stack((uv1, uv0)), numpy.column_stack((uv0, uv1)))
+	stride = int(faces.max()) + 1
+	keys = low * stride + high
+	order = numpy.argsort(keys, kind='mergesort')
+	keys, uvs = keys[order], uvs[order]
+	is_new = numpy.concatenate(([True], keys[1:] != keys[:-1]))
+	first = numpy.flatnonzero(is_new)[numpy.cumsum(is_new) - 1]
+	mismatch = (uvs != uvs[first]).any(axis=1)
+	seam_keys = numpy.unique(keys[mismatch])
+	return numpy.column_stack((seam_keys // stride, seam_keys % stride))
+
+def split_vertices_by_uv(loop_vertex_indices, loop_uvs):
+	"""面の角毎の (頂点インデックス, UV) の組み合わせ毎に CM3D2 の頂点を作る
+	(書き出す頂点毎の元の頂点インデックス, 書き出す頂点毎の UV, 面の角 → 書き出す頂点のインデックス) を返します。
+	書き出す頂点は元の頂点インデックス順に並び、同じ頂点の UV 違いは続けて並びます。
+	"""
+	loop_uvs = numpy.asarray(loop_uvs, dtype=numpy.float32).reshape(-1, 2)
+	rows = numpy.empty(len(loop_uvs), dtype=[('index', '<i8'), ('u', '<f4'), ('v', '<f4')])
+	rows['index'] = loop_vertex_indices
+	rows['u'] = loop_uvs[:, 0]
+	rows['v'] = loop_uvs[:, 1]
+	# -0.0 と 0.0 を同じ UV として扱う
+	rows['u'] += 0.0
+	rows['v'] += 0.0
+	split_rows, loop_split_indices = numpy.unique(rows, return_inverse=True)
+	split_uvs = numpy.column_stack((split_rows['u'], split_rows['v']))
+	return split_rows['index'], split_uvs, loop_split_indices
+
+def strip_triangles(total):
+	"""total 角形の面を両端から交互に詰めていく帯状の三角面 (面の角の位置の (total - 2, 3) 配列) に分ける"""
+	tris = []
+	seek_min, seek_max = 0, total - 1
+	for i in range(total - 2):
+		if not i % 2:
+			tris.append([seek_min, seek_min + 1, seek_max])
+			seek_min += 1
+		else:
+			tris.append([seek_min, seek_max - 1, seek_max])
+			seek_max -= 1
+	return numpy.array(tris, dtype=numpy.int64).reshape(-1, 3)
+
+def triangulate_faces(loop_starts, loop_totals, quad_diagonals):
+	"""多角形の面を三角面に分ける
+	(三角面毎の面の角のインデックスの (T, 3) 配列, 三角面毎の元の面のインデックス) を返し、三角面は元の面の順に並びます。
+	面の角は逆順 (CM3D2 の向き) にしてから分け、四角面は quad_diagonals が True なら
+	[0, 1, 2], [0, 2, 3]、False なら [0, 1, 3], [1, 2, 3] の組み合わせを使います。
+	"""
+	loop_starts = numpy.asarray(loop_starts, dtype=numpy.int64)
+	loop_totals = numpy.asarray(loop_totals, dtype=numpy.int64)
+	quad_diagonals = numpy.asarray(quad_diagonals, dtype=bool)
+	tri_loops, tri_faces, tri_orders = [], [], []
+	for total in numpy.unique(loop_totals):
+		if total < 3:
+			continue
+		faces = numpy.flatnonzero(loop_totals == total)
+		if total == 4:
+			patterns = numpy.where(quad_diagonals[faces][:, None, None],
+				numpy.array([[[0, 1, 2], [0, 2, 3]]]),
+				numpy.array([[[0, 1, 3], [1, 2, 3]]]))
+		else:
+			patterns = strip_triangles(total)[None]
+		# 逆順にした面の角の位置 → 面の角のインデックス
+		loops = loop_starts[faces][:, None, None] + (total - 1) - patterns
+		tri_count = loops.shape[1]
+		tri_loops.append(loops.reshape(-1, 3))
+		tri_faces.append(numpy.repeat(faces, tri_count))
+		tri_orders.append(numpy.tile(numpy.arange(tri_count), len(faces)))
+	if not tri_loops:
+		return numpy.zeros((0, 3), dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	tri_loops = numpy.concatenate(tri_loops)
+	tri_faces = numpy.concatenate(tri_faces)
+	order = numpy.lexsort((numpy.concatenate(tri_orders), tri_faces))
+	return tri_loops[order], tri_faces[order]
+
+def vertex_normals(cos, loop_vertex_indices, loop_starts, loop_totals):
+	"""面の法線を角の角度で重み付けして足し合わせた頂点の法線 (Blender と同じ計算) を返す"""
+	cos = numpy.asarray(cos, dtype=numpy.float64).reshape(-1, 3)
+	loop_vertex_indices = numpy.asarray(loop_vertex_indices, dtype=numpy.int64)
+	loop_starts = numpy.asarray(loop_starts, dtype=numpy.int64)
+	loop_totals = numpy.asarray(loop_totals, dtype=numpy.int64)
+	# 面の角毎の所属する面と、前後の面の角
+	loop_faces = numpy.repeat(numpy.arange(len(loop_starts)), loop_totals)
+	face_starts = loop_starts[loop_faces]
+	face_totals = loop_totals[loop_faces]
+	positions = numpy.arange(len(loop_faces)) - numpy.repeat(numpy.cumsum(loop_totals) - loop_totals, loop_totals)
+	loop_indices = face_starts + positions
+	next_cos = cos[loop_vertex_indices[face_starts + (positions + 1) % face_totals]]
+	prev_cos = cos[loop_vertex_indices[face_starts + (positions - 1) % face_totals]]
+	loop_cos = cos[loop_vertex_indices[loop_indices]]
+	# 面の法線 (Newell 法)
+	crosses = numpy.cross(loop_cos, next_cos)
+	face_normals = numpy.column_stack([numpy.bincount(loop_faces, weights=crosses[:, i], minlength=len(loop_starts)) for i in range(3)])
+	face_normals /= numpy.maximum(numpy.sqrt((face_normals ** 2).sum(axis=1)), 1e-12)[:, None]
+	# 面の角の角度
+	edges1 = prev_cos - loop_cos
+	edges2 = next_cos - loop_cos
+	edges1 /= numpy.maximum(numpy.sqrt((edges1 ** 2).sum(axis=1)), 1e-12)[:, None]
+	edges2 /= numpy.maximum(numpy.sqrt((edges2 ** 2).sum(axis=1)), 1e-12)[:, None]
+	angles = numpy.arccos(numpy.clip((edges1 * edges2).sum(axis=1), -1.0, 1.0))
+	weighted = face_normals[loop_faces] * angles[:, None]
+	vertices = loop_vertex_indices[loop_indices]
+	normals = numpy.column_stack([numpy.bincount(vertices, weights=weighted[:, i], minlength=len(cos)) for i in range(3)])
+	normals /= numpy.maximum(numpy.sqrt((normals ** 2).sum(axis=1)), 1e-12)[:, None]
+	return normals
+
+def top_weights(vertex_indices, bone_indices, values, vertex_count, count=4):
+	"""頂点グループへの割り当て毎の配列から、頂点毎に値の大きい順に count 個のウェイトを選ぶ
+	((vertex_count, count) のボーンのインデックス, 同じ形のウェイト値) を返し、足りない分は 0 で埋めます。
+	"""
+	vertex_indices = numpy.asarray(vertex_indices, dtype=numpy.int64)
+	order = numpy.argsort(vertex_indices, kind='mergesort')
+	vertex_indices = vertex_indices[order]
+	bone_indices = numpy.asarray(bone_indices, dtype=numpy.int64)[order]
+	values = numpy.asarray(values, dtype=numpy.float32)[order]
+	# 頂点 × 割り当ての密な配列に並べる
+	counts = numpy.bincount(vertex_indices, minlength=vertex_count)
+	width = max(count, int(counts.max()) if len(counts) else 0)
+	columns = numpy.arange(len(vertex_indices)) - (numpy.cumsum(counts) - counts)[vertex_indices]
+	dense_bones = numpy.zeros((vertex_count, width), dtype=numpy.int64)
+	dense_values = numpy.zeros((vertex_count, width), dtype=numpy.float32)
+	dense_bones[vertex_indices, columns] = bone_indices
+	dense_values[vertex_indices, columns] = values
+	# 大きい順に安定ソートして count 個を選ぶ (同じ値なら割り当ての順が先のものを残す)
+	rows = numpy.arange(vertex_count)[:, None]
+	top = numpy.argsort(-dense_values, axis=1, kind='mergesort')[:, :count]
+	return dense_bones[rows, top], dense_values[rows, top]
+
+def used_local_bones(weights):
+	"""0 より大きいウェイトが1つでもあるローカルボーンのインデックスを返す"""
+	return numpy.unique(weights['index'][0 < weights['value']])
+
+def group_weights(weights):
+	"""ウェイトを (ローカルボーンのインデックス, ウェイト値, 頂点インデックスの配列) のリストにまとめる
+	値が 0 以下のものは除き、同じ頂点に同じボーンが複数あれば後の方を使います。
+	"""
+	vertex_indices = numpy.repeat(numpy.arange(len(weights), dtype=numpy.int64), 4)
+	bone_indices = weights['index'].ravel().astype(numpy.int64)
+	values = weights['value'].ravel()
+	mask = 0 < values
+	vertex_indices, bone_indices, values = vertex_indices[mask], bone_indices[mask], values[mask]
+	if not len(values):
+		return []
+
+	# 同じ (頂点, ボーン) の組は最後のものだけ残す
+	keys = vertex_indices * (int(bone_indices.max()) + 1) + bone_indices
+	unique_keys, last = numpy.unique(keys[::-1], return_index=True)
+	keep = numpy.sort(len(keys) - 1 - last)
+	vertex_indices, bone_indices, values = vertex_indices[keep], bone_indices[keep], values[keep]
+
+	order = numpy.lexsort((vertex_indices, values, bone_indices))
+	vertex_indices, bone_indices, values = vertex_indices[order], bone_indices[order], values[order]
+	starts = numpy.flatnonzero((numpy.diff(bone_indices) != 0) | (numpy.diff(values) != 0)) + 1
+	starts = numpy.concatenate(([0], starts))
+	ends = numpy.concatenate((starts[1:], [len(values)]))
+	return [(int(bone_indices[start]), float(values[start]), vertex_indices[start:end]) for start, end in zip(starts.tolist(), ends.tolist())]
+
+def write_bones(writer, names, unknowns, parents, cos, rots):
+	"""ボーン情報を書き込む (回転は x, y, z, w の順)"""
+	writer.write_int(len(names))
+	writer.write(b''.join(binaryio.encode_str(name) + binaryio.UINT8.pack(int(unknown) & 0xFF) for name, unknown in zip(names, unknowns)))
+	writer.write_array(parents, '<i4')
+	transforms = numpy.empty((len(names), 7), dtype='<f4')
+	transforms[:, :3] = numpy.reshape(cos, (-1, 3))
+	transforms[:, 3:] = numpy.reshape(rots, (-1, 4))
+	writer.write(transforms.tobytes())
+
+def write_local_bones(writer, names, matrices):
+	"""ローカルボーン情報を書き込む (行列は16個の float の並び)"""
+	writer.write_int(len(names))
+	writer.write_strs(names)
+	writer.write_array(matrices, '<f4')
+
+def write_vertices(writer, vertices, unknown_data=None):
+	"""頂点データと不明データを書き込む"""
+	writer.write_array(vertices, VERTEX_DTYPE)
+	if unknown_data is None:
+		writer.write_int(0)
+	else:
+		writer.write_int(len(unknown_data))
+		writer.write_array(unknown_data, '<f4')
+
+def write_weights(writer, weights):
+	writer.write_array(weights, WEIGHT_DTYPE)
+
+def write_face_indices(writer, indices):
+	"""マテリアル1つ分の面インデックスを個数付きで書き込む"""
+	writer.write_int(len(indices))
+	writer.write_array(indices, '<u2')
+
+def write_material(writer, material):
+	"""read_material と同じ形式の辞書からマテリアルを書き込む"""
+	writer.write_strs([material['name1'], material['name2'], material['name3']])
+	for tex_data in material['data']:
+		writer.write_strs([tex_data['type'], tex_data['name']])
+		if tex_data['type'] == 'tex':
+			writer.write_str(tex_data['type2'])
+			if tex_data['type2'] == 'tex2d':
+				writer.write_strs([tex_data['name2'], tex_data['path']])
+				writer.pack(binaryio.FLOAT4, *tex_data['color'])
+		elif tex_data['type'] == 'col':
+			writer.pack(binaryio.FLOAT4, *tex_data['color'])
+		elif tex_data['type'] == 'f':
+			writer.write_float(tex_data['float'])
+	writer.write_str('end')
+
+def write_morph(writer, name, morph):
+	"""モーフ1つ分を書き込む"""
+	writer.write_strs(['morph', name])
+	writer.write_int(len(morph))
+	writer.write_array(morph, MORPH_DTYPE)
+
+def write_model(file, model):
+	"""ModelData をファイルオブジェクト (または BinaryWriter) に書き込む"""
+	writer = as_writer(file)
+	writer.write_str('CM3D2_MESH')
+	writer.write_int(model.version)
+	writer.write_strs([model.name, model.base_bone_name])
+	write_bones(writer, model.bone_names, model.bone_unknowns, model.bone_parents, model.bone_cos, model.bone_rots)
+	writer.write_int(len(model.vertices))
+	writer.write_int(len(model.face_indices))
+	write_local_bones(writer, model.local_bone_names, model.local_bone_matrices)
+	write_vertices(writer, model.vertices, model.unknown_data)
+	write_weights(writer, model.weights)
+	for indices in model.face_indices:
+		write_face_indices(writer, indices)
+	writer.write_int(len(model.materials))
+	for material in model.materials:
+		write_material(writer, material)
+	for name, morph in model.morphs:
+		write_morph(writer, name, morph)
+	writer.write_str('end')
+
+def write_model_file(filepath, model, backup_filepath=None):
+	"""ModelData を一時ファイル経由で書き込む (backup_filepath を指定すれば元のファイルをそこへ移します)"""
+	with fileutil.TemporaryFileWriter(filepath, 'wb', backup_filepath=backup_filepath) as file:
+		write_model(file, model)
+
+def write_model_files(jobs, max_workers=4):
+	"""(パス, ModelData, バックアップのパス) のリストをスレッドで並列に書き込む
+	ファイル毎に (秒数, ファイルサイズ) か、書き込みに失敗した時の例外を入れたリストを返します。
+	"""
+	def write(job):
+		filepath, model, backup_filepath = job
+		start = time.perf_counter()
+		try:
+			write_model_file(filepath, model, backup_filepath)
+			return time.perf_counter() - start, os.path.getsize(filepath)
+		except (IOError, OSError) as e:
+			return e
+	if len(jobs) <= 1:
+		return [write(job) for job in jobs]
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+		return list(executor.map(write, jobs))
+
+class ModelFileReader:
+	"""mmap で .model を開き、各セクションを初回アクセス時にだけ読み込むクラス
+	開いた時点では各セクションの開始位置を記録するだけで、
+	頂点やモーフ本体は読み飛ばします。
+	"""
+
+	SECTIONS = ('header', 'bones', 'local_bones', 'vertices', 'weights', 'faces', 'materials', 'morphs')
+
+	def __init__(self, filepath):
+		self.filepath = filepath
+		self.offsets = {}
+		self.morph_offsets = []
+		self.__cache = {}
+		self.__buffer = None
+		self.__file = open(filepath, 'rb')
+		try:
+			try:
+				self.__buffer = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:
+				raise CM3D2ImportException("これはカスタムメイド3D2のモデルファイルではありません")
+			self.__scan()
+		except:
+			self.close()
+			raise
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		"""mmap とファイルを閉じる"""
+		if self.__buffer is not None:
+			self.__buffer.close()
+			self.__buffer = None
+		self.__file.close()
+
+	def __reader(self, offset=0):
+		return BinaryReader(buffer=self.__buffer, offset=offset)
+
+	def __scan(self):
+		"""各セクションの開始位置を記録しながら読み飛ばす"""
+		reader = self.__reader()
+		try:
+			ext = reader.read_str()
+		except (CM3D2ImportException, UnicodeDecodeError):
+			ext = None
+		if ext != 'CM3D2_MESH':
+			raise CM3D2ImportException("これはカスタムメイド3D2のモデルファイルではありません")
+
+		self.offsets['header'] = reader.tell()
+		reader.skip(4)
+		reader.skip_str()
+		reader.skip_str()
+
+		self.offsets['bones'] = reader.tell()
+		bone_count = reader.read_int()
+		for i in range(bone_count):
+			reader.skip_str()
+			reader.skip(1)
+		reader.skip(bone_count * (4 + 7 * 4))
+
+		self.offsets['local_bones'] = reader.tell()
+		self.vertex_count, self.mesh_count, self.local_bone_count = (reader.read_int() for i in range(3))
+		for i in range(self.local_bone_count):
+			reader.skip_str()
+		reader.skip(self.local_bone_count * 16 * 4)
+
+		self.offsets['vertices'] = reader.tell()
+		reader.skip(self.vertex_count * VERTEX_DTYPE.itemsize)
+		reader.skip(reader.read_int() * 4 * 4)
+
+		self.offsets['weights'] = reader.tell()
+		reader.skip(self.vertex_count * WEIGHT_DTYPE.itemsize)
+
+		self.offsets['faces'] = reader.tell()
+		for i in range(self.mesh_count):
+			reader.skip(reader.read_int() * 2)
+
+		self.offsets['materials'] = reader.tell()
+		for i in range(reader.read_int()):
+			self.__skip_material(reader)
+
+		self.offsets['morphs'] = reader.tell()
+		while True:
+			offset = reader.tell()
+			if reader.read_str() != 'morph':
+				break
+			self.morph_offsets.append(offset)
+			reader.skip_str()
+			reader.skip(reader.read_int() * MORPH_DTYPE.itemsize)
+		if len(self.__buffer) < reader.tell():
+			raise CM3D2ImportException("ファイルが途中で終わっています")
+
+	@staticmethod
+	def __skip_material(reader):
+		for i in range(3):
+			reader.skip_str()
+		while True:
+			data_type = reader.read_str()
+			if data_type == 'tex':
+				reader.skip_str()
+				if reader.read_str() == 'tex2d':
+					reader.skip_str()
+					reader.skip_str()
+					reader.skip(4 * 4)
+			elif data_type == 'col':
+				reader.skip_str()
+				reader.skip(4 * 4)
+			elif data_type == 'f':
+				reader.skip_str()
+				reader.skip(4)
+			else:
+				return
+
+	def __section(self, name, decoder):
+		"""セクションを初回アクセス時だけデコードしてキャッシュする"""
+		if name not in self.__cache:
+			self.__cache[name] = decoder(self.__reader(self.offsets[name]))
+		return self.__cache[name]
+
+	@staticmethod
+	def __read_header(reader):
+		return reader.read_int(), reader.read_str(), reader.read_str()
+
+	@property
+	def version(self):
+		return self.__section('header', self.__read_header)[0]
+
+	@property
+	def name(self):
+		return self.__section('header', self.__read_header)[1]
+
+	@property
+	def base_bone_name(self):
+		return self.__section('header', self.__read_header)[2]
+
+	@staticmethod
+	def __read_bones(reader):
+		bone_count = reader.read_int()
+		names, unknowns = [], []
+		for i in range(bone_count):
+			names.append(reader.read_str())
+			unknowns.append(reader.read_uint8())
+		parents = reader.read_array('<i4', bone_count)
+		transforms = reader.read_array('<f4', bone_count * 7).reshape(bone_count, 7)
+		return names, numpy.array(unknowns, dtype=numpy.uint8), parents, transforms[:, :3], transforms[:, 3:]
+
+	@property
+	def bones(self):
+		"""(名前のリスト, 不明フラグ, 親インデックス, 位置, 回転(x, y, z, w)) を返す"""
+		return self.__section('bones', self.__read_bones)
+
+	@property
+	def bone_names(self):
+		return self.bones[0]
+
+	def __read_local_bones(self, reader):
+		reader.skip(3 * 4)
+		names = [reader.read_str() for i in range(self.local_bone_count)]
+		matrices = reader.read_array('<f4', self.local_bone_count * 16).reshape(-1, 4, 4)
+		return names, matrices
+
+	@property
+	def local_bones(self):
+		"""(名前のリスト, 4x4行列の配列) を返す"""
+		return self.__section('local_bones', self.__read_local_bones)
+
+	@property
+	def local_bone_names(self):
+		return self.local_bones[0]
+
+	def __read_vertices(self, reader):
+		vertices = reader.read_array(VERTEX_DTYPE, self.vertex_count)
+		unknown_data = reader.read_array('<f4', reader.read_int() * 4).reshape(-1, 4)
+		return vertices, unknown_data
+
+	@property
+	def vertices(self):
+		return self.__section('vertices', self.__read_vertices)[0]
+
+	@property
+	def unknown_data(self):
+		return self.__section('vertices', self.__read_vertices)[1]
+
+	@property
+	def weights(self):
+		return self.__section('weights', lambda reader: reader.read_array(WEIGHT_DTYPE, self.vertex_count))
+
+	@property
+	def face_indices(self):
+		return self.__section('faces', lambda reader: [reader.read_array('<u2', reader.read_int()) for i in range(self.mesh_count)])
+
+	@property
+	def materials(self):
+		return self.__section('materials', lambda reader: [read_material(reader) for i in range(reader.read_int())])
+
+	@property
+	def material_names(self):
+		return [material['name1'] for material in self.materials]
+
+	def __read_morph_names(self, reader):
+		names = []
+		for offset in self.morph_offsets:
+			reader.seek(offset)
+			reader.skip_str()
+			names.append(reader.read_str())
+		return names
+
+	@property
+	def morph_names(self):
+		"""モーフ本体は読まずに名前だけを返す"""
+		return self.__section('morphs', self.__read_morph_names)
+
+	def morph(self, index):
+		"""index 番目のモーフを (名前, MORPH_DTYPE の構造化配列) で返す"""
+		key = 'morph:' + str(index)
+		if key not in self.__cache:
+			reader = self.__reader(self.morph_offsets[index])
+			reader.skip_str()
+			name = reader.read_str()
+			self.__cache[key] = (name, reader.read_array(MORPH_DTYPE, reader.read_int()))
+		return self.__cache[key]
+
+	def to_model(self):
+		"""全セクションを読み込んで ModelData を返す"""
+		model = ModelData()
+		model.version, model.name, model.base_bone_name = self.version, self.name, self.base_bone_name
+		model.bone_names, model.bone_unknowns, model.bone_parents, model.bone_cos, model.bone_rots = self.bones
+		model.local_bone_names, model.local_bone_matrices = self.local_bones
+		model.vertices = self.vertices
+		model.unknown_data = self.unknown_data
+		model.weights = self.weights
+		model.face_indices = self.face_indices
+		model.materials = self.materials
+		model.morphs = [self.morph(i) for i in range(len(self.morph_offsets))]
+		return model
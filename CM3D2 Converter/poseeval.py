@@ -0,0 +1,168 @@
+# Fカーブとボーン姿勢の評価 (bpy非依存)
+import numpy
+
+# キーフレームの補間方法 (Blender の Keyframe.interpolation に対応)
+INTERPOLATION_TYPES = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2}
+
+def correct_bezier_handles(co0, right0, left1, co1):
+	"""x 方向に単調になるようハンドルを縮めて返す (Blender の correct_bezpart 相当)"""
+	h1 = co0 - right0
+	h2 = co1 - left1
+	len1 = numpy.abs(h1[:, 0])
+	len2 = numpy.abs(h2[:, 0])
+	length = co1[:, 0] - co0[:, 0]
+	total = len1 + len2
+	fac = numpy.ones_like(total)
+	over = (0 < total) & (length < total)
+	fac[over] = length[over] / total[over]
+	return co0 - h1 * fac[:, None], co1 - h2 * fac[:, None]
+
+def evaluate_fcurve(times, co, handle_left, handle_right, interpolations, extrapolation='CONSTANT', iterations=32):
+	"""キーフレームの配列から Fカーブを times の全時刻でまとめて評価する
+	co, handle_left, handle_right は (K, 2) の配列、interpolations は
+	INTERPOLATION_TYPES の値の配列です。
+	"""
+	times = numpy.asarray(times, dtype=numpy.float64)
+	co = numpy.asarray(co, dtype=numpy.float64).reshape(-1, 2)
+	handle_left = numpy.asarray(handle_left, dtype=numpy.float64).reshape(-1, 2)
+	handle_right = numpy.asarray(handle_right, dtype=numpy.float64).reshape(-1, 2)
+	interpolations = numpy.asarray(interpolations)
+	if not len(co):
+		return numpy.zeros(len(times))
+	result = numpy.empty(len(times))
+
+	# 最初/最後のキーより外側
+	before = times <= co[0, 0]
+	after = co[-1, 0] <= times
+	result[before] = co[0, 1]
+	result[after] = co[-1, 1]
+	if extrapolation == 'LINEAR' and 2 <= len(co):
+		# 端のキーが直線補間なら隣のキー、ベジェならハンドルの向きに延長する
+		if interpolations[0] != INTERPOLATION_TYPES['CONSTANT']:
+			other = co[1] if interpolations[0] == INTERPOLATION_TYPES['LINEAR'] else handle_left[0]
+			dx = co[0, 0] - other[0]
+			if dx:
+				result[before] = co[0, 1] - (co[0, 1] - other[1]) / dx * (co[0, 0] - times[before])
+		if interpolations[-1] != INTERPOLATION_TYPES['CONSTANT']:
+			other = co[-2] if interpolations[-1] == INTERPOLATION_TYPES['LINEAR'] else handle_right[-1]
+			dx = co[-1, 0] - other[0]
+			if dx:
+				result[after] = co[-1, 1] + (co[-1, 1] - other[1]) / dx * (times[after] - co[-1, 0])
+
+	inside = ~(before | after)
+	if not inside.any():
+		return result
+	inside_times = times[inside]
+	segment = numpy.searchsorted(co[:, 0], inside_times, side='right') - 1
+	values = numpy.empty(len(inside_times))
+	kinds = interpolations[segment]
+	co0, co1 = co[segment], co[segment + 1]
+
+	mask = kinds == INTERPOLATION_TYPES['CONSTANT']
+	values[mask] = co0[mask, 1]
+
+	mask = kinds == INTERPOLATION_TYPES['LINEAR']
+	if mask.any():
+		fac = (inside_times[mask] - co0[mask, 0]) / (co1[mask, 0] - co0[mask, 0])
+		values[mask] = co0[mask, 1] + (co1[mask, 1] - co0[mask, 1]) * fac
+
+	mask = kinds == INTERPOLATION_TYPES['BEZIER']
+	if mask.any():
+		p0, p3 = co0[mask], co1[mask]
+		p1, p2 = correct_bezier_handles(p0, handle_right[segment[mask]], handle_left[segment[mask] + 1], p3)
+		target = inside_times[mask]
+
+		def bezier(u, axis):
+			v = 1.0 - u
+			return v * v * v * p0[:, axis] + 3 * v * v * u * p1[:, axis] + 3 * v * u * u * p2[:, axis] + u * u * u * p3[:, axis]
+
+		# x(u) は単調増加なので二分法で u を求める
+		low = numpy.zeros(len(target))
+		high = numpy.ones(len(target))
+		for i in range(iterations):
+			middle = (low + high) * 0.5
+			is_low = bezier(middle, 0) < target
+			low = numpy.where(is_low, middle, low)
+			high = numpy.where(is_low, high, middle)
+		values[mask] = bezier((low + high) * 0.5, 1)
+
+	result[inside] = values
+	return result
+
+def quaternion_to_matrix(quats):
+	"""(N, 4) の w, x, y, z を正規化して (N, 3, 3) の回転行列にする"""
+	quats = numpy.asarray(quats, dtype=numpy.float64)
+	lengths = numpy.sqrt((quats * quats).sum(axis=1))
+	lengths[lengths == 0] = 1.0
+	w, x, y, z = (quats / lengths[:, None]).T
+	return numpy.array([
+		[1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)],
+		[2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)],
+		[2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)],
+		]).transpose(2, 0, 1)
+
+def euler_to_matrix(eulers, order='XYZ'):
+	"""(N, 3) のオイラー角を order の順に回転した (N, 3, 3) の回転行列にする"""
+	eulers = numpy.asarray(eulers, dtype=numpy.float64)
+	count = len(eulers)
+	matrices = {}
+	for axis, name in enumerate('XYZ'):
+		c, s = numpy.cos(eulers[:, axis]), numpy.sin(eulers[:, axis])
+		matrix = numpy.zeros((count, 3, 3))
+		i, j = [index for index in range(3) if index != axis]
+		matrix[:, axis, axis] = 1.0
+		matrix[:, i, i] = c
+		matrix[:, j, j] = c
+		matrix[:, i, j] = -s if axis != 1 else s
+		matrix[:, j, i] = s if axis != 1 else -s
+		matrices[name] = matrix
+	result = matrices[order[0]]
+	for name in order[1:]:
+		result = numpy.einsum('...ij,...jk->...ik', matrices[name], result)
+	return result
+
+def compose_matrices(locations, rotations, scales):
+	"""位置/回転行列/拡縮から (N, 4, 4) の変形行列を作る"""
+	count = len(rotations)
+	result = numpy.zeros((count, 4, 4))
+	result[:, :3, :3] = rotations * numpy.asarray(scales, dtype=numpy.float64)[:, None, :]
+	result[:, :3, 3] = locations
+	result[:, 3, 3] = 1.0
+	return result
+
+def forward_kinematics(parents, rest_matrices, basis_matrices):
+	"""ボーンのポーズ行列 (アーマチュア空間) を全時刻まとめて計算する
+	parents は親のインデックス (親無しは -1)、rest_matrices は (B, 4, 4) の
+	アーマチュア空間でのレスト行列、basis_matrices は (S, B, 4, 4) の
+	ローカル変形行列です。
+	"""
+	parents = list(parents)
+	rest_matrices = numpy.asarray(rest_matrices, dtype=numpy.float64)
+	result = numpy.empty(basis_matrices.shape)
+
+	# 親が先に計算されるよう深さ順に並べる
+	depths = []
+	for index in range(len(parents)):
+		depth, parent = 0, parents[index]
+		while 0 <= parent:
+			depth, parent = depth + 1, parents[parent]
+		depths.append(depth)
+
+	for index in sorted(range(len(parents)), key=lambda i: depths[i]):
+		parent = parents[index]
+		if parent < 0:
+			offset = rest_matrices[index]
+			result[:, index] = numpy.einsum('ij,...jk->...ik', offset, basis_matrices[:, index])
+		else:
+			offset = numpy.linalg.inv(rest_matrices[parent]).dot(rest_matrices[index])
+			local = numpy.einsum('ij,...jk->...ik', offset, basis_matrices[:, index])
+			result[:, index] = numpy.einsum('...ij,...jk->...ik', result[:, parent], local)
+	return result
+
+def parent_relative_matrices(parents, pose_matrices):
+	"""ポーズ行列を親ボーンからの相対行列に変換する (親無しはそのまま)"""
+	result = pose_matrices.copy()
+	for index, parent in enumerate(parents):
+		if 0 <= parent:
+			result[:, index] = numpy.einsum('...ij,...jk->...ik', numpy.linalg.inv(pose_matrices[:, parent]), pose_matrices[:, index])
+	return result
@@ -1,7 +1,7 @@
 import bpy
 import os
-import struct
 from . import common
+from . import binaryio
 
 class export_cm3d2_tex(bpy.types.Operator):
 	bl_idname = 'image.export_cm3d2_tex'
@@ -71,6 +71,7 @@ class export_cm3d2_tex(bpy.types.Operator):
 		return {'FINISHED'}
 
 	def write_texture(self, context, file):
+		writer = binaryio.BinaryWriter(file)
 		# とりあえずpngで保存
 		img = context.edit_image
 		if img.source != 'VIEWER':
@@ -104,11 +105,11 @@ class export_cm3d2_tex(bpy.types.Operator):
 			os.remove(temp_path)
 		
 		# 本命ファイルに書き込み
-		common.write_str(file, 'CM3D2_TEX')
-		file.write(struct.pack('<i', self.version))
-		common.write_str(file, self.path)
-		file.write(struct.pack('<i', len(temp_data)))
-		file.write(temp_data)
+		writer.write_str('CM3D2_TEX')
+		writer.write_int(self.version)
+		writer.write_str(self.path)
+		writer.write_int(len(temp_data))
+		writer.write(temp_data)
 
 # メニューを登録する関数
 def menu_func(self, context):
@@ -1,5 +1,6 @@
-import os, os.path, bpy, struct, os.path
+import os, os.path, bpy, os.path
 from . import common
+from . import binaryio
 
 class import_cm3d2_tex(bpy.types.Operator):
 	bl_idname = 'image.import_cm3d2_tex'
@@ -34,35 +35,43 @@ class import_cm3d2_tex(bpy.types.Operator):
 	def execute(self, context):
 		common.preferences().tex_import_path = self.filepath
 		try:
-			file = open(self.filepath, 'rb')
+			reader = binaryio.open_reader(self.filepath)
 		except:
 			self.report(type={'ERROR'}, message="ファイルを開くのに失敗しました、アクセス不可かファイルが存在しません")
 			return {'CANCELLED'}
-		header_ext = common.read_str(file)
+		with reader:
+			try:
+				header_ext = reader.read_str()
+			except binaryio.CM3D2ImportException:
+				header_ext = None
 		if header_ext == 'CM3D2_TEX':
-			file.seek(4, 1)
-			in_path = common.read_str(file)
-			png_size = struct.unpack('<i', file.read(4))[0]
-			root, ext = os.path.splitext(self.filepath)
-			png_path = root + ".png"
-			is_png_overwrite = os.path.exists(png_path)
-			if self.mode == 'PACK' and is_png_overwrite:
-				png_path += ".temp.png"
-			png_file = open(png_path, 'wb')
-			png_file.write(file.read(png_size))
-			png_file.close()
+			# 埋め込まれたPNGはキャッシュに取り出して使い回し、元の tex のパスを画像に記録する
+			try:
+				png_path, in_path = common.get_png_cache().extract(self.filepath)
+			except (IOError, OSError, binaryio.CM3D2ImportException):
+				self.report(type={'ERROR'}, message="texファイルからPNGを取り出せませんでした")
+				return {'CANCELLED'}
 			bpy.ops.image.open(filepath=png_path)
 			img = context.edit_image
 			img.name = os.path.basename(self.filepath)
 			img['cm3d2_path'] = in_path
+			img['cm3d2_tex_path'] = self.filepath
 		else:
 			bpy.ops.image.open(filepath=self.filepath)
 			img = context.edit_image
-		file.close()
 		if self.mode == 'PACK':
 			img.pack(as_png=True)
-			if header_ext == 'CM3D2_TEX':
-				os.remove(png_path)
+		return {'FINISHED'}
+
+class clear_cm3d2_png_cache(bpy.types.Operator):
+	bl_idname = 'image.clear_cm3d2_png_cache'
+	bl_label = "PNGキャッシュを削除"
+	bl_description = "texファイルから取り出したPNGのキャッシュを全て削除します"
+	bl_options = {'REGISTER'}
+	
+	def execute(self, context):
+		count, size = common.get_png_cache().clear()
+		self.report(type={'INFO'}, message="%d個のキャッシュ (%.1fMB) を削除しました" % (count, size / 1024 / 1024))
 		return {'FINISHED'}
 
 # メニューを登録する関数
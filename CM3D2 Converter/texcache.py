@@ -0,0 +1,115 @@
+# tex から取り出した PNG のキャッシュ (bpy非依存)
+import os
+import hashlib
+from . import binaryio
+from .binaryio import CM3D2ImportException
+
+def read_tex_header(reader):
+	"""tex のヘッダーを読み込み (CM3D2内のパス, PNGのサイズ) を返す"""
+	if reader.read_str() != 'CM3D2_TEX':
+		raise CM3D2ImportException("これはカスタムメイド3D2のテクスチャファイルではありません")
+	reader.skip(4)
+	in_path = reader.read_str()
+	png_size = reader.read_int()
+	return in_path, png_size
+
+class PNGCache:
+	"""tex から取り出した PNG を保存しておくキャッシュ
+	キャッシュは tex のパス/サイズ/更新日時のハッシュ毎のフォルダに元の名前で置き、
+	合計サイズが max_size を超えたら最後に使われたのが古いものから削除します。
+	"""
+
+	def __init__(self, cache_dir, max_size=512 * 1024 * 1024):
+		self.cache_dir = cache_dir
+		self.max_size = max_size
+
+	def cache_path(self, tex_path):
+		"""tex に対応するキャッシュの PNG のパスを返す"""
+		tex_path = os.path.normcase(os.path.abspath(tex_path))
+		stat = os.stat(tex_path)
+		key = "%s|%d|%d" % (tex_path, stat.st_size, int(stat.st_mtime * 1000))
+		digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+		name = os.path.splitext(os.path.basename(tex_path))[0]
+		return os.path.join(self.cache_dir, digest, name + ".png")
+
+	def contains(self, path):
+		"""パスがキャッシュのフォルダ内にあるかを返す"""
+		cache_dir = os.path.normcase(os.path.abspath(self.cache_dir))
+		path = os.path.normcase(os.path.abspath(path))
+		return path.startswith(cache_dir + os.sep)
+
+	def extract(self, tex_path):
+		"""tex の PNG をキャッシュに取り出し (PNGのパス, CM3D2内のパス) を返す
+		既にキャッシュにあれば書き込まずにそれを返します。
+		"""
+		png_path = self.cache_path(tex_path)
+		with binaryio.open_reader(tex_path) as reader:
+			in_path, png_size = read_tex_header(reader)
+			if os.path.exists(png_path):
+				# 最後に使った日時として更新日時を使う
+				os.utime(png_path, None)
+				return png_path, in_path
+			data = reader.read_exact(png_size)
+
+		if not os.path.isdir(os.path.dirname(png_path)):
+			os.makedirs(os.path.dirname(png_path))
+		temp_path = png_path + ".temp"
+		with open(temp_path, 'wb') as file:
+			file.write(data)
+		os.replace(temp_path, png_path)
+		self.prune(keep=png_path)
+		return png_path, in_path
+
+	def files(self):
+		"""キャッシュ内の (パス, サイズ, 更新日時) のリストを返す"""
+		if not os.path.isdir(self.cache_dir):
+			return []
+		result = []
+		for root, dirs, names in os.walk(self.cache_dir):
+			for name in names:
+				path = os.path.join(root, name)
+				try:
+					stat = os.stat(path)
+				except OSError:
+					continue
+				result.append((path, stat.st_size, stat.st_mtime))
+		return result
+
+	def remove(self, path):
+		"""キャッシュのファイルを削除し、空になったフォルダも削除する"""
+		os.remove(path)
+		try:
+			os.rmdir(os.path.dirname(path))
+		except OSError:
+			pass
+
+	def size(self):
+		"""キャッシュの合計サイズを返す"""
+		return sum(size for path, size, mtime in self.files())
+
+	def prune(self, keep=None):
+		"""合計サイズが max_size に収まるまで古いものから削除する"""
+		files = sorted(self.files(), key=lambda item: item[2])
+		total = sum(size for path, size, mtime in files)
+		for path, size, mtime in files:
+			if total <= self.max_size:
+				break
+			if path == keep:
+				continue
+			try:
+				self.remove(path)
+			except OSError:
+				continue
+			total -= size
+
+	def clear(self):
+		"""キャッシュを全て削除し、(削除した数, 削除したサイズ) を返す"""
+		count, total = 0, 0
+		for path, size, mtime in self.files():
+			try:
+				self.remove(path)
+			except OSError:
+				continue
+			count += 1
+			total += size
+		return count, total
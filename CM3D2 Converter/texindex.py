@@ -0,0 +1,117 @@
+# テクスチャ置き場のファイル索引 (bpy非依存)
+import os
+import json
+
+# 索引に載せる拡張子
+TEXTURE_EXTS = ('.tex', '.png')
+# キャッシュファイルの形式が変わったら上げる
+CACHE_VERSION = 1
+
+class TextureIndex:
+	"""テクスチャ置き場のファイル名 (小文字) からパスを引く索引
+	フォルダ毎の更新日時をキャッシュファイルに保存しておき、
+	次回からは更新日時が変わったフォルダだけを読み直します。
+	"""
+
+	def __init__(self, cache_path=None):
+		self.cache_path = cache_path
+		self.roots = []
+		# フォルダのパス → [更新日時, サブフォルダ名のリスト, テクスチャのファイル名のリスト]
+		self.dirs = {}
+		# 小文字のファイル名 → パス
+		self.files = {}
+		self.load()
+
+	def load(self):
+		"""キャッシュファイルがあれば読み込む (壊れていれば無視して作り直します)"""
+		if not self.cache_path or not os.path.exists(self.cache_path):
+			return
+		try:
+			with open(self.cache_path, 'r', encoding='utf-8') as file:
+				data = json.load(file)
+		except (IOError, OSError, ValueError):
+			return
+		if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+			return
+		self.roots = data.get('roots', [])
+		self.dirs = data.get('dirs', {})
+		self.__build_files()
+
+	def save(self):
+		"""キャッシュファイルに書き込む"""
+		if not self.cache_path:
+			return
+		data = {'version': CACHE_VERSION, 'roots': self.roots, 'dirs': self.dirs}
+		temp_path = self.cache_path + ".temp"
+		try:
+			with open(temp_path, 'w', encoding='utf-8') as file:
+				json.dump(data, file, ensure_ascii=False)
+			os.replace(temp_path, self.cache_path)
+		except (IOError, OSError):
+			pass
+
+	def update(self, roots):
+		"""roots 以下を走査し、更新日時が変わったフォルダだけ読み直す (変更があれば True を返す)"""
+		roots = [os.path.normpath(root) for root in roots]
+		changed = roots != self.roots
+		dirs = {}
+		stack = list(reversed(roots))
+		while stack:
+			path = stack.pop()
+			if path in dirs:
+				continue
+			try:
+				mtime = os.stat(path).st_mtime
+			except OSError:
+				continue
+			entry = self.dirs.get(path)
+			if not entry or entry[0] != mtime:
+				changed = True
+				entry = self.__scan_dir(path, mtime)
+				if entry is None:
+					continue
+			dirs[path] = entry
+			stack.extend(os.path.join(path, name) for name in reversed(entry[1]))
+		if len(dirs) != len(self.dirs):
+			changed = True
+
+		self.roots = roots
+		self.dirs = dirs
+		if changed:
+			self.__build_files()
+			self.save()
+		return changed
+
+	def __scan_dir(self, path, mtime):
+		try:
+			names = os.listdir(path)
+		except OSError:
+			return None
+		subdirs, files = [], []
+		for name in names:
+			if os.path.isdir(os.path.join(path, name)):
+				subdirs.append(name)
+			elif os.path.splitext(name)[1].lower() in TEXTURE_EXTS:
+				files.append(name)
+		return [mtime, subdirs, files]
+
+	def __build_files(self):
+		"""os.walk と同じ順に辿り、同じ名前があれば先に見つかった方を使う"""
+		files = {}
+		stack = list(reversed(self.roots))
+		while stack:
+			path = stack.pop()
+			entry = self.dirs.get(path)
+			if not entry:
+				continue
+			for name in entry[2]:
+				files.setdefault(name.lower(), os.path.join(path, name))
+			stack.extend(os.path.join(path, name) for name in reversed(entry[1]))
+		self.files = files
+
+	def find(self, file_name):
+		"""ファイル名 (大文字小文字は区別しない) からパスを返す、無ければ None"""
+		return self.files.get(file_name.lower())
+
+	def __len__(self):
+		return len(self.files)
@@ -0,0 +1,236 @@
+# ベンチマーク用の合成アセット (.model / .anm / .mate / .tex) を作成する
+#
+# 使い方:
+#   python benchmark/make_assets.py [出力フォルダ] [--preset small|medium|large]
+#       [--vertices N] [--bones N] [--materials N] [--morphs N] [--keys N] [--seed N]
+#
+# Blender無しで動くように、アドオンの bpy 非依存モジュール (binaryio, modelfile, anmfile)
+# だけを読み込んで書き出しに使います。
+import os, sys, zlib, types, struct, argparse, importlib
+import numpy
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "CM3D2 Converter")
+ADDON_PACKAGE = "cm3d2_converter_bench"
+
+# プリセット毎のアセットの大きさ
+PRESETS = {
+	'small': {'vertices': 2000, 'bones': 40, 'materials': 2, 'morphs': 4, 'morph_size': 200, 'keys': 30, 'tex_size': 128},
+	'medium': {'vertices': 20000, 'bones': 120, 'materials': 6, 'morphs': 40, 'morph_size': 1500, 'keys': 120, 'tex_size': 512},
+	'large': {'vertices': 60000, 'bones': 250, 'materials': 12, 'morphs': 120, 'morph_size': 4000, 'keys': 600, 'tex_size': 1024},
+	}
+
+# アドオンの bpy 非依存モジュールを読み込む (__init__.py は bpy を使うので通さない)
+def load_module(name):
+	if ADDON_PACKAGE not in sys.modules:
+		package = types.ModuleType(ADDON_PACKAGE)
+		package.__path__ = [ADDON_DIR]
+		sys.modules[ADDON_PACKAGE] = package
+	return importlib.import_module(ADDON_PACKAGE + "." + name)
+
+binaryio = load_module('binaryio')
+modelfile = load_module('modelfile')
+anmfile = load_module('anmfile')
+
+# 親のインデックスが自分より前になるボーン階層を作る
+def make_bone_parents(bone_count, random):
+	parents = numpy.empty(bone_count, dtype=numpy.int32)
+	parents[0] = -1
+	for index in range(1, bone_count):
+		# 直前のボーン付近を親にして、ある程度の深さの木にする
+		parents[index] = random.randint(max(0, index - 8), index)
+	return parents
+
+def bone_name(index):
+	return "Bip01" if index == 0 else "Bip01 Bone%03d" % index
+
+# 円柱状のグリッドメッシュの ModelData を作る
+# 1周した継ぎ目の列は UV だけが違う頂点として複製する (CM3D2 の UV の切れ目と同じ形)
+def make_model_data(vertex_count=2000, bone_count=40, material_count=2, morph_count=4, morph_size=200, seed=0):
+	random = numpy.random.RandomState(seed)
+	columns = max(3, int(numpy.sqrt(vertex_count)))
+	rows = max(2, vertex_count // (columns + 1))
+
+	model = modelfile.ModelData()
+	model.version = 1000
+	model.name = "bench_body"
+	model.base_bone_name = bone_name(0)
+
+	# ボーン
+	model.bone_names = [bone_name(i) for i in range(bone_count)]
+	model.bone_unknowns = (random.rand(bone_count) < 0.5).astype(numpy.uint8)
+	model.bone_parents = make_bone_parents(bone_count, random)
+	model.bone_cos = random.uniform(-0.1, 0.1, (bone_count, 3)).astype(numpy.float32)
+	rots = random.normal(size=(bone_count, 4))
+	model.bone_rots = (rots / numpy.sqrt((rots * rots).sum(axis=1))[:, None]).astype(numpy.float32)
+
+	# ローカルボーン (全ボーン、行列は単位行列に位置だけずらしたもの)
+	model.local_bone_names = list(model.bone_names)
+	matrices = numpy.tile(numpy.identity(4, dtype=numpy.float32), (bone_count, 1, 1))
+	matrices[:, 3, :3] = random.uniform(-1, 1, (bone_count, 3))
+	model.local_bone_matrices = matrices
+
+	# 頂点 (columns + 1 列目が継ぎ目の複製)
+	angles = numpy.linspace(0, 2 * numpy.pi, columns + 1)
+	angles[-1] = angles[0]
+	heights = numpy.linspace(0, 1.5, rows)
+	angle_grid, height_grid = numpy.meshgrid(angles, heights)
+	cos = numpy.column_stack((numpy.cos(angle_grid).ravel() * 0.2, height_grid.ravel(), numpy.sin(angle_grid).ravel() * 0.2))
+	normals = numpy.column_stack((numpy.cos(angle_grid).ravel(), numpy.zeros(angle_grid.size), numpy.sin(angle_grid).ravel()))
+	u_grid, v_grid = numpy.meshgrid(numpy.linspace(0, 1, columns + 1), numpy.linspace(0, 1, rows))
+	uvs = numpy.column_stack((u_grid.ravel(), v_grid.ravel()))
+	model.vertices = modelfile.build_vertex_array(cos, normals, uvs)
+
+	# ウェイト (近いボーン4つ、大きい順で合計1.0)
+	count = len(model.vertices)
+	indices = numpy.sort(random.randint(0, bone_count, (count, 4)), axis=1)
+	values = numpy.sort(random.rand(count, 4), axis=1)[:, ::-1]
+	values /= values.sum(axis=1)[:, None]
+	model.weights = modelfile.build_weight_array(indices, values)
+
+	# 面 (グリッドの四角を2つの三角にして、行毎にマテリアルへ振り分ける)
+	row_index, column_index = numpy.meshgrid(numpy.arange(rows - 1), numpy.arange(columns), indexing='ij')
+	v0 = (row_index * (columns + 1) + column_index).ravel()
+	v1, v2, v3 = v0 + 1, v0 + columns + 1, v0 + columns + 2
+	quads = numpy.column_stack((v0, v2, v1, v1, v2, v3)).reshape(rows - 1, -1)
+	material_count = max(1, min(material_count, rows - 1))
+	model.face_indices = [chunk.ravel().astype(numpy.uint16) for chunk in numpy.array_split(quads, material_count)]
+
+	# マテリアル
+	for index in range(material_count):
+		model.materials.append(make_material(index))
+
+	# モーフ (ランダムな頂点を動かす)
+	for index in range(morph_count):
+		size = min(morph_size, count)
+		morph_indices = numpy.sort(random.choice(count, size, replace=False))
+		model.morphs.append(("morph%03d" % index, modelfile.build_morph_array(
+			morph_indices,
+			random.normal(scale=0.01, size=(size, 3)),
+			random.normal(scale=0.05, size=(size, 3)))))
+	return model
+
+# read_material と同じ形式のマテリアル情報
+def make_material(index):
+	name = "bench_mate%02d" % index
+	return {
+		'name1': name,
+		'name2': "CM3D2/Toony_Lighted_Outline",
+		'name3': "CM3D2__Toony_Lighted_Outline",
+		'data': [
+			{'type': 'tex', 'name': "_MainTex", 'type2': 'tex2d', 'name2': name, 'path': "Assets/texture/texture/" + name + ".png", 'color': (0.0, 0.0, 1.0, 1.0)},
+			{'type': 'tex', 'name': "_ToonRamp", 'type2': 'tex2d', 'name2': "toonGrayA1", 'path': "Assets/texture/texture/toon/toonGrayA1.png", 'color': (0.0, 0.0, 1.0, 1.0)},
+			{'type': 'col', 'name': "_Color", 'color': (1.0, 1.0, 1.0, 1.0)},
+			{'type': 'col', 'name': "_ShadowColor", 'color': (0.0, 0.0, 0.0, 1.0)},
+			{'type': 'f', 'name': "_Shininess", 'float': 0.0},
+			{'type': 'f', 'name': "_OutlineWidth", 'float': 0.0015},
+			],
+		}
+
+def write_model(filepath, **kwargs):
+	model = make_model_data(**kwargs)
+	with open(filepath, 'wb') as file:
+		modelfile.write_model(file, model)
+	return model
+
+# ボーン数 × キーフレーム数の .anm を書き出す
+def write_anm(filepath, bone_count=40, key_count=30, seed=0):
+	random = numpy.random.RandomState(seed)
+	parents = make_bone_parents(bone_count, random)
+	times = numpy.linspace(0, key_count / 30.0, key_count)
+	with open(filepath, 'wb') as file:
+		writer = binaryio.BinaryWriter(file)
+		writer.write_str('CM3D2_ANIM')
+		writer.write_int(1000)
+		for index in range(bone_count):
+			path = [bone_name(index)]
+			parent = parents[index]
+			while 0 <= parent:
+				path.append(bone_name(parent))
+				parent = parents[parent]
+			writer.write_bool(True)
+			writer.write_str("/".join(reversed(path)))
+
+			# 回転はゆっくり回る単位クォータニオン、位置は小さく揺らす
+			phase = random.uniform(0, 2 * numpy.pi, 4)
+			quats = numpy.column_stack([numpy.sin(times * 2 + p) * 0.3 for p in phase[:3]] + [numpy.ones(key_count)])
+			quats /= numpy.sqrt((quats * quats).sum(axis=1))[:, None]
+			locs = random.normal(scale=0.001, size=(key_count, 3)).cumsum(axis=0)
+			for channel_id, values in zip(anmfile.ROTATION_CHANNELS + anmfile.LOCATION_CHANNELS, list(quats.T) + list(locs.T)):
+				tangents = anmfile.compute_tangents(times, values)
+				anmfile.write_channel(writer, channel_id, numpy.column_stack((times, values, tangents, tangents)))
+		writer.write_bool(False)
+
+def write_mate(filepath, index=0):
+	with open(filepath, 'wb') as file:
+		writer = binaryio.BinaryWriter(file)
+		writer.write_str('CM3D2_MATERIAL')
+		writer.write_int(1000)
+		material = make_material(index)
+		writer.write_str(material['name1'])
+		modelfile.write_material(writer, material)
+
+# 単色のグラデーションの PNG を作る
+def make_png(width, height):
+	x = numpy.linspace(0, 255, width).astype(numpy.uint8)
+	y = numpy.linspace(0, 255, height).astype(numpy.uint8)
+	pixels = numpy.empty((height, width, 4), dtype=numpy.uint8)
+	pixels[:, :, 0] = x[None, :]
+	pixels[:, :, 1] = y[:, None]
+	pixels[:, :, 2] = 128
+	pixels[:, :, 3] = 255
+	raw = b''.join(b'\x00' + row.tobytes() for row in pixels)
+
+	def chunk(kind, data):
+		return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+	header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+	return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+def write_tex(filepath, size=128):
+	png = make_png(size, size)
+	with open(filepath, 'wb') as file:
+		writer = binaryio.BinaryWriter(file)
+		writer.write_str('CM3D2_TEX')
+		writer.write_int(1000)
+		writer.write_str("assets/texture/texture/" + os.path.splitext(os.path.basename(filepath))[0] + ".png")
+		writer.write_int(len(png))
+		writer.write(png)
+
+# 出力フォルダに一式を作成し、{種類: パス} を返す
+def make_assets(output_dir, preset='small', seed=0, **overrides):
+	params = dict(PRESETS[preset])
+	params.update((key, value) for key, value in overrides.items() if value is not None)
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+	paths = {
+		'model': os.path.join(output_dir, "bench_%s.model" % preset),
+		'anm': os.path.join(output_dir, "bench_%s.anm" % preset),
+		'mate': os.path.join(output_dir, "bench_%s.mate" % preset),
+		'tex': os.path.join(output_dir, "bench_%s.tex" % preset),
+		}
+	write_model(paths['model'], vertex_count=params['vertices'], bone_count=params['bones'], material_count=params['materials'],
+		morph_count=params['morphs'], morph_size=params['morph_size'], seed=seed)
+	write_anm(paths['anm'], bone_count=params['bones'], key_count=params['keys'], seed=seed)
+	write_mate(paths['mate'])
+	write_tex(paths['tex'], size=params['tex_size'])
+	return paths, params
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="ベンチマーク用の合成アセットを作成します")
+	parser.add_argument('output_dir', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"))
+	parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+	parser.add_argument('--vertices', type=int)
+	parser.add_argument('--bones', type=int)
+	parser.add_argument('--materials', type=int)
+	parser.add_argument('--morphs', type=int)
+	parser.add_argument('--morph-size', type=int, dest='morph_size')
+	parser.add_argument('--keys', type=int)
+	parser.add_argument('--tex-size', type=int, dest='tex_size')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args(argv)
+	paths, params = make_assets(args.output_dir, args.preset, args.seed, vertices=args.vertices, bones=args.bones,
+		materials=args.materials, morphs=args.morphs, morph_size=args.morph_size, keys=args.keys, tex_size=args.tex_size)
+	for kind in sorted(paths):
+		print("%s: %s (%d bytes)" % (kind, paths[kind], os.path.getsize(paths[kind])))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,225 @@
+# CM3D2 Converter のベンチマーク
+#
+# Blender無しで (ファイルの読み書きだけ):
+#   python benchmark/run_benchmark.py --preset medium --output report.json
+# Blender上で (オペレーター全体も計測):
+#   blender -b --factory-startup --python benchmark/run_benchmark.py -- --preset medium --output report.json
+# 前回の結果と比べる (遅くなった項目があれば終了コード1):
+#   python benchmark/run_benchmark.py --compare old_report.json --threshold 1.2
+import os, sys, math, time, json, shutil, tempfile, platform, argparse, subprocess
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import make_assets
+from make_assets import binaryio, modelfile, anmfile, load_module
+
+texcache = load_module('texcache')
+
+try:
+	import bpy
+except ImportError:
+	bpy = None
+
+# func を repeat 回実行し、各回の秒数のリストを返す (setup は毎回の前に実行し計測しない)
+def measure(func, repeat, setup=None):
+	times = []
+	for i in range(repeat):
+		if setup:
+			setup()
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return times
+
+def summarize(name, times, **info):
+	result = {
+		'name': name,
+		'repeat': len(times),
+		'min': min(times),
+		'median': float(numpy.median(times)),
+		'mean': float(numpy.mean(times)),
+		}
+	result.update(info)
+	return result
+
+# .anm の書き出し (エクスポート時と同じ anmfile.write_anm を使う、tolerances があればキーを間引く)
+def encode_anm(anm, tolerances=None):
+	anmfile.write_anm(BytesSink(), anm, tolerances)
+
+# 書き込んだバイト数だけ数えるファイルオブジェクト
+class BytesSink:
+	def __init__(self):
+		self.size = 0
+	def write(self, data):
+		self.size += len(data)
+		return len(data)
+
+def read_mate(filepath):
+	with binaryio.open_reader(filepath) as reader:
+		reader.read_str()
+		reader.read_int()
+		reader.read_str()
+		return modelfile.read_material(reader)
+
+# Blender無しで計測できるファイルの読み書き
+def run_codec_benchmarks(paths, repeat):
+	results = []
+	model = modelfile.read_model_file(paths['model'])
+	counts = {'vertices': model.vertex_count, 'faces': model.face_count, 'bones': len(model.bone_names), 'morphs': len(model.morphs)}
+
+	results.append(summarize('model.read', measure(lambda: modelfile.read_model_file(paths['model']), repeat), **counts))
+
+	def read_lazy():
+		with modelfile.ModelFileReader(paths['model']) as reader:
+			reader.morph_names
+	results.append(summarize('model.read_names', measure(read_lazy, repeat), **counts))
+	results.append(summarize('model.write', measure(lambda: modelfile.write_model(BytesSink(), model), repeat), **counts))
+
+	def weld():
+		remap, first = modelfile.weld_vertices(model.vertices)
+		faces = model.all_faces()
+		modelfile.uv_seam_edges(remap[faces], model.vertices['uv'][faces])
+	results.append(summarize('model.weld', measure(weld, repeat), **counts))
+	results.append(summarize('model.group_weights', measure(lambda: modelfile.group_weights(model.weights), repeat), **counts))
+
+	anm = anmfile.read_anm_file(paths['anm'])
+	counts = {'bones': len(anm.tracks), 'keys': sum(len(array) for path, channels in anm.tracks for array in channels.values())}
+	results.append(summarize('anm.read', measure(lambda: anmfile.read_anm_file(paths['anm']), repeat), **counts))
+	results.append(summarize('anm.write', measure(lambda: encode_anm(anm), repeat), **counts))
+	tolerances = anmfile.channel_tolerances(0.0001, math.radians(0.1))
+	results.append(summarize('anm.write_reduce', measure(lambda: encode_anm(anm, tolerances), repeat), **counts))
+
+	results.append(summarize('mate.read', measure(lambda: read_mate(paths['mate']), repeat)))
+
+	cache_dir = tempfile.mkdtemp(prefix="cm3d2_bench_")
+	try:
+		cache = texcache.PNGCache(cache_dir)
+		results.append(summarize('tex.extract', measure(lambda: cache.extract(paths['tex']), repeat, setup=cache.clear), bytes=os.path.getsize(paths['tex'])))
+		results.append(summarize('tex.extract_cached', measure(lambda: cache.extract(paths['tex']), repeat), bytes=os.path.getsize(paths['tex'])))
+	finally:
+		shutil.rmtree(cache_dir, ignore_errors=True)
+	return results
+
+# Blender上でのオペレーター全体の計測
+def run_operator_benchmarks(paths, repeat, work_dir):
+	import addon_utils
+	addon_dir = os.path.dirname(make_assets.ADDON_DIR)
+	if addon_dir not in sys.path:
+		sys.path.insert(0, addon_dir)
+	addon_utils.enable(os.path.basename(make_assets.ADDON_DIR), default_set=True)
+
+	def reset_scene():
+		bpy.ops.wm.read_homefile(use_empty=True)
+
+	def import_model():
+		bpy.ops.import_mesh.import_cm3d2_model(filepath=paths['model'], is_replace_cm3d2_tex=False)
+
+	results = []
+	model = modelfile.read_model_file(paths['model'])
+	counts = {'vertices': model.vertex_count, 'faces': model.face_count, 'bones': len(model.bone_names), 'morphs': len(model.morphs)}
+	results.append(summarize('op.import_model', measure(import_model, repeat, setup=reset_scene), **counts))
+
+	export_path = os.path.join(work_dir, "export.model")
+	def setup_export():
+		reset_scene()
+		import_model()
+		ob = next(ob for ob in bpy.context.scene.objects if ob.type == 'MESH')
+		bpy.context.scene.objects.active = ob
+		ob.select = True
+	def export_model():
+		bpy.ops.export_mesh.export_cm3d2_model(filepath=export_path, is_backup=False, is_batch=True)
+	results.append(summarize('op.export_model', measure(export_model, repeat, setup=setup_export), **counts))
+
+	anm = anmfile.read_anm_file(paths['anm'])
+	key_count = max(len(array) for path, channels in anm.tracks for array in channels.values())
+	def setup_anm():
+		reset_scene()
+		import_model()
+		ob = next(ob for ob in bpy.context.scene.objects if ob.type == 'ARMATURE')
+		bpy.context.scene.objects.active = ob
+		ob.select = True
+	def import_anm():
+		bpy.ops.import_anim.import_cm3d2_anm(filepath=paths['anm'])
+	results.append(summarize('op.import_anm', measure(import_anm, repeat, setup=setup_anm), bones=len(anm.tracks), keys=key_count))
+
+	anm_export_path = os.path.join(work_dir, "export.anm")
+	def setup_anm_export():
+		setup_anm()
+		import_anm()
+	def export_anm():
+		bpy.ops.export_anim.export_cm3d2_anm(filepath=anm_export_path, is_backup=False,
+			frame_start=bpy.context.scene.frame_start, frame_end=bpy.context.scene.frame_end, key_frame_count=key_count)
+	results.append(summarize('op.export_anm', measure(export_anm, repeat, setup=setup_anm_export), bones=len(anm.tracks), keys=key_count))
+	return results
+
+def git_revision():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(make_assets.ADDON_DIR), stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+# 前回の結果と比べて threshold 倍以上遅くなった項目のリストを返す
+def compare_reports(report, old_report, threshold):
+	old_results = {result['name']: result for result in old_report['results']}
+	slower = []
+	for result in report['results']:
+		old = old_results.get(result['name'])
+		if not old or not old['median']:
+			continue
+		ratio = result['median'] / old['median']
+		print("%-24s %10.4f -> %10.4f 秒 (x%.2f)" % (result['name'], old['median'], result['median'], ratio))
+		if threshold <= ratio:
+			slower.append(result['name'])
+	return slower
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+	parser = argparse.ArgumentParser(description="CM3D2 Converter のファイル読み書き/オペレーターの処理時間を計測します")
+	parser.add_argument('--preset', choices=sorted(make_assets.PRESETS), default='small')
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--assets', help="アセットの作成先 (省略時は一時フォルダ)")
+	parser.add_argument('--output', help="結果のJSONの書き出し先")
+	parser.add_argument('--compare', help="比較する前回の結果のJSON")
+	parser.add_argument('--threshold', type=float, default=1.2, help="この倍率以上遅くなったら失敗にする")
+	args = parser.parse_args(argv)
+
+	work_dir = tempfile.mkdtemp(prefix="cm3d2_bench_")
+	try:
+		paths, params = make_assets.make_assets(args.assets or work_dir, args.preset, args.seed)
+		results = run_codec_benchmarks(paths, args.repeat)
+		if bpy is not None:
+			results.extend(run_operator_benchmarks(paths, args.repeat, work_dir))
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+	report = {
+		'preset': args.preset,
+		'params': params,
+		'revision': git_revision(),
+		'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+		'python': platform.python_version(),
+		'numpy': numpy.__version__,
+		'blender': bpy.app.version_string if bpy is not None else None,
+		'platform': platform.platform(),
+		'results': results,
+		}
+	for result in results:
+		print("%-24s min %10.4f  median %10.4f 秒" % (result['name'], result['min'], result['median']))
+	if args.output:
+		with open(args.output, 'w', encoding='utf-8') as file:
+			json.dump(report, file, ensure_ascii=False, indent=1)
+
+	if args.compare:
+		with open(args.compare, 'r', encoding='utf-8') as file:
+			slower = compare_reports(report, json.load(file), args.threshold)
+		if slower:
+			print("遅くなった項目: " + ", ".join(slower))
+			return 1
+	return 0
+
+if __name__ == '__main__':
+	code = main()
+	if code:
+		sys.exit(code)
@@ -0,0 +1,82 @@
+# アーマチュアをまとめてインポートした2つのmodelが、それぞれ元のボーン情報でエクスポートされるかのテスト
+# Blender上でのみ実行します (それ以外ではスキップ):
+#   blender -b --factory-startup --python-expr "import sys, pytest; sys.exit(pytest.main(['tests']))"
+import os, sys, shutil, tempfile, types, unittest
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark"))
+import make_assets
+from make_assets import modelfile
+
+try:
+	import bpy
+except ImportError:
+	bpy = None
+
+# body と共通のボーンに髪のボーンを足し、髪のボーンだけをローカルボーンにした model
+def make_hair_model(body):
+	hair = make_assets.make_model_data(vertex_count=100, bone_count=len(body.bone_names), material_count=1, morph_count=0, seed=1)
+	hair.name = "hair"
+	extra_names = ["Hair_%02d" % index for index in range(5)]
+	hair.bone_names = list(body.bone_names) + extra_names
+	hair.bone_unknowns = numpy.concatenate((body.bone_unknowns, numpy.zeros(len(extra_names), dtype=numpy.uint8)))
+	hair.bone_parents = numpy.concatenate((body.bone_parents, numpy.zeros(len(extra_names), dtype=numpy.int32)))
+	hair.bone_cos = numpy.concatenate((body.bone_cos, numpy.full((len(extra_names), 3), 0.05, dtype=numpy.float32)))
+	hair.bone_rots = numpy.concatenate((body.bone_rots, numpy.tile(numpy.array([[1, 0, 0, 0]], dtype=numpy.float32), (len(extra_names), 1))))
+	hair.local_bone_names = extra_names
+	matrices = numpy.tile(numpy.identity(4, dtype=numpy.float32), (len(extra_names), 1, 1))
+	matrices[:, 3, 1] = numpy.arange(len(extra_names))
+	hair.local_bone_matrices = matrices
+	weights = hair.weights.copy()
+	weights['index'] %= len(extra_names)
+	hair.weights = weights
+	return hair
+
+@unittest.skipIf(bpy is None, "Blender上でのみ実行できます")
+class MergedArmatureTest(unittest.TestCase):
+	def setUp(self):
+		import addon_utils
+		addon_dir = os.path.dirname(make_assets.ADDON_DIR)
+		if addon_dir not in sys.path:
+			sys.path.insert(0, addon_dir)
+		addon_utils.enable(os.path.basename(make_assets.ADDON_DIR), default_set=True)
+		bpy.ops.wm.read_homefile(use_empty=True)
+		self.work_dir = tempfile.mkdtemp(prefix="cm3d2_test_")
+
+	def tearDown(self):
+		shutil.rmtree(self.work_dir, ignore_errors=True)
+
+	def test_each_mesh_exports_own_bone_data(self):
+		common = sys.modules[os.path.basename(make_assets.ADDON_DIR) + ".common"]
+		model_export = sys.modules[os.path.basename(make_assets.ADDON_DIR) + ".model_export"]
+
+		body = make_assets.make_model_data(vertex_count=200, bone_count=20, material_count=1, morph_count=0, seed=0)
+		body.name = "body"
+		hair = make_hair_model(body)
+		models = {'body': body, 'hair': hair}
+		for name, model in models.items():
+			with open(os.path.join(self.work_dir, name + ".model"), 'wb') as file:
+				modelfile.write_model(file, model)
+		bpy.ops.import_mesh.import_cm3d2_model(directory=self.work_dir, files=[{'name': "body.model"}, {'name': "hair.model"}], is_replace_cm3d2_tex=False)
+
+		armatures = [ob for ob in bpy.context.scene.objects if ob.type == 'ARMATURE']
+		self.assertEqual(len(armatures), 1)
+		bone_lines, local_bone_lines = common.get_bone_data_lines(armatures[0].data)
+		self.assertEqual(sorted(line.split(',')[0] for line in bone_lines), sorted(hair.bone_names))
+		self.assertEqual(sorted(line.split(',')[0] for line in local_bone_lines), sorted(body.local_bone_names + hair.local_bone_names))
+
+		settings = types.SimpleNamespace(scale=0.2, version=1000, is_arrange_name=True, is_convert_tris=True, is_normalize_weight=True, is_convert_bone_weight_names=True)
+		for ob in [ob for ob in bpy.context.scene.objects if ob.type == 'MESH']:
+			model = models[ob.name.split('.')[0]]
+			bpy.context.scene.objects.active = ob
+			bone_info_mode = model_export.get_bone_info_mode(bpy.context, ob)
+			self.assertEqual(bone_info_mode, 'OBJECT_PROPERTY')
+			exporter = model_export.batch_model_exporter(settings, bone_info_mode)
+			self.assertIsNone(exporter.precheck(bpy.context), exporter.messages)
+			result = exporter.collect_model(bpy.context, common.PhaseTimer("test"))
+			self.assertEqual(result.bone_names, model.bone_names)
+			self.assertEqual(result.local_bone_names, model.local_bone_names)
+			self.assertEqual(result.base_bone_name, model.base_bone_name)
+
+if __name__ == '__main__':
+	unittest.main()
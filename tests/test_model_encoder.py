@@ -0,0 +1,183 @@
+# modelfile.write_model と以前の struct.pack による書き出しが同じバイト列になるかのテスト
+#
+#   python -m pytest tests
+import os, io, sys, struct, unittest
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark"))
+import make_assets
+from make_assets import modelfile
+
+# 以前の common.write_str
+def legacy_write_str(file, raw_str):
+	b_str = format(len(raw_str.encode('utf-8')), 'b')
+	for i in range(9):
+		if 7 < len(b_str):
+			file.write(struct.pack('<B', int("1" + b_str[-7:], 2)))
+			b_str = b_str[:-7]
+		else:
+			file.write(struct.pack('<B', int(b_str, 2)))
+			break
+	file.write(raw_str.encode('utf-8'))
+
+# 以前の export_cm3d2_model.write_model と同じく1項目ずつ struct.pack で書き出す
+def legacy_write_model(file, model):
+	legacy_write_str(file, 'CM3D2_MESH')
+	file.write(struct.pack('<i', model.version))
+	legacy_write_str(file, model.name)
+	legacy_write_str(file, model.base_bone_name)
+
+	file.write(struct.pack('<i', len(model.bone_names)))
+	for name, unknown in zip(model.bone_names, model.bone_unknowns):
+		legacy_write_str(file, name)
+		file.write(struct.pack('<b', int(unknown)))
+	for parent in model.bone_parents:
+		file.write(struct.pack('<i', int(parent)))
+	for co, rot in zip(model.bone_cos, model.bone_rots):
+		file.write(struct.pack('<3f', co[0], co[1], co[2]))
+		file.write(struct.pack('<4f', rot[0], rot[1], rot[2], rot[3]))
+
+	file.write(struct.pack('<2i', len(model.vertices), len(model.face_indices)))
+
+	file.write(struct.pack('<i', len(model.local_bone_names)))
+	for name in model.local_bone_names:
+		legacy_write_str(file, name)
+	for matrix in model.local_bone_matrices:
+		for f in matrix.ravel():
+			file.write(struct.pack('<f', f))
+
+	for vert in model.vertices:
+		co, no, uv = vert['co'], vert['normal'], vert['uv']
+		file.write(struct.pack('<3f', co[0], co[1], co[2]))
+		file.write(struct.pack('<3f', no[0], no[1], no[2]))
+		file.write(struct.pack('<2f', uv[0], uv[1]))
+	file.write(struct.pack('<i', 0))
+	for weight in model.weights:
+		file.write(struct.pack('<4H', *weight['index']))
+		file.write(struct.pack('<4f', *weight['value']))
+
+	for indices in model.face_indices:
+		file.write(struct.pack('<i', len(indices)))
+		for face_index in indices:
+			file.write(struct.pack('<H', face_index))
+
+	file.write(struct.pack('<i', len(model.materials)))
+	for material in model.materials:
+		legacy_write_str(file, material['name1'])
+		legacy_write_str(file, material['name2'])
+		legacy_write_str(file, material['name3'])
+		for tex_data in material['data']:
+			legacy_write_str(file, tex_data['type'])
+			legacy_write_str(file, tex_data['name'])
+			if tex_data['type'] == 'tex':
+				legacy_write_str(file, tex_data['type2'])
+				if tex_data['type2'] == 'tex2d':
+					legacy_write_str(file, tex_data['name2'])
+					legacy_write_str(file, tex_data['path'])
+					col = tex_data['color']
+					file.write(struct.pack('<3f', col[0], col[1], col[2]))
+					file.write(struct.pack('<f', col[3]))
+			elif tex_data['type'] == 'col':
+				col = tex_data['color']
+				file.write(struct.pack('<3f', col[0], col[1], col[2]))
+				file.write(struct.pack('<f', col[3]))
+			elif tex_data['type'] == 'f':
+				file.write(struct.pack('<f', tex_data['float']))
+		legacy_write_str(file, 'end')
+
+	for name, morph in model.morphs:
+		legacy_write_str(file, 'morph')
+		legacy_write_str(file, name)
+		file.write(struct.pack('<i', len(morph)))
+		for item in morph:
+			vec, normal = item['co'], item['normal']
+			file.write(struct.pack('<H', item['index']))
+			file.write(struct.pack('<3f', vec[0], vec[1], vec[2]))
+			file.write(struct.pack('<3f', normal[0], normal[1], normal[2]))
+	legacy_write_str(file, 'end')
+
+# 以前の export_cm3d2_model.execute と同じく頂点毎に sorted で大きい順に4つのウェイトを選ぶ
+def legacy_top_weights(memberships, vertex_count):
+	indices = numpy.zeros((vertex_count, 4), dtype=numpy.int64)
+	values = numpy.zeros((vertex_count, 4), dtype=numpy.float32)
+	for vertex_index in range(vertex_count):
+		vgs = [[bone, value] for vertex, bone, value in memberships if vertex == vertex_index]
+		vgs = sorted(vgs, key=lambda vg: vg[1], reverse=True)[0:4]
+		for column, (bone, value) in enumerate(vgs):
+			indices[vertex_index, column] = bone
+			values[vertex_index, column] = value
+	return indices, values
+
+# 3〜7角形の面を並べたメッシュを三角面に分けてマテリアルに振り分けた ModelData
+def make_ngon_model(seed=0):
+	random = numpy.random.RandomState(seed)
+	model = make_assets.make_model_data(vertex_count=300, bone_count=12, material_count=1, morph_count=0, seed=seed)
+	loop_totals = random.randint(3, 8, 40)
+	loop_starts = numpy.cumsum(loop_totals) - loop_totals
+	loop_vertex_indices = random.randint(0, len(model.vertices), loop_totals.sum())
+	quad_diagonals = random.rand(len(loop_totals)) < 0.5
+	tri_loops, tri_faces = modelfile.triangulate_faces(loop_starts, loop_totals, quad_diagonals)
+	tri_indices = loop_vertex_indices[tri_loops]
+	material_indices = tri_faces % 3
+	model.face_indices = [tri_indices[material_indices == index].ravel().astype(numpy.uint16) for index in range(3)]
+	model.materials = [make_assets.make_material(index) for index in range(3)]
+	# テクスチャ無しの tex
+	model.materials[1]['data'].append({'type': 'tex', 'name': "_ShadowTex", 'type2': 'null'})
+	model.morphs.append(("ngon_morph", modelfile.build_morph_array(
+		numpy.arange(0, len(model.vertices), 7),
+		random.normal(size=(len(range(0, len(model.vertices), 7)), 3)),
+		random.normal(size=(len(range(0, len(model.vertices), 7)), 3)))))
+	return model
+
+class ModelEncoderTest(unittest.TestCase):
+
+	def assert_same_bytes(self, model):
+		legacy = io.BytesIO()
+		legacy_write_model(legacy, model)
+		current = io.BytesIO()
+		modelfile.write_model(current, model)
+		self.assertEqual(legacy.getvalue(), current.getvalue())
+
+	def test_morphs_and_materials(self):
+		self.assert_same_bytes(make_assets.make_model_data(vertex_count=500, bone_count=20, material_count=4, morph_count=5, morph_size=60, seed=1))
+
+	def test_ngons(self):
+		self.assert_same_bytes(make_ngon_model())
+
+	def test_material_entries(self):
+		model = make_ngon_model(seed=2)
+		types = set(tex_data['type'] for material in model.materials for tex_data in material['data'])
+		self.assertEqual(types, {'tex', 'col', 'f'})
+		self.assert_same_bytes(model)
+
+	def test_long_names(self):
+		model = make_assets.make_model_data(vertex_count=50, bone_count=3, material_count=1, morph_count=1, morph_size=5)
+		model.name = "長い名前" * 40
+		model.morphs[0] = ("モーフ" * 50, model.morphs[0][1])
+		self.assert_same_bytes(model)
+
+	def test_tied_weights(self):
+		# 5つ以上の割り当てで4番目と5番目が同じ値になる頂点を多く含む
+		random = numpy.random.RandomState(4)
+		vertex_count = 200
+		memberships = []
+		for vertex_index in range(vertex_count):
+			bones = random.choice(12, random.randint(1, 8), replace=False)
+			for bone in bones:
+				memberships.append((vertex_index, int(bone), float(numpy.float32(random.choice([0.125, 0.25, 0.5])))))
+		vertex_indices, bone_indices, values = (numpy.array(column) for column in zip(*memberships))
+		indices, weights = modelfile.top_weights(vertex_indices, bone_indices, values, vertex_count)
+		legacy_indices, legacy_weights = legacy_top_weights(memberships, vertex_count)
+		numpy.testing.assert_array_equal(indices, legacy_indices)
+		numpy.testing.assert_array_equal(weights, legacy_weights)
+
+	def test_round_trip(self):
+		model = make_ngon_model(seed=3)
+		data = io.BytesIO()
+		modelfile.write_model(data, model)
+		again = io.BytesIO()
+		modelfile.write_model(again, modelfile.read_model(io.BytesIO(data.getvalue())))
+		self.assertEqual(data.getvalue(), again.getvalue())
+
+if __name__ == '__main__':
+	unittest.main()